@@ -0,0 +1,229 @@
+# Benchmarks for reading sources, merging spans and rendering reports.
+#
+#   python -m benchmarks run --output before.json
+#   python -m benchmarks run --output after.json
+#   python -m benchmarks compare before.json after.json --threshold 0.1
+#   python -m benchmarks overhead --quick --threshold 0.02
+#
+# `run --quick` limits the sweep to small sources and label counts, and `--filter`
+# selects benchmarks by a substring of their id, such as `report[` or `size=1024,`.
+# `compare` exits with status 1 if any benchmark got slower by more than the
+# threshold. `overhead` times each benchmark against its `/unmeasured` baseline, in
+# alternating rounds, and exits with status 1 if any is slower than its baseline by
+# more than the threshold. `report/unmeasured` renders without ever looking up an
+# active instrumentation, so `report` is only slower by the cost of `measure`
+# without one.
+import argparse
+import json
+import platform
+import sys
+import timeit
+from datetime import UTC, datetime
+from importlib.metadata import version
+from pathlib import Path
+from typing import Any
+
+from benchmarks.cases import MB, Benchmark, Limits, benchmarks
+
+QUICK_LIMITS = Limits(max_source_size=MB, max_labels=100, max_cause_depth=16)
+# Suffix of the name of the baseline of a benchmark, see `overhead`
+UNMEASURED = "/unmeasured"
+
+
+def time_benchmark(benchmark: Benchmark, repeat: int) -> dict[str, Any]:
+    with benchmark.context():
+        timer = timeit.Timer(benchmark.setup())
+        number, _ = timer.autorange()
+        times = [time / number for time in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "name": benchmark.name,
+        "params": benchmark.params,
+        "number": number,
+        "best": min(times),
+        "times": times,
+    }
+
+
+def run(args: argparse.Namespace) -> int:
+    limits = QUICK_LIMITS if args.quick else Limits()
+    if args.max_source_size is not None:
+        limits = Limits(args.max_source_size, limits.max_labels, limits.max_cause_depth)
+    if args.max_labels is not None:
+        limits = Limits(limits.max_source_size, args.max_labels, limits.max_cause_depth)
+
+    results: dict[str, dict[str, Any]] = {}
+    for benchmark in benchmarks(limits):
+        if args.filter and not any(part in benchmark.id for part in args.filter):
+            continue
+        result = time_benchmark(benchmark, args.repeat)
+        results[benchmark.id] = result
+        print(f"{benchmark.id:<50} {format_time(result['best']):>10}", file=sys.stderr)
+
+    report = {
+        "metadata": {
+            "date": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "pyagnostics": version("pyagnostics"),
+            "rich": version("rich"),
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output + "\n")
+    return 0
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def compare(args: argparse.Namespace) -> int:
+    base = json.loads(args.base.read_text())["results"]
+    new = json.loads(args.new.read_text())["results"]
+
+    # Keep the order of the sweep, rather than sorting ids like `size=10240` first
+    common = [benchmark_id for benchmark_id in base if benchmark_id in new]
+    only_base = [benchmark_id for benchmark_id in base if benchmark_id not in new]
+    only_new = [benchmark_id for benchmark_id in new if benchmark_id not in base]
+
+    slower = 0
+    for benchmark_id in common:
+        base_time, new_time = base[benchmark_id]["best"], new[benchmark_id]["best"]
+        change = new_time / base_time - 1
+        if change > args.threshold:
+            marker = "SLOWER"
+            slower += 1
+        elif change < -args.threshold:
+            marker = "faster"
+        else:
+            marker = ""
+        print(
+            f"{benchmark_id:<50} {format_time(base_time):>10} "
+            f"{format_time(new_time):>10} {change:>+8.1%} {marker}"
+        )
+
+    for benchmark_id in only_base:
+        print(f"{benchmark_id:<50} only in {args.base}")
+    for benchmark_id in only_new:
+        print(f"{benchmark_id:<50} only in {args.new}")
+
+    if slower:
+        print(
+            f"{slower} benchmarks got slower by more than {args.threshold:.0%}",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+# Time `benchmark` and its `baseline` in alternating rounds, so that both see the
+# same noise, and return the best time of each
+def time_pair(
+    benchmark: Benchmark, baseline: Benchmark, repeat: int
+) -> tuple[float, float]:
+    timer = timeit.Timer(benchmark.setup())
+    with baseline.context():
+        baseline_timer = timeit.Timer(baseline.setup())
+    number, _ = timer.autorange()
+    best = baseline_best = float("inf")
+    for _ in range(repeat):
+        best = min(best, timer.timeit(number) / number)
+        with baseline.context():
+            baseline_best = min(baseline_best, baseline_timer.timeit(number) / number)
+    return best, baseline_best
+
+
+def overhead(args: argparse.Namespace) -> int:
+    sweep = {
+        benchmark.id: benchmark
+        for benchmark in benchmarks(QUICK_LIMITS if args.quick else Limits())
+    }
+
+    over = 0
+    for baseline in sweep.values():
+        if not baseline.name.endswith(UNMEASURED):
+            continue
+        benchmark = sweep.get(baseline.id.replace(f"{UNMEASURED}[", "[", 1))
+        if benchmark is None or (
+            args.filter and not any(part in benchmark.id for part in args.filter)
+        ):
+            continue
+        new_time, base_time = time_pair(benchmark, baseline, args.repeat)
+        change = new_time / base_time - 1
+        marker = ""
+        if change > args.threshold:
+            marker = "OVER"
+            over += 1
+        print(
+            f"{benchmark.id:<50} {format_time(base_time):>10} "
+            f"{format_time(new_time):>10} {change:>+8.1%} {marker}"
+        )
+
+    if over:
+        print(
+            f"{over} benchmarks cost more than {args.threshold:.0%} over their "
+            "unmeasured baseline",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    subparsers = parser.add_subparsers(required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.set_defaults(command=run)
+    run_parser.add_argument("--output", "-o", type=Path, help="write results here")
+    run_parser.add_argument(
+        "--filter", "-k", action="append", help="only run ids containing this"
+    )
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--quick", action="store_true", help="small inputs only")
+    run_parser.add_argument("--max-source-size", type=int)
+    run_parser.add_argument("--max-labels", type=int)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two runs")
+    compare_parser.set_defaults(command=compare)
+    compare_parser.add_argument("base", type=Path)
+    compare_parser.add_argument("new", type=Path)
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown to flag, 0.1 is 10%% (default)",
+    )
+
+    overhead_parser = subparsers.add_parser(
+        "overhead", help="compare benchmarks to their unmeasured baseline"
+    )
+    overhead_parser.set_defaults(command=overhead)
+    overhead_parser.add_argument(
+        "--filter", "-k", action="append", help="only run ids containing this"
+    )
+    overhead_parser.add_argument("--repeat", type=int, default=20)
+    overhead_parser.add_argument(
+        "--quick", action="store_true", help="small inputs only"
+    )
+    overhead_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.02,
+        help="relative cost to flag, 0.02 is 2%% (default)",
+    )
+
+    args = parser.parse_args()
+    return args.command(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
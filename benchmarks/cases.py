@@ -0,0 +1,340 @@
+import io
+import random
+import subprocess
+import sys
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from functools import partial
+
+from rich.console import Console, RenderableType
+from rich.text import Text
+
+from pyagnostics import report, snippets, source
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.instrument import Instrumentation, Phase
+from pyagnostics.report import LabeledSourceBlock, Report
+from pyagnostics.source import InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan, SpanSet, Utf8Index
+
+KB = 1024
+MB = 1024 * KB
+
+SOURCE_SIZES = [KB, 10 * KB, 100 * KB, MB, 10 * MB, 100 * MB]
+LABEL_COUNTS = [1, 10, 100, 1_000, 10_000]
+CAUSE_DEPTHS = [1, 4, 16, 64]
+RECURSION_DEPTHS = [10, 100, 900]
+WIDTHS = [40, 80, 200]
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    params: dict[str, int]
+    # Prepares the inputs outside of the timed code, and returns the timed code
+    setup: Callable[[], Callable[[], object]] = field(compare=False)
+    # Entered around the setup and the timing
+    context: Callable[[], AbstractContextManager[object]] = field(
+        default=nullcontext, compare=False
+    )
+
+    @property
+    def id(self: "Benchmark") -> str:
+        params = ",".join(f"{key}={value}" for key, value in self.params.items())
+        return f"{self.name}[{params}]"
+
+
+@dataclass(frozen=True)
+class Limits:
+    max_source_size: int = 100 * MB
+    max_labels: int = 10_000
+    max_cause_depth: int = 64
+
+
+def make_source_code(size: int) -> str:
+    line_template = "let value_{} = compute(value_{}, 42) + offset;\n"
+    lines: list[str] = []
+    length = 0
+    i = 0
+    while length < size:
+        line = line_template.format(i, i - 1)
+        lines.append(line)
+        length += len(line)
+        i += 1
+    return "".join(lines)[:size]
+
+
+def make_spans(count: int, source_len: int, seed: int = 0) -> list[SourceSpan]:
+    rng = random.Random(seed)
+    source_id = SourceId()
+    spans = []
+    for _ in range(count):
+        start = rng.randrange(max(1, source_len - 20))
+        spans.append(SourceSpan(start, start + rng.randint(1, 20), source_id))
+    return spans
+
+
+# A source with one line per label, and a label on every line
+def make_labeled_source(labels: int) -> tuple[str, list[LabeledSpan]]:
+    source_code = make_source_code(labels * 50)
+    source_id = SourceId()
+    labeled_spans = []
+    start = 0
+    for i, line in enumerate(source_code.splitlines(keepends=True)[:labels]):
+        labeled_spans.append(
+            LabeledSpan(SourceSpan(start + 4, start + 11, source_id), f"label {i}")
+        )
+        start += len(line)
+    return source_code, labeled_spans
+
+
+def make_labeled_error(labels: int) -> DiagnosticError:
+    source_code, labeled_spans = make_labeled_source(labels)
+    source_id = labeled_spans[0].source_id
+    return DiagnosticError(
+        code="bench::labels",
+        message="A diagnostic with many labels",
+        labels=labeled_spans,
+        notes=["[blue]help:[/blue] this is a note"],
+    ).add_source(source_id, InMemorySource(source_code, name="bench.src"))
+
+
+def make_cause_chain(depth: int) -> DiagnosticError:
+    def raise_chain(level: int) -> None:
+        if level == 0:
+            raise ValueError("the root cause")
+        try:
+            raise_chain(level - 1)
+        except Exception as e:
+            raise DiagnosticError(
+                code=f"bench::cause::{level}", message=f"level {level}"
+            ) from e
+
+    try:
+        raise_chain(depth)
+    except DiagnosticError as e:
+        return e
+    raise AssertionError("unreachable")
+
+
+def make_recursion(depth: int) -> DiagnosticError:
+    def recurse(level: int) -> None:
+        if level == 0:
+            raise DiagnosticError(code="bench::recursion", message="the bottom")
+        recurse(level - 1)
+
+    try:
+        recurse(depth)
+    except DiagnosticError as e:
+        return e
+    raise AssertionError("unreachable")
+
+
+def render(renderable: RenderableType, width: int) -> str:
+    output = io.StringIO()
+    console = Console(
+        file=output, width=width, color_system="truecolor", force_terminal=True
+    )
+    console.print(renderable)
+    return output.getvalue()
+
+
+def _read_span_cold(size: int) -> Callable[[], object]:
+    source_code = make_source_code(size)
+    span = SourceSpan(size // 2, size // 2 + 10, SourceId())
+    return lambda: InMemorySource(source_code).read_span(span, 2, 2)
+
+
+def _read_span_warm(size: int) -> Callable[[], object]:
+    source = InMemorySource(make_source_code(size))
+    span = SourceSpan(size // 2, size // 2 + 10, SourceId())
+    source.read_span(span)
+    return lambda: source.read_span(span, 2, 2)
+
+
+def _union(labels: int) -> Callable[[], object]:
+    spans = make_spans(labels, labels * 50)
+    return lambda: SourceSpan.union(spans)
+
+
+def _span_set_add(labels: int) -> Callable[[], object]:
+    spans = make_spans(labels, labels * 50)
+
+    def add() -> SpanSet:
+        span_set = SpanSet()
+        for span in spans:
+            span_set.add(span)
+        return span_set
+
+    return add
+
+
+# Disjoint spans added from the last to the first, each of which lands before
+# every span added so far, and queried once they are all added
+def _span_set_add_unsorted(labels: int) -> Callable[[], object]:
+    source_id = SourceId()
+    spans = [
+        SourceSpan(start, start + 10, source_id) for start in range(0, labels * 50, 50)
+    ]
+    spans.reverse()
+
+    def add() -> object:
+        span_set = SpanSet()
+        for span in spans:
+            span_set.add(span)
+        return span_set.contains(spans[0])
+
+    return add
+
+
+def _from_byte_range(labels: int) -> Callable[[], object]:
+    # Not only ASCII, so that offsets are translated through the checkpoints
+    source_code = make_source_code(MB).replace("offset", "décalage")
+    spans = make_spans(labels, len(source_code))
+    index = Utf8Index(source_code)
+    byte_ranges = [span.byte_range(index) for span in spans]
+    source_id = spans[0].source_id
+
+    def from_byte_ranges() -> object:
+        index = Utf8Index(source_code)
+        return [
+            SourceSpan.from_byte_range(start, end, source_id, index)
+            for start, end in byte_ranges
+        ]
+
+    return from_byte_ranges
+
+
+def _labeled_source_block(labels: int, width: int) -> Callable[[], object]:
+    source_code, labeled_spans = make_labeled_source(labels)
+    return lambda: render(
+        LabeledSourceBlock(Text(source_code), labels=labeled_spans), width
+    )
+
+
+def _report(labels: int, width: int) -> Callable[[], object]:
+    error = make_labeled_error(labels)
+    return lambda: render(Report(error), width)
+
+
+def _report_instrumented(labels: int, width: int) -> Callable[[], object]:
+    error = make_labeled_error(labels)
+    instrumentation = Instrumentation()
+    return lambda: render(Report(error, instrumentation=instrumentation), width)
+
+
+# Modules which measure the phases of rendering, see `pyagnostics.instrument`
+MEASURED_MODULES = [report, snippets, source]
+_NULL_CONTEXT: AbstractContextManager[None] = nullcontext()
+
+
+def _null_measure(_phase: Phase) -> AbstractContextManager[None]:
+    return _NULL_CONTEXT
+
+
+# Replace `measure` with one which never looks up the active instrumentation, as
+# the baseline `report/unmeasured` for the cost of `measure` without one. See the
+# `overhead` command.
+@contextmanager
+def unmeasured() -> Iterator[None]:
+    measures = [module.measure for module in MEASURED_MODULES]
+    for module in MEASURED_MODULES:
+        module.measure = _null_measure  # type: ignore[attr-defined]
+    try:
+        yield
+    finally:
+        for module, measure in zip(MEASURED_MODULES, measures, strict=True):
+            module.measure = measure  # type: ignore[attr-defined]
+
+
+def _report_cached(labels: int, width: int) -> Callable[[], object]:
+    error = make_labeled_error(labels)
+    render(error, width)
+    return lambda: render(error, width)
+
+
+def _report_causes(depth: int, width: int) -> Callable[[], object]:
+    error = make_cause_chain(depth)
+    return lambda: render(Report(error), width)
+
+
+def _report_recursion(depth: int) -> Callable[[], object]:
+    error = make_recursion(depth)
+    return lambda: render(Report(error), 80)
+
+
+# Importing is timed in a fresh interpreter, including its own startup, which the
+# `import/python` baseline measures on its own.
+IMPORTS = {
+    "python": "pass",
+    "exceptions": "import pyagnostics.exceptions",
+    "report": "import pyagnostics.report",
+}
+
+
+def _import(code: str) -> Callable[[], object]:
+    return lambda: subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def benchmarks(limits: Limits) -> Iterator[Benchmark]:
+    for name, code in IMPORTS.items():
+        yield Benchmark(f"import/{name}", {}, partial(_import, code))
+
+    sizes = [size for size in SOURCE_SIZES if size <= limits.max_source_size]
+    label_counts = [count for count in LABEL_COUNTS if count <= limits.max_labels]
+    depths = [depth for depth in CAUSE_DEPTHS if depth <= limits.max_cause_depth]
+
+    for size in sizes:
+        yield Benchmark(
+            "read_span/cold", {"size": size}, partial(_read_span_cold, size)
+        )
+        yield Benchmark(
+            "read_span/warm", {"size": size}, partial(_read_span_warm, size)
+        )
+    for labels in label_counts:
+        yield Benchmark("union", {"labels": labels}, partial(_union, labels))
+        yield Benchmark(
+            "span_set/add", {"labels": labels}, partial(_span_set_add, labels)
+        )
+        yield Benchmark(
+            "span_set/add_unsorted",
+            {"labels": labels},
+            partial(_span_set_add_unsorted, labels),
+        )
+        yield Benchmark(
+            "from_byte_range", {"labels": labels}, partial(_from_byte_range, labels)
+        )
+    for labels in label_counts:
+        for width in WIDTHS:
+            params = {"labels": labels, "width": width}
+            yield Benchmark(
+                "labeled_source_block",
+                params,
+                partial(_labeled_source_block, labels, width),
+            )
+            yield Benchmark("report", params, partial(_report, labels, width))
+            yield Benchmark(
+                "report/unmeasured",
+                params,
+                partial(_report, labels, width),
+                unmeasured,
+            )
+            yield Benchmark(
+                "report/instrumented",
+                params,
+                partial(_report_instrumented, labels, width),
+            )
+            yield Benchmark(
+                "report/cached", params, partial(_report_cached, labels, width)
+            )
+    for depth in depths:
+        for width in WIDTHS:
+            yield Benchmark(
+                "report/causes",
+                {"depth": depth, "width": width},
+                partial(_report_causes, depth, width),
+            )
+    for depth in RECURSION_DEPTHS:
+        yield Benchmark(
+            "report/recursion", {"depth": depth}, partial(_report_recursion, depth)
+        )
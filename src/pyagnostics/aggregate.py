@@ -0,0 +1,155 @@
+import dataclasses
+from collections.abc import Hashable, Iterable
+from dataclasses import dataclass, field
+from typing import Self, cast
+
+from rich.console import RenderableType
+from rich.markup import escape
+
+from pyagnostics.exceptions import DiagnosticError, DiagnosticErrorGroup
+from pyagnostics.plain import plain_text
+from pyagnostics.protocols import Diagnostic, SourceMap
+from pyagnostics.severity import Severity
+from pyagnostics.source import span_location
+from pyagnostics.spans import SourceId, SourceSpan
+
+
+def _text_key(renderable: RenderableType | None) -> Hashable:
+    if renderable is None or isinstance(renderable, str):
+        return renderable
+    return plain_text(renderable)
+
+
+# Key under which duplicate diagnostics are folded together: the same code,
+# severity, message and label texts on the same sources. The label spans are not
+# part of the key, they are the locations of each occurrence.
+def diagnostic_key(
+    diagnostic: Diagnostic,
+) -> tuple[Hashable, Severity, Hashable, tuple[tuple[Hashable, SourceId], ...]]:
+    return (
+        _text_key(diagnostic.code),
+        diagnostic.severity,
+        _text_key(diagnostic.message),
+        tuple((_text_key(label.label), label.source_id) for label in diagnostic.labels),
+    )
+
+
+@dataclass
+class Occurrences:
+    # The first occurrence of the diagnostic
+    diagnostic: Diagnostic
+    count: int = 1
+    # The label spans of every occurrence which are not those of the first one
+    other_locations: list[tuple[SourceSpan, ...]] = field(default_factory=list)
+
+    def _format_location(self: Self, spans: tuple[SourceSpan, ...]) -> str:
+        span = spans[0]
+        resolved = (
+            self.diagnostic.get_source(span.source_id)
+            if isinstance(self.diagnostic, SourceMap)
+            else None
+        )
+        if resolved is None:
+            return f"{span.start}..{span.end}"
+        source_code, _highlighter = resolved
+        name, line, column = span_location(source_code, span)
+        name = escape(name) if name else name
+        return f"{name}:{line}:{column + 1}" if name else f"{line}:{column + 1}"
+
+    # The first occurrence, with a note of the other occurrences when there are any
+    def to_diagnostic_error(self: Self, max_locations: int = 10) -> DiagnosticError:
+        error = DiagnosticError.from_diagnostic(self.diagnostic)
+        if self.count == 1:
+            return error
+
+        note = f"[blue]note:[/blue] occurred {self.count} times"
+        if self.other_locations:
+            locations = [
+                self._format_location(spans)
+                for spans in self.other_locations[:max_locations]
+            ]
+            note += f", also at {', '.join(locations)}"
+            if len(self.other_locations) > max_locations:
+                note += f" and {len(self.other_locations) - max_locations} more"
+
+        folded = dataclasses.replace(
+            error,
+            labels=list(error.labels),
+            notes=[*error.notes, note],
+            context=list(error.context),
+            source_map=dict(error.source_map),
+        )
+        folded.__cause__ = error.__cause__
+        folded.__context__ = error.__context__
+        folded.__suppress_context__ = error.__suppress_context__
+        folded.__traceback__ = error.__traceback__
+        folded._source_scope = error._source_scope
+        return folded
+
+
+# Group duplicate diagnostics by `diagnostic_key`, in order of first occurrence
+def group_duplicates(diagnostics: Iterable[Diagnostic]) -> list[Occurrences]:
+    groups: dict[Hashable, Occurrences] = {}
+    seen_locations: dict[Hashable, set[tuple[SourceSpan, ...]]] = {}
+    for diagnostic in diagnostics:
+        key = diagnostic_key(diagnostic)
+        spans = tuple(label.span for label in diagnostic.labels)
+        occurrences = groups.get(key)
+        if occurrences is None:
+            groups[key] = Occurrences(diagnostic)
+            seen_locations[key] = {spans}
+            continue
+        occurrences.count += 1
+        if spans and spans not in seen_locations[key]:
+            seen_locations[key].add(spans)
+            occurrences.other_locations.append(spans)
+    return list(groups.values())
+
+
+# Fold duplicate diagnostics into a single `DiagnosticError` each, noting how many
+# times they occurred and where else.
+def fold_duplicates(
+    diagnostics: Iterable[Diagnostic], max_locations: int = 10
+) -> list[DiagnosticError]:
+    return [
+        occurrences.to_diagnostic_error(max_locations)
+        for occurrences in group_duplicates(diagnostics)
+    ]
+
+
+# Fold duplicate diagnostics within `group`, and within any groups nested in it.
+# Each folded diagnostic takes the place of its first occurrence, and nested groups
+# keep theirs.
+def fold_duplicate_errors(
+    group: DiagnosticErrorGroup, max_locations: int = 10
+) -> DiagnosticErrorGroup:
+    firsts = {
+        id(occurrences.diagnostic): occurrences.to_diagnostic_error(max_locations)
+        for occurrences in group_duplicates(
+            exception
+            for exception in group.exceptions
+            if isinstance(exception, DiagnosticError)
+        )
+    }
+    exceptions: list[DiagnosticError | ExceptionGroup[DiagnosticError]] = []
+    for exception in group.exceptions:
+        if isinstance(exception, DiagnosticError):
+            error = firsts.pop(id(exception), None)
+            if error is not None:
+                exceptions.append(error)
+        elif isinstance(exception, DiagnosticErrorGroup):
+            exceptions.append(fold_duplicate_errors(exception, max_locations))
+        else:
+            exceptions.append(exception)
+    # Nested groups are typed as `ExceptionGroup` by `ExceptionGroup.exceptions`, but
+    # are accepted by its constructor all the same
+    folded = DiagnosticErrorGroup(
+        group.message, cast(list[DiagnosticError], exceptions)
+    )
+    for source_id, (source_code, highlighter) in group.source_map.items():
+        folded.add_source(source_id, source_code, highlighter)
+    folded.__cause__ = group.__cause__
+    folded.__context__ = group.__context__
+    folded.__suppress_context__ = group.__suppress_context__
+    folded.__traceback__ = group.__traceback__
+    return folded
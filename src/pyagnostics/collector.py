@@ -0,0 +1,177 @@
+import tempfile
+from array import array
+from collections import Counter, deque
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import dataclass, field
+from enum import StrEnum, auto
+from pathlib import Path
+from threading import Lock
+from typing import IO, Self
+
+from pyagnostics.exceptions import DiagnosticError, DiagnosticErrorGroup
+from pyagnostics.protocols import Diagnostic
+from pyagnostics.severity import Severity
+
+
+class OverflowPolicy(StrEnum):
+    # Drop the oldest diagnostics to make room for new ones
+    DROP_OLDEST = auto()
+    # Keep the first diagnostics, and only count any further ones
+    COUNT_ONLY = auto()
+    # Move the oldest diagnostics to a temporary file to make room for new ones
+    SPILL = auto()
+
+
+# Collects diagnostics without raising them, counting them per severity.
+#
+# At most `max_diagnostics` diagnostics are kept in memory, beyond which the
+# `overflow` policy applies. Diagnostics which are not kept are still counted, and
+# reported by `dropped`. Spilled diagnostics are written in their wire form, see
+# `pyagnostics.wire`, so that of their sources only the windows their reports show
+# are kept, and are read back as the `DiagnosticError`s `from_wire` decodes.
+#
+# All methods are safe to call from many threads at once.
+@dataclass
+class DiagnosticCollector:
+    max_diagnostics: int | None = None
+    overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST
+    # Directory of the spill file, defaults to the system temporary directory
+    spill_dir: Path | None = None
+
+    _diagnostics: deque[Diagnostic] = field(
+        default_factory=deque, init=False, repr=False
+    )
+    _counts: Counter[Severity] = field(default_factory=Counter, init=False, repr=False)
+    _dropped: int = field(default=0, init=False, repr=False)
+    _spill_file: IO[bytes] | None = field(default=None, init=False, repr=False)
+    # Start offset of every spilled diagnostic, followed by the end of the file
+    _spill_offsets: "array[int]" = field(
+        default_factory=lambda: array("q", [0]), init=False, repr=False
+    )
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False)
+
+    def __enter__(self: Self) -> Self:
+        return self
+
+    def __exit__(self: Self, *_exc_info: object) -> None:
+        self.close()
+
+    def close(self: Self) -> None:
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+                self._spill_offsets = array("q", [0])
+
+    def _spill(self: Self, diagnostic: Diagnostic) -> None:
+        from pyagnostics.wire import to_wire  # noqa: PLC0415
+
+        data = to_wire(diagnostic)
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(dir=self.spill_dir)  # noqa: SIM115
+        self._spill_file.seek(self._spill_offsets[-1])
+        self._spill_file.write(data)
+        self._spill_offsets.append(self._spill_offsets[-1] + len(data))
+
+    def push(self: Self, diagnostic: Diagnostic) -> None:
+        with self._lock:
+            self._counts[diagnostic.severity] += 1
+            if (
+                self.max_diagnostics is None
+                or len(self._diagnostics) < self.max_diagnostics
+            ):
+                self._diagnostics.append(diagnostic)
+                return
+
+            match self.overflow:
+                case OverflowPolicy.COUNT_ONLY:
+                    self._dropped += 1
+                case OverflowPolicy.DROP_OLDEST:
+                    self._diagnostics.append(diagnostic)
+                    if len(self._diagnostics) > self.max_diagnostics:
+                        self._diagnostics.popleft()
+                        self._dropped += 1
+                case OverflowPolicy.SPILL:
+                    self._diagnostics.append(diagnostic)
+                    if len(self._diagnostics) > self.max_diagnostics:
+                        self._spill(self._diagnostics.popleft())
+                case _:
+                    raise ValueError(f"Unknown overflow policy: {self.overflow!r}")
+
+    def extend(self: Self, diagnostics: Iterable[Diagnostic]) -> None:
+        for diagnostic in diagnostics:
+            self.push(diagnostic)
+
+    @property
+    def counts(self: Self) -> Mapping[Severity, int]:
+        with self._lock:
+            return {severity: self._counts[severity] for severity in Severity}
+
+    def count(self: Self, severity: Severity | None = None) -> int:
+        with self._lock:
+            if severity is None:
+                return self._counts.total()
+            return self._counts[severity]
+
+    @property
+    def dropped(self: Self) -> int:
+        with self._lock:
+            return self._dropped
+
+    @property
+    def has_errors(self: Self) -> bool:
+        return self.count(Severity.ERROR) > 0
+
+    def __len__(self: Self) -> int:
+        with self._lock:
+            return len(self._spill_offsets) - 1 + len(self._diagnostics)
+
+    def _read_spilled(self: Self, index: int) -> bytes | None:
+        with self._lock:
+            if self._spill_file is None or index >= len(self._spill_offsets) - 1:
+                return None
+            start, end = self._spill_offsets[index], self._spill_offsets[index + 1]
+            self._spill_file.seek(start)
+            return self._spill_file.read(end - start)
+
+    # Iterate over the kept diagnostics, oldest first, including spilled ones
+    def __iter__(self: Self) -> Iterator[Diagnostic]:
+        from pyagnostics.wire import from_wire  # noqa: PLC0415
+
+        with self._lock:
+            diagnostics = list(self._diagnostics)
+            spilled = len(self._spill_offsets) - 1
+
+        for index in range(spilled):
+            data = self._read_spilled(index)
+            if data is None:
+                break
+            yield from_wire(data)
+        yield from diagnostics
+
+    # Convert the kept diagnostics into a `DiagnosticErrorGroup`, but only if any
+    # errors were collected.
+    def into_error_group(
+        self: Self, message: str = "Collected diagnostics"
+    ) -> DiagnosticErrorGroup | None:
+        if not self.has_errors:
+            return None
+
+        exceptions = [
+            DiagnosticError.from_diagnostic(diagnostic) for diagnostic in self
+        ]
+        counts = self.counts
+        dropped = self.dropped
+        if dropped:
+            exceptions.append(
+                DiagnosticError(
+                    severity=Severity.ERROR,
+                    message=(
+                        f"{dropped} diagnostics were dropped "
+                        f"({counts[Severity.ERROR]} errors, "
+                        f"{counts[Severity.WARNING]} warnings and "
+                        f"{counts[Severity.ADVICE]} advice in total)"
+                    ),
+                )
+            )
+        return DiagnosticErrorGroup(message, exceptions)
@@ -1,53 +1,130 @@
 import dataclasses
-from collections.abc import MutableSequence
+from collections.abc import Iterable, Sequence
 from dataclasses import dataclass
 from pathlib import Path
 from types import ModuleType
-from typing import TYPE_CHECKING, Self, cast
-
-from rich.abc import RichRenderable
-from rich.console import Group, RenderableType, RichCast
+from typing import TYPE_CHECKING, Any, Self, cast
 
+from pyagnostics.frames import FrameMatcher
+from pyagnostics.lazy import lazy_if_callable
 from pyagnostics.protocols import (
     Diagnostic,
     SourceCode,
     SourceCodeHighlighter,
     SourceMap,
 )
-from pyagnostics.report import Report
+from pyagnostics.registry import source_registry
+from pyagnostics.scope import SourceScope, current_source_scope
 from pyagnostics.severity import Severity
 from pyagnostics.spans import LabeledSpan, SourceId
 
-_suppressed_frame_paths: MutableSequence[str] = []
+# The rendering modules, and rich along with them, are only imported once a
+# diagnostic is rendered, so that defining and raising diagnostics stays cheap.
+if TYPE_CHECKING:
+    from rich.console import RenderableType
+
+    from pyagnostics.report import RenderCache
+    from pyagnostics.snippets import RenderLimits
 
+_suppressed_frames = FrameMatcher()
 
-def supress_diagnostic_frames(*modules: str | ModuleType) -> None:
+
+# Hide frames from reports. Strings are path prefixes, and modules hide their whole
+# package directory. Path globs and module names or globs are given separately, see
+# `FrameMatcher`.
+def supress_diagnostic_frames(
+    *modules: str | ModuleType,
+    path_globs: Iterable[str] = (),
+    module_names: Iterable[str] = (),
+) -> None:
+    prefixes: list[str] = []
     for module in modules:
         match module:
             case str() as module:
-                _suppressed_frame_paths.append(module)
+                prefixes.append(module)
             case ModuleType() as module if module.__file__ is not None:
-                _suppressed_frame_paths.append(
-                    str(Path(module.__file__).parent.resolve())
-                )
+                prefixes.append(str(Path(module.__file__).parent.resolve()))
             case _:
                 raise ValueError(f"Unsupported module type: {module}")
+    _suppressed_frames.add(*prefixes, path_globs=path_globs, modules=module_names)
+
+
+# `values`, with any callables wrapped in `Lazy`. Without any, `values` itself.
+def _lazy_items(values: list[Any]) -> list[Any]:
+    for value in values:
+        if callable(value):
+            return [lazy_if_callable(value) for value in values]
+    return values
 
 
 @dataclass
-class DiagnosticError(RichCast, SourceMap, Exception):
+class DiagnosticError(SourceMap, Exception):
     severity: Severity = Severity.ERROR
-    code: RenderableType | None = None
-    message: RenderableType | None = None
+    code: "RenderableType | None" = None
+    message: "RenderableType | None" = None
     labels: list[LabeledSpan] = dataclasses.field(default_factory=list)
-    notes: list[RenderableType] = dataclasses.field(default_factory=list)
-    context: list[RenderableType] = dataclasses.field(default_factory=list)
+    notes: "list[RenderableType]" = dataclasses.field(default_factory=list)
+    context: "list[RenderableType]" = dataclasses.field(default_factory=list)
     source_map: dict[SourceId, tuple[SourceCode, SourceCodeHighlighter | None]] = (
         dataclasses.field(default_factory=dict)
     )
+    # Limits of the reports rendered by the diagnostic itself, or `None` for the
+    # default `RenderLimits`
+    limits: "RenderLimits | None" = dataclasses.field(
+        default=None, repr=False, compare=False
+    )
+    _render_cache: "RenderCache | None" = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # Sources active where the diagnostic was created, see `AmbientSource`
+    _source_scope: SourceScope | None = dataclasses.field(
+        default_factory=current_source_scope, init=False, repr=False, compare=False
+    )
+    # Sources added to the groups the diagnostic is in, innermost first, see
+    # `DiagnosticErrorGroup`
+    _group_sources: list[
+        dict[SourceId, tuple[SourceCode, SourceCodeHighlighter | None]]
+    ] = dataclasses.field(default_factory=list, init=False, repr=False, compare=False)
 
-    def with_context(self: Self, context: RenderableType) -> Self:
-        self.context.append(context)
+    # The message, notes, context and labels can be `Lazy`, or zero-argument
+    # callables which are wrapped in `Lazy`, so that they are only built if the
+    # diagnostic is rendered
+    def __post_init__(self: Self) -> None:
+        if callable(self.message):
+            self.message = lazy_if_callable(self.message)
+        self.notes = _lazy_items(self.notes)
+        self.context = _lazy_items(self.context)
+        for label in self.labels:
+            if callable(label.label):
+                self.labels = [
+                    LabeledSpan(label.span, lazy_if_callable(label.label))
+                    for label in self.labels
+                ]
+                break
+
+    # Convert any diagnostic to a `DiagnosticError`, with the sources of its labels
+    @classmethod
+    def from_diagnostic(cls, diagnostic: Diagnostic) -> "DiagnosticError":
+        if isinstance(diagnostic, DiagnosticError):
+            return diagnostic
+        error = cls(
+            severity=diagnostic.severity,
+            code=diagnostic.code,
+            message=diagnostic.message,
+            labels=list(diagnostic.labels),
+            notes=list(diagnostic.notes),
+            context=list(diagnostic.context),
+        )
+        if isinstance(diagnostic, SourceMap):
+            for label in diagnostic.labels:
+                resolved = diagnostic.get_source(label.source_id)
+                if resolved is not None:
+                    error.add_source(label.source_id, *resolved)
+        return error
+
+    def with_context(self: Self, context: "RenderableType") -> Self:
+        self.context.append(lazy_if_callable(context))
+        self._render_cache = None
         return self
 
     def add_source(
@@ -58,49 +135,159 @@ class DiagnosticError(RichCast, SourceMap, Exception):
     ) -> Self:
         if source_id not in self.source_map:
             self.source_map[source_id] = (source_code, highlighter)
+            self._render_cache = None
         return self
 
+    # Resolve `source_id` through the sources added to this diagnostic and to the
+    # groups it is in, and the scope it was created in only, without
+    # `source_registry`
+    def get_attached_source(
+        self: Self, source_id: SourceId
+    ) -> tuple[SourceCode, SourceCodeHighlighter | None] | None:
+        resolved = self.source_map.get(source_id)
+        for group_sources in self._group_sources:
+            if resolved is not None:
+                break
+            resolved = group_sources.get(source_id)
+        if resolved is None and self._source_scope is not None:
+            resolved = self._source_scope.get(source_id)
+        return resolved
+
     def get_source(
         self: Self, source_id: SourceId
     ) -> tuple[SourceCode, SourceCodeHighlighter | None] | None:
-        return self.source_map.get(source_id)
+        resolved = self.get_attached_source(source_id)
+        if resolved is None:
+            resolved = source_registry.resolve(source_id)
+        return resolved
+
+    def with_limits(self: Self, limits: "RenderLimits | None") -> Self:
+        self.limits = limits
+        self._render_cache = None
+        return self
 
     def add_note(self: Self, note: str) -> None:
         self.notes.append(note)
+        self._render_cache = None
+
+    def __rich__(self: Self) -> "RenderableType":
+        from pyagnostics.report import RenderCache, Report  # noqa: PLC0415
+        from pyagnostics.snippets import RenderLimits  # noqa: PLC0415
+
+        if self._render_cache is None:
+            self._render_cache = RenderCache()
+        return Report(
+            self,
+            suppressed_frame_paths=_suppressed_frames,
+            limits=self.limits or RenderLimits(),
+            cache=self._render_cache,
+        )
 
-    def __rich__(self: Self) -> RenderableType:
-        return Report(self, suppressed_frame_paths=_suppressed_frame_paths)
+    def to_plain_text(self: Self, width: int | None = None) -> str:
+        from pyagnostics.plain import PlainReport  # noqa: PLC0415
+        from pyagnostics.snippets import RenderLimits  # noqa: PLC0415
+
+        return PlainReport(
+            self,
+            suppressed_frame_paths=_suppressed_frames,
+            width=width,
+            limits=self.limits or RenderLimits(),
+        ).render()
+
+    def to_json(self: Self, indent: int | None = None) -> str:
+        from pyagnostics.plain import PlainReport  # noqa: PLC0415
+        from pyagnostics.snippets import RenderLimits  # noqa: PLC0415
+
+        return PlainReport(
+            self,
+            suppressed_frame_paths=_suppressed_frames,
+            limits=self.limits or RenderLimits(),
+        ).to_json(indent=indent)
 
 
 if TYPE_CHECKING:
     _: type[Diagnostic] = DiagnosticError
 
 
-class DiagnosticErrorGroup(ExceptionGroup[DiagnosticError], SourceMap, RichCast):
+# Sources added to a group are kept by the group, and its exceptions, including
+# those of nested groups, resolve them through it after their own.
+class DiagnosticErrorGroup(ExceptionGroup[DiagnosticError], SourceMap):
+    def __init__(
+        self: Self, message: str, exceptions: Sequence[DiagnosticError]
+    ) -> None:
+        super().__init__(message, exceptions)
+        self.source_map: dict[
+            SourceId, tuple[SourceCode, SourceCodeHighlighter | None]
+        ] = {}
+        # Sources added to the groups this group is in, innermost first
+        self._group_sources: list[
+            dict[SourceId, tuple[SourceCode, SourceCodeHighlighter | None]]
+        ] = []
+        for exception in self.exceptions:
+            _add_group_sources(exception, self.source_map)
+
+    # The rendered reports of the exceptions of the group may resolve sources
+    # through it
+    def _clear_render_caches(self: Self) -> None:
+        for exception in self.exceptions:
+            if isinstance(exception, DiagnosticErrorGroup):
+                exception._clear_render_caches()
+            elif isinstance(exception, DiagnosticError):
+                exception._render_cache = None
+
     def add_source(
         self: Self,
         source_id: SourceId,
         source_code: SourceCode,
         highlighter: SourceCodeHighlighter | None = None,
     ) -> Self:
-        for exception in self.exceptions:
-            if isinstance(exception, SourceMap):
-                exception.add_source(source_id, source_code, highlighter=highlighter)
+        if source_id not in self.source_map:
+            self.source_map[source_id] = (source_code, highlighter)
+            self._clear_render_caches()
         return self
 
     def get_source(
         self: Self, source_id: SourceId
     ) -> tuple[SourceCode, SourceCodeHighlighter | None] | None:
+        resolved = self.source_map.get(source_id)
+        if resolved is not None:
+            return resolved
         for exception in self.exceptions:
             if isinstance(exception, SourceMap):
                 resolved = exception.get_source(source_id)
                 if resolved is not None:
                     return resolved
+        for group_sources in self._group_sources:
+            resolved = group_sources.get(source_id)
+            if resolved is not None:
+                return resolved
+        return None
+
+    # As `DiagnosticError.get_attached_source`, through the sources added to the
+    # group, and those attached to its exceptions
+    def get_attached_source(
+        self: Self, source_id: SourceId
+    ) -> tuple[SourceCode, SourceCodeHighlighter | None] | None:
+        resolved = self.source_map.get(source_id)
+        if resolved is not None:
+            return resolved
+        for exception in self.exceptions:
+            if isinstance(exception, DiagnosticError | DiagnosticErrorGroup):
+                resolved = exception.get_attached_source(source_id)
+                if resolved is not None:
+                    return resolved
+        for group_sources in self._group_sources:
+            resolved = group_sources.get(source_id)
+            if resolved is not None:
+                return resolved
         return None
 
     def __rich__(
         self: Self,
-    ) -> RenderableType:
+    ) -> "RenderableType":
+        from rich.abc import RichRenderable  # noqa: PLC0415
+        from rich.console import Group, RenderableType  # noqa: PLC0415
+
         return Group(
             *[
                 cast(RenderableType, exception)
@@ -108,3 +295,18 @@ class DiagnosticErrorGroup(ExceptionGroup[DiagnosticError], SourceMap, RichCast)
                 if isinstance(exception, RichRenderable)
             ]
         )
+
+
+# Resolve the sources of `group_sources` in `exception`, and in every exception of
+# it if it is a group, after those they resolve already
+def _add_group_sources(
+    exception: BaseException,
+    group_sources: dict[SourceId, tuple[SourceCode, SourceCodeHighlighter | None]],
+) -> None:
+    if isinstance(exception, DiagnosticErrorGroup):
+        exception._group_sources.append(group_sources)
+        for nested in exception.exceptions:
+            _add_group_sources(nested, group_sources)
+    elif isinstance(exception, DiagnosticError):
+        exception._group_sources.append(group_sources)
+        exception._render_cache = None
@@ -0,0 +1,416 @@
+import os
+import re
+from collections.abc import Hashable, Iterable, Iterator
+from dataclasses import dataclass, field
+from fnmatch import translate
+from threading import Lock
+from types import FrameType, TracebackType
+from typing import NamedTuple, Self
+
+try:
+    _IMPORT_CWD = os.path.abspath(os.getcwd())
+except FileNotFoundError:
+    _IMPORT_CWD = ""
+
+# Attribute holding the frames captured by `capture_frames` on an exception
+_CAPTURED_FRAMES_ATTR = "_pyagnostics_frames"
+
+
+class Frame(NamedTuple):
+    filename: str
+    lineno: int
+    name: str
+    # Name of the module the frame's code belongs to, if known
+    module: str | None = None
+
+
+# A run of frames repeated more than this many times in a row, such as by a
+# recursion, is shown this many times, and the rest are folded, as CPython does
+RECURSION_CUTOFF = 3
+# Longest run of frames which is folded, such as of mutually recursive functions
+MAX_RECURSION_FRAMES = 8
+
+
+# Stands in for `count` more repetitions of `frames`, after the frames shown
+# `RECURSION_CUTOFF` times
+@dataclass(frozen=True, slots=True)
+class RepeatedFrames:
+    frames: tuple[Frame, ...]
+    count: int
+
+
+# Stands in for `count` frames in the middle of a stack with more than `max_frames`
+@dataclass(frozen=True, slots=True)
+class OmittedFrames:
+    count: int
+
+
+StackEntry = Frame | RepeatedFrames | OmittedFrames
+
+
+class Stack(NamedTuple):
+    frames: tuple[StackEntry, ...]
+    # Whether the exception was the `__cause__` (rather than the `__context__`) of
+    # the exception before it in the chain
+    is_cause: bool
+
+
+def format_frame(frame: Frame) -> str:
+    return f"in File {frame.filename}:{frame.lineno} in {frame.name}"
+
+
+def frames_repeated(entry: RepeatedFrames) -> str:
+    frames = "frame" if len(entry.frames) == 1 else f"{len(entry.frames)} frames"
+    times = "time" if entry.count == 1 else "times"
+    return f"[Previous {frames} repeated {entry.count} more {times}]"
+
+
+def frames_omitted(count: int) -> str:
+    return f"… {count} frame{'' if count == 1 else 's'} omitted"
+
+
+def causes_omitted(count: int) -> str:
+    return f"… {count} more cause{'' if count == 1 else 's'} omitted"
+
+
+def _frame_flag(frame: FrameType, name: str) -> bool:
+    # Only look into the frame locals (which may need to be materialized) if the
+    # code of the frame could have set the flag at all.
+    code = frame.f_code
+    if name not in code.co_varnames and name not in code.co_names:
+        return False
+    return bool(frame.f_locals.get(name, False))
+
+
+# The filename and module of the `Frame` of `tb`
+def _location(tb: TracebackType) -> tuple[str, str | None]:
+    frame = tb.tb_frame
+    filename = frame.f_code.co_filename
+    if filename and not filename.startswith("<") and not os.path.isabs(filename):
+        filename = os.path.join(_IMPORT_CWD, filename)
+    return filename or "?", frame.f_globals.get("__name__")
+
+
+def _frame(tb: TracebackType) -> Frame:
+    filename, module = _location(tb)
+    return Frame(filename, tb.tb_lineno, tb.tb_frame.f_code.co_name, module)
+
+
+# Times the run of `length` keys at `start` repeats in a row
+def _repeats(keys: list[Hashable], start: int, length: int) -> int:
+    run = keys[start : start + length]
+    end = start + length
+    repeats = 1
+    while keys[end : end + length] == run:
+        repeats += 1
+        end += length
+    return repeats
+
+
+# The length and repeats of the shortest run of keys at `start` which repeats more
+# than `RECURSION_CUTOFF` times in a row, if any. Only the lengths up to the later
+# keys equal to the key at `start`, as chained by `next_index`, are tried.
+def _recursion(
+    keys: list[Hashable], next_index: list[int], start: int
+) -> tuple[int, int] | None:
+    index = next_index[start]
+    while index and index - start <= MAX_RECURSION_FRAMES:
+        length = index - start
+        if start + length * (RECURSION_CUTOFF + 1) > len(keys):
+            break
+        repeats = _repeats(keys, start, length)
+        if repeats > RECURSION_CUTOFF:
+            return length, repeats
+        index = next_index[index]
+    return None
+
+
+# Indices of the keys shown, and the start, length and count of each run folded
+# after them, once the runs of `keys` repeated more than `RECURSION_CUTOFF` times
+# are folded
+def _fold(keys: list[Hashable]) -> list[int | tuple[int, int, int]]:
+    if len(set(keys)) == len(keys):
+        # Without a repeated key, there is no repeated run of keys
+        return list(range(len(keys)))
+
+    # Index of the next key equal to each key, or 0 if there is none
+    next_index = [0] * len(keys)
+    last_index: dict[Hashable, int] = {}
+    for index in range(len(keys) - 1, -1, -1):
+        next_index[index] = last_index.get(keys[index], 0)
+        last_index[keys[index]] = index
+
+    shown: list[int | tuple[int, int, int]] = []
+    index = 0
+    while index < len(keys):
+        recursion = _recursion(keys, next_index, index) if next_index[index] else None
+        if recursion is None:
+            shown.append(index)
+            index += 1
+            continue
+        length, repeats = recursion
+        shown.extend(range(index, index + length * RECURSION_CUTOFF))
+        shown.append((index, length, repeats - RECURSION_CUTOFF))
+        index += length * repeats
+    return shown
+
+
+# The entries of a stack, with the runs repeated more than `RECURSION_CUTOFF` times
+# folded, comparing them by `keys`, and the entries in the middle beyond
+# `max_frames` omitted. Frame records are only created for the entries shown.
+def _stack_entries(
+    keys: list[Hashable],
+    entries: list[TracebackType | StackEntry],
+    max_frames: int | None,
+) -> tuple[StackEntry, ...]:
+    shown = _fold(keys)
+    omitted = 0
+    head = len(shown)
+    if max_frames is not None and len(shown) > max_frames:
+        tail = max_frames // 2
+        head = max_frames - tail
+        omitted = sum(
+            1 if isinstance(item, int) else item[1] * item[2]
+            for item in shown[head : len(shown) - tail]
+        )
+        shown = [*shown[:head], *shown[len(shown) - tail :]]
+
+    frames: list[StackEntry] = []
+    for item in shown:
+        if isinstance(item, int):
+            entry = entries[item]
+            frames.append(_frame(entry) if isinstance(entry, TracebackType) else entry)
+            continue
+        start, length, count = item
+        repeated = [
+            _frame(entry) if isinstance(entry, TracebackType) else entry
+            for entry in entries[start : start + length]
+        ]
+        frames.append(
+            RepeatedFrames(
+                tuple(frame for frame in repeated if isinstance(frame, Frame)), count
+            )
+        )
+    if omitted:
+        frames.insert(head, OmittedFrames(omitted))
+    return tuple(frames)
+
+
+# Extract compact frame records for the traceback of `exc`, honouring the same
+# `_rich_traceback_omit` / `_rich_traceback_guard` flags as `rich.traceback`, and
+# leaving out the frames `suppressed` matches.
+#
+# Runs of frames repeated more than `RECURSION_CUTOFF` times are folded, and the
+# frames in the middle beyond `max_frames` omitted, before their records are
+# created. Suppressed frames are left out first, so they are never counted as
+# omitted.
+def extract_frames(
+    exc: BaseException,
+    max_frames: int | None = None,
+    suppressed: "FrameMatcher | None" = None,
+) -> tuple[StackEntry, ...]:
+    if suppressed is not None and not suppressed.pattern_count:
+        suppressed = None
+    entries: list[TracebackType | StackEntry] = []
+    keys: list[Hashable] = []
+    tb = exc.__traceback__
+    while tb is not None:
+        frame = tb.tb_frame
+        if not _frame_flag(frame, "_rich_traceback_omit") and (
+            suppressed is None or not suppressed._matches(*_location(tb))
+        ):
+            entries.append(tb)
+            # The tracebacks keep their code alive, so its id is unique for as
+            # long as the keys are compared
+            keys.append((id(frame.f_code), tb.tb_lineno))
+        if _frame_flag(frame, "_rich_traceback_guard"):
+            entries.clear()
+            keys.clear()
+        tb = tb.tb_next
+
+    # Frames captured before the exception was re-raised are innermost. Entries
+    # already folded or omitted are never folded again.
+    captured: tuple[StackEntry, ...] = getattr(exc, _CAPTURED_FRAMES_ATTR, ())
+    for entry in captured if suppressed is None else suppressed.exclude(captured):
+        entries.append(entry)
+        keys.append(entry if isinstance(entry, Frame) else object())
+    return _stack_entries(keys, entries, max_frames)
+
+
+_GLOB_CHARS = frozenset("*?[")
+
+
+def _compile_patterns(patterns: Iterable[str]) -> re.Pattern[str] | None:
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+# Matches frames against three kinds of patterns:
+#  - `prefixes` of the frame filename, such as `/usr/lib/python3.12/`, matched as
+#    is, even if they contain glob characters
+#  - `path_globs` matching the whole frame filename, such as `*/site-packages/*`
+#  - `modules`, module names such as `asyncio`, also matching their submodules, or
+#    module name globs, such as `myapp.*.internal`, matching the frame module
+#
+# All patterns are compiled into a single regex per kind of frame attribute, and
+# the result for each filename and module is cached until more patterns are added.
+@dataclass
+class FrameMatcher:
+    prefixes: list[str] = field(default_factory=list)
+    path_globs: list[str] = field(default_factory=list)
+    modules: list[str] = field(default_factory=list)
+
+    _path_regex: re.Pattern[str] | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _module_regex: re.Pattern[str] | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _cache: dict[tuple[str, str | None], bool] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    def __post_init__(self: Self) -> None:
+        self._compile()
+
+    def _compile(self: Self) -> None:
+        self._path_regex = _compile_patterns(
+            [
+                *(re.escape(prefix) for prefix in self.prefixes),
+                *(translate(glob) for glob in self.path_globs),
+            ]
+        )
+        self._module_regex = _compile_patterns(
+            translate(module)
+            if not _GLOB_CHARS.isdisjoint(module)
+            else rf"{re.escape(module)}(?:\.|\Z)"
+            for module in self.modules
+        )
+        self._cache = {}
+
+    # Number of patterns of every kind, which only grows
+    @property
+    def pattern_count(self: Self) -> int:
+        return len(self.prefixes) + len(self.path_globs) + len(self.modules)
+
+    def add(
+        self: Self,
+        *prefixes: str,
+        path_globs: Iterable[str] = (),
+        modules: Iterable[str] = (),
+    ) -> None:
+        with self._lock:
+            self.prefixes.extend(prefixes)
+            self.path_globs.extend(path_globs)
+            self.modules.extend(modules)
+            self._compile()
+
+    def matches(self: Self, frame: Frame) -> bool:
+        return self._matches(frame.filename, frame.module)
+
+    # Whether a frame of `filename` and `module` matches, without its record
+    def _matches(self: Self, filename: str, module: str | None) -> bool:
+        cache = self._cache
+        key = (filename, module)
+        matched = cache.get(key)
+        if matched is None:
+            path_regex, module_regex = self._path_regex, self._module_regex
+            matched = (
+                path_regex is not None and path_regex.match(filename) is not None
+            ) or (
+                module_regex is not None
+                and module is not None
+                and module_regex.match(module) is not None
+            )
+            cache[key] = matched
+        return matched
+
+    # The entries of a stack without the frames matched, dropping repeated runs
+    # of only matched frames
+    def exclude(self: Self, entries: Iterable[StackEntry]) -> list[StackEntry]:
+        kept: list[StackEntry] = []
+        for entry in entries:
+            match entry:
+                case Frame():
+                    if not self.matches(entry):
+                        kept.append(entry)
+                case RepeatedFrames(frames, count):
+                    frames = tuple(frame for frame in frames if not self.matches(frame))
+                    if frames:
+                        kept.append(RepeatedFrames(frames, count))
+                case OmittedFrames():
+                    kept.append(entry)
+        return kept
+
+
+def next_exc(exc: BaseException) -> BaseException | None:
+    if exc.__cause__:
+        return exc.__cause__
+    elif exc.__context__ and not exc.__suppress_context__:
+        return exc.__context__
+    else:
+        return None
+
+
+# Lazily walk `exc` and its chain of causes, extracting the frames of each
+# exception only once the walk reaches it. Only the first `max_depth` causes after
+# `exc` are walked, see `omitted_causes`, and at most `max_frames` of each stack,
+# without the frames `suppressed` matches.
+#
+# The ids of the exceptions walked are added to `seen`, and the walk stops at an
+# exception already walked, as a chain can be made to loop back on itself.
+def walk_causes_and_stacks(
+    exc: BaseException,
+    max_depth: int | None = None,
+    max_frames: int | None = None,
+    suppressed: FrameMatcher | None = None,
+    seen: set[int] | None = None,
+) -> Iterator[tuple[BaseException, Stack]]:
+    if seen is None:
+        seen = set()
+    cause: BaseException | None = exc
+    is_cause = False
+    depth = 0
+
+    while (
+        cause is not None
+        and (max_depth is None or depth <= max_depth)
+        and id(cause) not in seen
+    ):
+        seen.add(id(cause))
+        yield cause, Stack(extract_frames(cause, max_frames, suppressed), is_cause)
+        is_cause = cause.__cause__ is not None
+        cause = next_exc(cause)
+        depth += 1
+
+
+# Number of causes after `exc`, the last exception `walk_causes_and_stacks` walked,
+# which it left out, without extracting any frames. It continues from `exc`, and
+# stops at the exceptions in `seen`, as the walk does.
+def omitted_causes(exc: BaseException, seen: set[int]) -> int:
+    omitted = 0
+    cause = next_exc(exc)
+    while cause is not None and id(cause) not in seen:
+        seen.add(id(cause))
+        omitted += 1
+        cause = next_exc(cause)
+    return omitted
+
+
+# Replace the tracebacks of `exc` and its causes with compact frame records.
+#
+# A caught exception keeps every frame of its traceback alive, along with all of
+# their locals. Capturing the frames of diagnostics which are kept around, but may
+# never be rendered, releases that memory while still rendering the same report.
+def capture_frames(exc: BaseException) -> None:
+    seen: set[int] = set()
+    cause: BaseException | None = exc
+    while cause is not None and id(cause) not in seen:
+        seen.add(id(cause))
+        if cause.__traceback__ is not None:
+            setattr(cause, _CAPTURED_FRAMES_ATTR, extract_frames(cause))
+            cause.__traceback__ = None
+        cause = next_exc(cause)
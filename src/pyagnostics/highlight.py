@@ -0,0 +1,140 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import TYPE_CHECKING, Self
+
+from pyagnostics.protocols import SourceCodeHighlighter, SpanContents
+from pyagnostics.source import InMemorySpanContents
+
+if TYPE_CHECKING:
+    from pygments.token import _TokenType  # type: ignore[import-untyped]
+    from rich.style import Style
+    from rich.syntax import SyntaxTheme
+
+
+# The tokens of a source, as the start offset of every token followed by the
+# length of the source, and the type of every token
+@dataclass
+class _Tokens:
+    starts: "array[int]"
+    token_types: "list[_TokenType]"
+
+
+def _tokenize(source_code: str, lexer_name: str) -> _Tokens:
+    from pygments.lexers import get_lexer_by_name  # type: ignore[import-untyped]  # noqa: PLC0415
+
+    # Without the input preprocessing of `get_tokens`, so that token offsets are
+    # offsets into `source_code`
+    lexer = get_lexer_by_name(lexer_name)
+    starts = array("q")
+    token_types: list[_TokenType] = []
+    for start, token_type, _value in lexer.get_tokens_unprocessed(source_code):
+        if token_types and token_types[-1] is token_type:
+            continue
+        starts.append(start)
+        token_types.append(token_type)
+    starts.append(len(source_code))
+    return _Tokens(starts, token_types)
+
+
+# The tokens of the most recently highlighted sources, shared by every
+# `PygmentsHighlighter`, so that each source is only lexed once, however many
+# windows of it are highlighted. Sources are evicted least recently used first,
+# once there are more than `max_sources`.
+@dataclass
+class TokenCache:
+    max_sources: int = 64
+
+    _tokens: OrderedDict[tuple[str, str], _Tokens] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False)
+
+    def get(self: Self, source_code: str, lexer_name: str) -> _Tokens:
+        key = (source_code, lexer_name)
+        with self._lock:
+            tokens = self._tokens.get(key)
+            if tokens is not None:
+                self._tokens.move_to_end(key)
+                return tokens
+
+        # Lexed outside of the lock, so that large sources don't block others
+        tokens = _tokenize(source_code, lexer_name)
+        with self._lock:
+            self._tokens[key] = tokens
+            while len(self._tokens) > self.max_sources:
+                self._tokens.popitem(last=False)
+        return tokens
+
+    def clear(self: Self) -> None:
+        with self._lock:
+            self._tokens.clear()
+
+    def __len__(self: Self) -> int:
+        return len(self._tokens)
+
+
+token_cache = TokenCache()
+
+
+# Highlights the windows of `source_code` with the pygments lexer `lexer_name`.
+#
+# The whole source is lexed the first time any window of it is highlighted, so
+# that tokens spanning several lines, such as multi-line strings, are highlighted
+# the same whichever window they are read in. Highlighting a window then only
+# visits the tokens within it.
+@dataclass
+class PygmentsHighlighter(SourceCodeHighlighter):
+    source_code: str = field(repr=False)
+    lexer_name: str
+    theme: str = "monokai"
+    cache: TokenCache = field(default_factory=lambda: token_cache, repr=False)
+
+    _styles: "dict[_TokenType, Style]" = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _syntax_theme: "SyntaxTheme | None" = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def _style(self: Self, token_type: "_TokenType") -> "Style":
+        style = self._styles.get(token_type)
+        if style is None:
+            if self._syntax_theme is None:
+                from rich.syntax import Syntax  # noqa: PLC0415
+
+                self._syntax_theme = Syntax.get_theme(self.theme)
+            style = self._styles[token_type] = self._syntax_theme.get_style_for_token(
+                token_type
+            )
+        return style
+
+    def highlight(self: Self, span_contents: SpanContents) -> SpanContents:
+        from rich.text import Span  # noqa: PLC0415
+
+        tokens = self.cache.get(self.source_code, self.lexer_name)
+        window_start, window_end = span_contents.span.start, span_contents.span.end
+        starts, token_types = tokens.starts, tokens.token_types
+
+        text = span_contents.text.copy()
+        first = max(0, bisect_right(starts, window_start) - 1)
+        last = min(len(token_types), bisect_left(starts, window_end))
+        for index in range(first, last):
+            style = self._style(token_types[index])
+            if not style:
+                continue
+            start = max(starts[index], window_start) - window_start
+            end = min(starts[index + 1], window_end) - window_start
+            if start < end:
+                text.spans.append(Span(start, end, style))
+
+        return InMemorySpanContents(
+            text=text,
+            span=span_contents.span,
+            line=span_contents.line,
+            column=span_contents.column,
+            line_count=span_contents.line_count,
+            name=span_contents.name,
+        )
@@ -0,0 +1,133 @@
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import StrEnum, auto
+from threading import Lock
+from time import perf_counter
+from types import TracebackType
+from typing import Self
+
+
+class Phase(StrEnum):
+    # Rendering a report, including every other phase
+    REPORT = auto()
+    # Walking the causes and contexts of an exception, and rendering them
+    CAUSES = auto()
+    # Matching frames against the suppressed frame paths
+    FRAMES = auto()
+    # Reading windows of a source
+    READ = auto()
+    # Merging the context windows of spans
+    UNION = auto()
+    # Highlighting windows of a source
+    HIGHLIGHT = auto()
+    # Wrapping and labelling the lines of a source block
+    LAYOUT = auto()
+
+
+# Called with the phase, wall time in seconds and codepoints read of every
+# measurement, on the thread it was taken on
+InstrumentationHook = Callable[[Phase, float, int], None]
+
+
+@dataclass
+class PhaseStats:
+    calls: int = 0
+    seconds: float = 0.0
+    # Codepoints of source read or processed
+    chars: int = 0
+
+
+# Records the wall time, calls and codepoints read of each phase of rendering, and
+# forwards every measurement to `hooks`.
+#
+# Phases nest, so the time of a phase includes the time of the phases within it,
+# such as `READ` within `REPORT`. An instrumentation can be shared by reports
+# rendered on many threads at once.
+@dataclass
+class Instrumentation:
+    hooks: list[InstrumentationHook] = field(default_factory=list)
+
+    _stats: dict[Phase, PhaseStats] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False)
+
+    def record(self: Self, phase: Phase, seconds: float, chars: int = 0) -> None:
+        with self._lock:
+            stats = self._stats.get(phase)
+            if stats is None:
+                stats = self._stats[phase] = PhaseStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.chars += chars
+        for hook in self.hooks:
+            hook(phase, seconds, chars)
+
+    @property
+    def stats(self: Self) -> dict[Phase, PhaseStats]:
+        with self._lock:
+            return {
+                phase: PhaseStats(stats.calls, stats.seconds, stats.chars)
+                for phase, stats in self._stats.items()
+            }
+
+    def reset(self: Self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def measure(self: Self, phase: Phase) -> "Measurement":
+        return Measurement(self, phase)
+
+    # Measure the phases of everything rendered within the context, on this thread
+    @contextmanager
+    def activate(self: Self) -> Iterator[Self]:
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+
+# A measurement of one call of a phase, recorded when its context exits. Codepoints
+# read are added to `chars` within the context.
+@dataclass(slots=True)
+class Measurement:
+    instrumentation: Instrumentation
+    phase: Phase
+    chars: int = 0
+    _start: float = field(default=0.0, init=False, repr=False)
+
+    def __enter__(self: Self) -> Self:
+        self._start = perf_counter()
+        return self
+
+    def __exit__(
+        self: Self,
+        _exc_type: type[BaseException] | None,
+        _exc_value: BaseException | None,
+        _traceback: TracebackType | None,
+    ) -> None:
+        self.instrumentation.record(
+            self.phase, perf_counter() - self._start, self.chars
+        )
+
+
+_active: ContextVar[Instrumentation | None] = ContextVar(
+    "pyagnostics_instrumentation", default=None
+)
+_disabled: AbstractContextManager[None] = nullcontext()
+
+
+def active_instrumentation() -> Instrumentation | None:
+    return _active.get()
+
+
+# Measure a call of `phase` with the active instrumentation, if any. Without one,
+# this costs a context variable lookup, and the context is `None`.
+def measure(phase: Phase) -> AbstractContextManager[Measurement | None]:
+    instrumentation = _active.get()
+    if instrumentation is None:
+        return _disabled
+    return Measurement(instrumentation, phase)
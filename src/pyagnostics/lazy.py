@@ -0,0 +1,61 @@
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Self
+
+if TYPE_CHECKING:
+    from rich.console import RenderableType
+
+
+# A renderable built by `factory` the first time it is rendered, and memoized.
+# Diagnostics which are caught and handled without being rendered never build it.
+# It is built once, even when it is first rendered on several threads at once.
+#
+# Pickling a lazy renderable builds it, and pickles the renderable it built.
+@dataclass
+class Lazy:
+    factory: "Callable[[], RenderableType | None]" = field(repr=False)
+
+    _value: "RenderableType | None" = field(default=None, init=False, repr=False)
+    _built: bool = field(default=False, init=False, repr=False)
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    @property
+    def value(self: Self) -> "RenderableType | None":
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value = self.factory()
+                    self._built = True
+        return self._value
+
+    def __rich__(self: Self) -> "RenderableType":
+        value = self.value
+        return "" if value is None else value
+
+    def __reduce__(self: Self) -> tuple[Any, ...]:
+        return _built, (self.value,)
+
+
+def _built(value: "RenderableType | None") -> Lazy:
+    lazy = Lazy(lambda: value)
+    lazy._value, lazy._built = value, True
+    return lazy
+
+
+# The renderable of `renderable`, building it if it is lazy
+def evaluate(renderable: "RenderableType | None") -> "RenderableType | None":
+    while isinstance(renderable, Lazy):
+        renderable = renderable.value
+    return renderable
+
+
+# Wrap a zero-argument callable, other than a renderable, in `Lazy`
+def lazy_if_callable(value: Any) -> Any:  # noqa: ANN401
+    if (
+        callable(value)
+        and not hasattr(value, "__rich__")
+        and not hasattr(value, "__rich_console__")
+    ):
+        return Lazy(value)
+    return value
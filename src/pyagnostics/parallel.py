@@ -0,0 +1,161 @@
+import io
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from enum import StrEnum, auto
+from itertools import islice
+from typing import TextIO
+
+from pyagnostics.exceptions import DiagnosticError, DiagnosticErrorGroup
+from pyagnostics.protocols import Diagnostic
+from pyagnostics.wire import from_wire, to_wire
+
+
+class ReportFormat(StrEnum):
+    # Plain text, rendered without rich
+    TEXT = auto()
+    # Text styled with ANSI escape codes, rendered by rich
+    ANSI = auto()
+
+
+def _leaves(
+    diagnostics: Iterable[Diagnostic | ExceptionGroup[DiagnosticError]],
+) -> Iterator[DiagnosticError]:
+    for diagnostic in diagnostics:
+        if isinstance(diagnostic, ExceptionGroup):
+            yield from _leaves(diagnostic.exceptions)
+        else:
+            yield DiagnosticError.from_diagnostic(diagnostic)
+
+
+def _chunks(
+    diagnostics: Iterator[DiagnosticError], chunk_size: int
+) -> Iterator[tuple[DiagnosticError, ...]]:
+    while chunk := tuple(islice(diagnostics, chunk_size)):
+        yield chunk
+
+
+def render_report(
+    diagnostic: DiagnosticError,
+    width: int = 80,
+    report_format: ReportFormat = ReportFormat.ANSI,
+) -> str:
+    match report_format:
+        case ReportFormat.TEXT:
+            return diagnostic.to_plain_text(width=width)
+        case ReportFormat.ANSI:
+            from rich.console import Console  # noqa: PLC0415
+
+            output = io.StringIO()
+            console = Console(
+                file=output, width=width, force_terminal=True, color_system="truecolor"
+            )
+            console.print(diagnostic)
+            return output.getvalue()
+        case _:
+            raise ValueError(f"Unknown report format: {report_format!r}")
+
+
+# Module level, so that it can be sent to a process pool
+def _render_chunk(
+    diagnostics: tuple[DiagnosticError, ...], width: int, report_format: ReportFormat
+) -> list[str]:
+    return [
+        render_report(diagnostic, width, report_format) for diagnostic in diagnostics
+    ]
+
+
+# Module level, so that it can be sent to a process pool
+def _render_wire_chunk(
+    diagnostics: tuple[bytes, ...], width: int, report_format: ReportFormat
+) -> list[str]:
+    return [
+        render_report(from_wire(diagnostic), width, report_format)
+        for diagnostic in diagnostics
+    ]
+
+
+# Render the reports of many diagnostics on `executor`, yielding them in the
+# order of the diagnostics as soon as each is rendered.
+#
+# Diagnostics are sent to the executor in chunks of `chunk_size`, with at most
+# `max_pending` chunks queued at once, so that diagnostics are only taken from
+# `diagnostics` as the reports are consumed. Nested groups are flattened.
+#
+# A thread pool of `max_workers` is used if no executor is given. Other executors
+# are sent the diagnostics in their wire format, see `pyagnostics.wire`.
+def render_reports(  # noqa: PLR0913
+    diagnostics: DiagnosticErrorGroup | Iterable[Diagnostic],
+    *,
+    width: int = 80,
+    report_format: ReportFormat = ReportFormat.ANSI,
+    executor: Executor | None = None,
+    max_workers: int | None = None,
+    chunk_size: int = 16,
+    max_pending: int | None = None,
+) -> Iterator[str]:
+    if executor is None:
+        with ThreadPoolExecutor(max_workers) as pool:
+            yield from render_reports(
+                diagnostics,
+                width=width,
+                report_format=report_format,
+                executor=pool,
+                max_workers=max_workers,
+                chunk_size=chunk_size,
+                max_pending=max_pending,
+            )
+        return
+
+    if max_pending is None:
+        max_pending = 4 * (max_workers or 8)
+    pending: deque[Future[list[str]]] = deque()
+    try:
+        leaves = _leaves(
+            diagnostics.exceptions
+            if isinstance(diagnostics, DiagnosticErrorGroup)
+            else diagnostics
+        )
+        in_process = isinstance(executor, ThreadPoolExecutor)
+        for chunk in _chunks(leaves, chunk_size):
+            if in_process:
+                future = executor.submit(_render_chunk, chunk, width, report_format)
+            else:
+                future = executor.submit(
+                    _render_wire_chunk,
+                    tuple(map(to_wire, chunk)),
+                    width,
+                    report_format,
+                )
+            pending.append(future)
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# Write the reports of many diagnostics to `file` as they are rendered, see
+# `render_reports`.
+def write_reports(  # noqa: PLR0913
+    diagnostics: DiagnosticErrorGroup | Iterable[Diagnostic],
+    file: TextIO,
+    *,
+    width: int = 80,
+    report_format: ReportFormat = ReportFormat.ANSI,
+    executor: Executor | None = None,
+    max_workers: int | None = None,
+    chunk_size: int = 16,
+) -> None:
+    for report in render_reports(
+        diagnostics,
+        width=width,
+        report_format=report_format,
+        executor=executor,
+        max_workers=max_workers,
+        chunk_size=chunk_size,
+    ):
+        file.write(report)
+        file.flush()
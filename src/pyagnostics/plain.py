@@ -0,0 +1,530 @@
+import json
+import re
+from collections.abc import Iterator, Mapping, Sequence
+from dataclasses import dataclass, field
+from functools import cached_property
+from io import StringIO
+from typing import Any, Self, TextIO
+
+from rich.console import RenderableType
+from rich.text import Text
+
+from pyagnostics.frames import (
+    Frame,
+    FrameMatcher,
+    OmittedFrames,
+    RepeatedFrames,
+    StackEntry,
+    causes_omitted,
+    format_frame,
+    frames_omitted,
+    frames_repeated,
+    omitted_causes,
+    walk_causes_and_stacks,
+)
+from pyagnostics.lazy import evaluate
+from pyagnostics.protocols import Diagnostic, SourceMap
+from pyagnostics.snippets import (
+    Omission,
+    OmittedLabels,
+    RenderLimits,
+    SnippetBlock,
+    cropped_lines,
+    cropped_ranges,
+    labels_omitted,
+    lines_omitted,
+    snippet_blocks,
+)
+from pyagnostics.source import CroppedLine, span_location
+from pyagnostics.spans import LabeledSpan
+
+# The tag syntax of `rich.markup`
+_MARKUP_TAG = re.compile(r"((\\*)\[([a-z#/@][^[]*?)])")
+# A word and the whitespace around it, as split by rich when wrapping
+_WORD = re.compile(r"\s*\S+\s*")
+
+
+def _strip_markup(markup: str) -> str:
+    if "[" not in markup:
+        return markup
+    parts: list[str] = []
+    position = 0
+    for match in _MARKUP_TAG.finditer(markup):
+        full_text, escapes, _tag = match.groups()
+        parts.append(markup[position : match.start()])
+        if escapes:
+            backslashes, escaped = divmod(len(escapes), 2)
+            parts.append("\\" * backslashes)
+            if escaped:
+                parts.append(full_text[len(escapes) :])
+        position = match.end()
+    parts.append(markup[position:])
+    return "".join(parts)
+
+
+# Render a renderable to lines of plain text. Strings are console markup, as they
+# are when rendered by rich. Rich is only used to render arbitrary renderables.
+def _plain_lines(renderable: RenderableType | None, width: int | None) -> list[str]:
+    renderable = evaluate(renderable)
+    if renderable is None:
+        renderable = ""
+    if isinstance(renderable, str):
+        return _wrap(_strip_markup(renderable), width)
+    if isinstance(renderable, Text):
+        return _wrap(renderable.plain, width)
+
+    from rich.console import Console  # noqa: PLC0415
+
+    console = Console(
+        file=StringIO(), width=width or 10_000, color_system=None, legacy_windows=False
+    )
+    return [
+        "".join(segment.text for segment in line).rstrip()
+        for line in console.render_lines(renderable, pad=False)
+    ]
+
+
+# The text of `renderable` rendered without styles or wrapping
+def plain_text(renderable: RenderableType | None) -> str:
+    return "\n".join(_plain_lines(renderable, None))
+
+
+# The text of `renderable` as `plain_text`, or `None` if it is empty once built
+def _optional_text(renderable: RenderableType | None) -> str | None:
+    renderable = evaluate(renderable)
+    return plain_text(renderable) if renderable else None
+
+
+# Wrap text like rich does, folding words which do not fit on a line. Every
+# character is assumed to be a single cell wide.
+def _wrap(text: str, width: int | None) -> list[str]:
+    lines: list[str] = []
+    for line in text.split("\n"):
+        line = line.expandtabs(8)  # noqa: PLW2901
+        if width is None or len(line) <= width:
+            lines.append(line)
+            continue
+
+        breaks: list[int] = []
+        offset = 0
+        for match in _WORD.finditer(line):
+            start, word = match.start(), match.group()
+            word_length = len(word.rstrip())
+            if width - offset >= word_length:
+                offset += len(word)
+            elif word_length > width:
+                for fold_start in range(start, start + len(word), width):
+                    if fold_start:
+                        breaks.append(fold_start)
+                    offset = len(word[fold_start - start : fold_start - start + width])
+            elif offset and start:
+                breaks.append(start)
+                offset = len(word)
+
+        for start, end in zip([0, *breaks], [*breaks, len(line)], strict=True):
+            wrapped_line = line[start:end]
+            # Only trailing whitespace that does not fit is removed
+            excess = len(wrapped_line) - width
+            if excess > 0:
+                whitespace = len(wrapped_line) - len(wrapped_line.rstrip())
+                wrapped_line = wrapped_line[
+                    : len(wrapped_line) - min(whitespace, excess)
+                ]
+            lines.append(wrapped_line[:width])
+    return lines
+
+
+# The text of `entry`, as `pyagnostics.report.Report` renders it
+def _stack_entry_text(entry: StackEntry) -> str:
+    match entry:
+        case Frame():
+            return _strip_markup(format_frame(entry))
+        case RepeatedFrames():
+            return frames_repeated(entry)
+        case OmittedFrames(count):
+            return frames_omitted(count)
+
+
+def _stack_entry_dict(entry: StackEntry) -> dict[str, Any]:
+    match entry:
+        case Frame():
+            return entry._asdict()
+        case RepeatedFrames(frames, count):
+            return {"repeated": [frame._asdict() for frame in frames], "count": count}
+        case OmittedFrames(count):
+            return {"omitted": count}
+
+
+# The pieces of `line` shown, as `pyagnostics.report.LabeledSourceBlock` crops it,
+# with the offset of the start of each piece in the source, and the end of the
+# codepoints of the source it shows.
+def _line_pieces(
+    line: str,
+    line_start: int,
+    labels: Sequence[LabeledSpan],
+    limits: RenderLimits | None,
+    crop: CroppedLine | None = None,
+) -> list[tuple[str, int, int | None]]:
+    line_end = line_start + len(line) if crop is None else crop.end
+    ranges = cropped_ranges(line_start, line_end, labels, limits)
+    if crop is not None:
+        ranges = crop.shown(ranges)
+    if ranges is None:
+        return [(line, line_start, None)]
+    pieces: list[tuple[str, int, int | None]] = []
+    for start, end in ranges:
+        piece = (
+            line[start - line_start : end - line_start]
+            if crop is None
+            else crop.slice(start, end).plain
+        )
+        piece_start = start
+        if start > line_start:
+            piece = f"…{piece}"
+            piece_start -= 1
+        if end < line_end:
+            piece = f"{piece}…"
+        pieces.append((piece, piece_start, end))
+    return pieces
+
+
+# Render the layout of `pyagnostics.report.LabeledSourceBlock` to plain lines.
+def _source_block_lines(  # noqa: PLR0912, PLR0913, PLR0915, PLR0917
+    source: str,
+    title: str | None,
+    start_line: int,
+    start_char_index: int,
+    labels: Sequence[LabeledSpan],
+    width: int | None,
+    omitted: Sequence[Omission] = (),
+    limits: RenderLimits | None = None,
+    cropped: Mapping[int, CroppedLine] | None = None,
+) -> Iterator[str]:
+    cropped = cropped or {}
+    plain_lines_with_end = source.splitlines(keepends=True)
+    text_lines = source.split("\n")[: len(plain_lines_with_end)]
+
+    omissions = {omission.line_index: omission for omission in omitted}
+    lines_in_src = len(plain_lines_with_end) + sum(
+        omission.line_count for omission in omitted
+    )
+    line_number_max_len = len(str(lines_in_src + start_line))
+    line_numbers_padding = " " * (line_number_max_len + 1)
+    available_width = (
+        None if width is None else max(1, width - (line_number_max_len + 3))
+    )
+
+    if title is not None:
+        yield f"{line_numbers_padding}╭─[{title}]"
+    else:
+        yield f"{line_numbers_padding}╭───"
+
+    sorted_labels = sorted(labels, key=lambda label: label.span.start)
+    next_label_idx = 0
+    active_labels: list[LabeledSpan] = []
+
+    src_line_start_index = start_char_index
+    first_line = start_line
+    for i, (line, line_with_end) in enumerate(
+        zip(text_lines, plain_lines_with_end, strict=False)
+    ):
+        omission = omissions.get(i)
+        if omission is not None:
+            yield f"{line_numbers_padding}{lines_omitted(omission.line_count)}"
+            src_line_start_index += omission.char_count
+            first_line += omission.line_count
+
+        crop = cropped.get(i)
+        wrapped_lines: list[tuple[str, int, int | None]] = []
+        for piece, piece_start, piece_end in _line_pieces(
+            line, src_line_start_index, labels, limits, crop
+        ):
+            offset = piece_start
+            for wrapped_line in _wrap(piece, available_width) or [""]:
+                wrapped_lines.append((wrapped_line, offset, piece_end))
+                offset += len(wrapped_line)
+
+        for j, (wrapped_line, segment_start, piece_end) in enumerate(wrapped_lines):
+            segment_end = segment_start + len(wrapped_line)
+            if piece_end is not None:
+                segment_end = min(segment_end, piece_end)
+
+            while (
+                next_label_idx < len(sorted_labels)
+                and sorted_labels[next_label_idx].span.start < segment_end
+            ):
+                active_labels.append(sorted_labels[next_label_idx])
+                next_label_idx += 1
+            active_labels = [
+                label for label in active_labels if label.span.end > segment_start
+            ]
+
+            line_number = (
+                str(i + first_line).rjust(line_number_max_len)
+                if j == 0
+                else " " * line_number_max_len
+            )
+            yield f"{line_number} │ {wrapped_line}"
+
+            for label_row in range(len(active_labels) + 1 if active_labels else 0):
+                parts = [line_numbers_padding, "· "]
+                labels_line_length = 0
+                for k, label in enumerate(
+                    active_labels[: len(active_labels) - label_row + 1]
+                ):
+                    label_start = max(label.span.start, segment_start)
+                    label_end = min(label.span.end, segment_end)
+                    label_len = max(1, label_end - label_start)
+                    before_len = label_start - segment_start - labels_line_length
+                    label_before_middle_len = label_len // 2
+                    label_after_middle_len = label_len - label_before_middle_len - 1
+
+                    if label_row == 0:
+                        parts.append(" " * before_len)
+                        parts.append("─" * label_before_middle_len)
+                        parts.append("┬")
+                        parts.append("─" * label_after_middle_len)
+                    else:
+                        parts.append(" " * (before_len + label_before_middle_len))
+                        if k == len(active_labels) - label_row:
+                            parts.append("╰─ ")
+                            parts.append(
+                                label.label
+                                if isinstance(label.label, str)
+                                else plain_text(label.label)
+                            )
+                        else:
+                            parts.append("│")
+                            parts.append(" " * label_after_middle_len)
+
+                    labels_line_length += before_len + label_len
+                row = "".join(parts)
+                yield row if width is None else row[:width]
+
+        src_line_start_index += (
+            len(line_with_end) if crop is None else crop.span.end - crop.span.start
+        )
+
+    yield f"{line_numbers_padding}╰───"
+
+
+# Render the layout of `pyagnostics.report.CauseList` to plain lines.
+def _cause_list_lines(
+    header: RenderableType | None,
+    items: Sequence[Sequence[str] | None],
+    width: int | None,
+) -> Iterator[str]:
+    if header:
+        header_lines = _plain_lines(header, None if width is None else width - 3)
+        yield f" × {header_lines[0]}"  # noqa: RUF001
+        for i, line in enumerate(header_lines[1:]):
+            if i == len(header_lines) - 2 and not items:
+                yield f"   {line}"
+            else:
+                yield f" │ {line}"
+
+    for i, item in enumerate(items):
+        if item is None:
+            yield " │   "
+            continue
+        last = i == len(items) - 1
+        for j, line in enumerate(item):
+            if j == 0:
+                yield f" ╰─▶ {line}" if last else f" ├─▶ {line}"
+            else:
+                yield f"     {line}" if last else f" │   {line}"
+
+
+# Renders a diagnostic to plain text with the same layout as `Report`, or to a
+# JSON document, without building any rich renderables for the report itself.
+#
+# Without a `width`, lines are never wrapped or cropped.
+@dataclass
+class PlainReport:
+    diag: Diagnostic
+    suppressed_frame_paths: Sequence[str] | FrameMatcher = field(default_factory=list)
+    width: int | None = None
+    limits: RenderLimits = field(default_factory=RenderLimits)
+
+    @cached_property
+    def _frame_matcher(self: Self) -> FrameMatcher:
+        if isinstance(self.suppressed_frame_paths, FrameMatcher):
+            return self.suppressed_frame_paths
+        return FrameMatcher(prefixes=list(self.suppressed_frame_paths))
+
+    def _inner_width(self: Self, padding: int) -> int | None:
+        return None if self.width is None else max(1, self.width - padding)
+
+    def _cause_lines(
+        self: Self,
+        diag: Diagnostic,
+        width: int | None,
+        include_exc_causes: bool = True,
+    ) -> Iterator[str]:
+        item_width = None if width is None else max(1, width - 5)
+        causes: list[Sequence[str] | None] = [
+            _plain_lines(context, item_width) for context in diag.context
+        ]
+
+        if isinstance(diag, BaseException):
+            seen: set[int] = set()
+            causes_and_stacks = walk_causes_and_stacks(
+                diag,
+                self.limits.max_cause_depth,
+                self.limits.max_stack_frames,
+                self._frame_matcher,
+                seen,
+            )
+            last, stack = next(causes_and_stacks)
+            causes.extend(
+                _wrap(_stack_entry_text(entry), item_width) for entry in stack.frames
+            )
+
+            for exc, stack in causes_and_stacks if include_exc_causes else ():
+                last = exc
+                kind = "Cause" if stack.is_cause else "Context"
+                if isinstance(exc, Diagnostic):
+                    code = plain_text(exc.code) if exc.code else "unknown"
+                    cause_report = PlainReport(
+                        exc, width=item_width, limits=self.limits
+                    )
+                    causes.append(
+                        [
+                            *_wrap(f"{kind}: {code}", item_width),
+                            *cause_report._cause_lines(
+                                exc, item_width, include_exc_causes=False
+                            ),
+                        ]
+                    )
+                else:
+                    nested_width = None if item_width is None else item_width - 5
+                    nested_causes: list[Sequence[str] | None] = [
+                        _wrap(_stack_entry_text(entry), nested_width)
+                        for entry in stack.frames
+                    ]
+                    exc_type = f"{exc.__class__.__module__}.{exc.__class__.__name__}"
+                    causes.append(
+                        [
+                            *_wrap(f"{kind}: {exc_type}", item_width),
+                            *_cause_list_lines(str(exc), nested_causes, item_width),
+                        ]
+                    )
+
+            if include_exc_causes:
+                omitted = omitted_causes(last, seen)
+                if omitted:
+                    causes.append(_wrap(causes_omitted(omitted), item_width))
+
+        yield from _cause_list_lines(evaluate(diag.message), causes, width)
+
+    def _snippet_lines(self: Self, width: int | None) -> Iterator[str]:
+        for block in snippet_blocks(self.diag, self.limits):
+            match block:
+                case OmittedLabels(count):
+                    yield ""
+                    yield labels_omitted(count)
+                case SnippetBlock(windows, labels):
+                    first = windows[0]
+                    yield ""
+                    yield from _source_block_lines(
+                        "".join(window.text.plain for window in windows),
+                        first.name,
+                        first.line,
+                        first.span.start,
+                        labels,
+                        width,
+                        omitted=block.omissions(),
+                        limits=self.limits,
+                        cropped=cropped_lines(windows),
+                    )
+
+    def lines(self: Self) -> Iterator[str]:
+        yield ""
+        if self.diag.code:
+            header = f"{self.diag.severity.title()}: {plain_text(self.diag.code)}"
+            for line in _wrap(header, self._inner_width(2)):
+                yield f" {line}"
+            yield ""
+
+        body_width = self._inner_width(4)
+        for line in self._cause_lines(self.diag, body_width):
+            yield f"  {line}"
+        for line in self._snippet_lines(body_width):
+            yield f"  {line}" if line else ""
+        if self.diag.notes:
+            yield ""
+            for note in self.diag.notes:
+                for line in _plain_lines(note, body_width):
+                    yield f"  {line}"
+        yield ""
+
+    def write(self: Self, out: TextIO) -> None:
+        for line in self.lines():
+            out.write(line.rstrip())
+            out.write("\n")
+
+    def render(self: Self) -> str:
+        out = StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def _label_dict(self: Self, label: LabeledSpan) -> dict[str, Any]:
+        result: dict[str, Any] = {
+            "source_id": label.source_id.value,
+            "start": label.span.start,
+            "end": label.span.end,
+            "label": plain_text(label.label),
+        }
+        resolved = (
+            self.diag.get_source(label.source_id)
+            if isinstance(self.diag, SourceMap)
+            else None
+        )
+        if resolved is not None:
+            source_code, _highlighter = resolved
+            name, result["line"], result["column"] = span_location(
+                source_code, label.span
+            )
+            result["name"] = name
+        return result
+
+    def _cause_dicts(self: Self) -> Iterator[dict[str, Any]]:
+        if not isinstance(self.diag, BaseException):
+            return
+        causes_and_stacks = walk_causes_and_stacks(
+            self.diag, suppressed=self._frame_matcher
+        )
+        next(causes_and_stacks)
+        for exc, stack in causes_and_stacks:
+            cause: dict[str, Any] = {
+                "kind": "cause" if stack.is_cause else "context",
+                "type": f"{exc.__class__.__module__}.{exc.__class__.__name__}",
+            }
+            if isinstance(exc, Diagnostic):
+                cause["code"] = _optional_text(exc.code)
+                cause["message"] = _optional_text(exc.message)
+            else:
+                cause["message"] = str(exc)
+            cause["frames"] = [_stack_entry_dict(entry) for entry in stack.frames]
+            yield cause
+
+    def to_dict(self: Self) -> dict[str, Any]:
+        frames: Sequence[StackEntry] = ()
+        if isinstance(self.diag, BaseException):
+            _, stack = next(
+                walk_causes_and_stacks(self.diag, suppressed=self._frame_matcher)
+            )
+            frames = stack.frames
+        return {
+            "severity": str(self.diag.severity),
+            "code": _optional_text(self.diag.code),
+            "message": _optional_text(self.diag.message),
+            "labels": [self._label_dict(label) for label in self.diag.labels],
+            "notes": [plain_text(note) for note in self.diag.notes],
+            "context": [plain_text(context) for context in self.diag.context],
+            "frames": [_stack_entry_dict(entry) for entry in frames],
+            "causes": list(self._cause_dicts()),
+        }
+
+    def to_json(self: Self, indent: int | None = None) -> str:
+        return json.dumps(self.to_dict(), indent=indent, ensure_ascii=False)
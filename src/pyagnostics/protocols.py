@@ -1,16 +1,17 @@
 from collections.abc import Sequence
-from typing import Protocol, Self, runtime_checkable
-
-from rich.console import RenderableType
-from rich.text import Text
+from typing import TYPE_CHECKING, Protocol, Self, runtime_checkable
 
 from pyagnostics.severity import Severity
 from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
 
+if TYPE_CHECKING:
+    from rich.console import RenderableType
+    from rich.text import Text
+
 
 class SpanContents(Protocol):
     @property
-    def text(self: Self) -> Text: ...
+    def text(self: Self) -> "Text": ...
 
     @property
     def span(self: Self) -> SourceSpan: ...
@@ -37,6 +38,39 @@ class SourceCode(Protocol):
     ) -> SpanContents: ...
 
 
+# A source that can read the context windows of many spans at once, merging
+# overlapping windows. See `pyagnostics.source.read_spans` for the fallback used
+# for sources that only implement `SourceCode`.
+@runtime_checkable
+class MultiSpanSourceCode(SourceCode, Protocol):
+    def read_spans(
+        self: Self,
+        spans: Sequence[SourceSpan],
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SpanContents]: ...
+
+
+# A source that can read spans which start or end within a line, without widening
+# them to whole lines, so that only the columns shown of very long lines are read.
+# See `pyagnostics.snippets`.
+@runtime_checkable
+class SlicingSourceCode(SourceCode, Protocol):
+    # The spans of the lines `read_span` reads for `span`, each with its line
+    # break, without reading them
+    def line_spans(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SourceSpan]: ...
+
+    # The codepoints of exactly `span`, at the line and column `read_span` resolves
+    # its start to, so that an offset at the start of a line is at the end of the
+    # line before it
+    def read_slice(self: Self, span: SourceSpan) -> SpanContents: ...
+
+
 class SourceCodeHighlighter(Protocol):
     def highlight(self: Self, span_contents: SpanContents) -> SpanContents: ...
 
@@ -44,22 +78,22 @@ class SourceCodeHighlighter(Protocol):
 @runtime_checkable
 class Diagnostic(Protocol):
     @property
-    def code(self: Self) -> RenderableType | None: ...
+    def code(self: Self) -> "RenderableType | None": ...
 
     @property
     def severity(self: Self) -> Severity: ...
 
     @property
-    def notes(self: Self) -> Sequence[RenderableType]: ...
+    def notes(self: Self) -> "Sequence[RenderableType]": ...
 
     @property
-    def message(self: Self) -> RenderableType | None: ...
+    def message(self: Self) -> "RenderableType | None": ...
 
     @property
     def labels(self: Self) -> Sequence[LabeledSpan]: ...
 
     @property
-    def context(self: Self) -> Sequence[RenderableType]: ...
+    def context(self: Self) -> "Sequence[RenderableType]": ...
 
 
 @runtime_checkable
@@ -0,0 +1,193 @@
+import weakref
+from dataclasses import dataclass, field
+from threading import RLock
+from typing import NamedTuple, Self
+
+from pyagnostics.protocols import SourceCode, SourceCodeHighlighter
+from pyagnostics.spans import SourceId
+
+
+# A source registered under an id by `SourceRegistry.hold`
+class SourceHold(NamedTuple):
+    source_code: SourceCode
+    highlighter: SourceCodeHighlighter | None = None
+
+
+# Resolves `SourceId`s to their source code, for every diagnostic at once.
+#
+# Sources are only held through weak references, so registering a source does not
+# keep it alive, unless it is pinned. Sources which cannot be weakly referenced must
+# be pinned. Diagnostics resolve their own `SourceMap` first, and fall back to
+# `source_registry` for the very `SourceId`s sources were registered under.
+#
+# All methods are safe to call from many threads at once.
+@dataclass
+class SourceRegistry:
+    # The id each source was registered under, which may only equal the id it is
+    # looked up with, and its reference. Sources which cannot be weakly referenced
+    # have no reference here, and are only held by `_pinned`.
+    _sources: dict[
+        SourceId,
+        tuple[SourceId, "weakref.ref[SourceCode] | None", SourceCodeHighlighter | None],
+    ] = field(default_factory=dict, init=False, repr=False)
+    _pinned: dict[SourceId, SourceCode] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # The holds of each id, latest last, and the registration of the id before its
+    # first hold, which is restored once every hold is released
+    _holds: dict[SourceId, list[SourceHold]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _held_over: dict[
+        SourceId,
+        tuple[
+            tuple[
+                SourceId,
+                "weakref.ref[SourceCode] | None",
+                SourceCodeHighlighter | None,
+            ]
+            | None,
+            SourceCode | None,
+        ],
+    ] = field(default_factory=dict, init=False, repr=False)
+    # Reentrant, as a weak reference callback may run on a thread holding the lock
+    _lock: RLock = field(default_factory=RLock, init=False, repr=False)
+
+    def register(
+        self: Self,
+        source_id: SourceId,
+        source_code: SourceCode,
+        highlighter: SourceCodeHighlighter | None = None,
+        *,
+        pin: bool = False,
+    ) -> SourceId:
+        def remove(ref: "weakref.ref[SourceCode]") -> None:
+            with self._lock:
+                entry = self._sources.get(source_id)
+                if entry is not None and entry[1] is ref:
+                    del self._sources[source_id]
+
+        ref: weakref.ref[SourceCode] | None
+        try:
+            ref = weakref.ref(source_code, remove)
+        except TypeError:
+            if not pin:
+                raise TypeError(
+                    f"{type(source_code).__name__} cannot be weakly referenced, "
+                    "register it with pin=True"
+                ) from None
+            ref = None
+
+        with self._lock:
+            self._sources[source_id] = (source_id, ref, highlighter)
+            if pin:
+                self._pinned[source_id] = source_code
+            else:
+                self._pinned.pop(source_id, None)
+        return source_id
+
+    def unregister(self: Self, source_id: SourceId) -> None:
+        with self._lock:
+            self._sources.pop(source_id, None)
+            self._pinned.pop(source_id, None)
+
+    # Register and pin `source_code` under `source_id` until the hold is released,
+    # over any registration of it. Holds of an id can be released in any order, and
+    # the latest of those left is registered, or once none are, the registration
+    # before the first.
+    def hold(
+        self: Self,
+        source_id: SourceId,
+        source_code: SourceCode,
+        highlighter: SourceCodeHighlighter | None = None,
+    ) -> SourceHold:
+        hold = SourceHold(source_code, highlighter)
+        with self._lock:
+            holds = self._holds.setdefault(source_id, [])
+            if not holds:
+                self._held_over[source_id] = (
+                    self._sources.get(source_id),
+                    self._pinned.get(source_id),
+                )
+            holds.append(hold)
+            self.register(source_id, source_code, highlighter, pin=True)
+        return hold
+
+    def release(self: Self, source_id: SourceId, hold: SourceHold) -> None:
+        with self._lock:
+            holds = self._holds.get(source_id)
+            if holds is None or hold not in holds:
+                return
+            holds.remove(hold)
+            if holds:
+                self.register(source_id, *holds[-1], pin=True)
+                return
+            del self._holds[source_id]
+            entry, pinned = self._held_over.pop(source_id)
+            self._sources.pop(source_id, None)
+            self._pinned.pop(source_id, None)
+            # Weakly held sources collected during the holds stay unregistered
+            if entry is None or (
+                pinned is None and entry[1] is not None and entry[1]() is None
+            ):
+                return
+            self._sources[source_id] = entry
+            if pinned is not None:
+                self._pinned[source_id] = pinned
+
+    # Keep the source of `source_id` alive until it is unpinned or unregistered
+    def pin(self: Self, source_id: SourceId) -> None:
+        with self._lock:
+            resolved = self.get(source_id)
+            if resolved is None:
+                raise KeyError(source_id)
+            self._pinned[source_id] = resolved[0]
+
+    def unpin(self: Self, source_id: SourceId) -> None:
+        with self._lock:
+            self._pinned.pop(source_id, None)
+            entry = self._sources.get(source_id)
+            if entry is not None and entry[1] is None:
+                del self._sources[source_id]
+
+    def get(
+        self: Self, source_id: SourceId
+    ) -> tuple[SourceCode, SourceCodeHighlighter | None] | None:
+        with self._lock:
+            return self._get(source_id, exact=False)
+
+    # `get`, only for the `SourceId` the source was registered under itself, so that
+    # ids which merely collide with it, such as from `SourceId.unsafe_from_value`,
+    # never resolve another source
+    def resolve(
+        self: Self, source_id: SourceId
+    ) -> tuple[SourceCode, SourceCodeHighlighter | None] | None:
+        with self._lock:
+            return self._get(source_id, exact=True)
+
+    # Must be called with the lock held
+    def _get(
+        self: Self, source_id: SourceId, *, exact: bool
+    ) -> tuple[SourceCode, SourceCodeHighlighter | None] | None:
+        entry = self._sources.get(source_id)
+        if entry is None:
+            return None
+        registered_id, ref, highlighter = entry
+        if exact and registered_id is not source_id:
+            return None
+        source_code = self._pinned.get(source_id)
+        if source_code is None and ref is not None:
+            source_code = ref()
+        if source_code is None:
+            return None
+        return source_code, highlighter
+
+    def __contains__(self: Self, source_id: SourceId) -> bool:
+        return self.get(source_id) is not None
+
+    def __len__(self: Self) -> int:
+        with self._lock:
+            return len(self._sources)
+
+
+source_registry = SourceRegistry()
@@ -1,6 +1,15 @@
-from collections.abc import Iterable, Iterator, MutableSequence, Sequence
+from collections.abc import (
+    Hashable,
+    Iterable,
+    Iterator,
+    Mapping,
+    MutableSequence,
+    Sequence,
+)
+from contextlib import nullcontext
 from dataclasses import dataclass, field
-from typing import Self
+from functools import cached_property
+from typing import NamedTuple, Self
 
 from rich.color import Color
 from rich.console import (
@@ -11,20 +20,53 @@ from rich.console import (
     NewLine,
     RenderableType,
     RenderResult,
-    RichCast,
     group,
 )
+from rich.default_styles import DEFAULT_STYLES
+from rich.highlighter import ReprHighlighter
+from rich.measure import Measurement
 from rich.padding import Padding
 from rich.segment import Segment
 from rich.style import Style
 from rich.styled import Styled
 from rich.terminal_theme import DIMMED_MONOKAI
 from rich.text import Text
-from rich.traceback import Stack, Traceback
 
-from pyagnostics.protocols import Diagnostic, SourceMap
+from pyagnostics.frames import (
+    Frame,
+    FrameMatcher,
+    OmittedFrames,
+    RepeatedFrames,
+    Stack,
+    StackEntry,
+    causes_omitted,
+    format_frame,
+    frames_omitted,
+    frames_repeated,
+    # Moved to `pyagnostics.frames`, and still importable from here
+    next_exc,  # noqa: F401
+    omitted_causes,
+    walk_causes_and_stacks,
+)
+from pyagnostics.instrument import Instrumentation, Phase, measure
+from pyagnostics.lazy import evaluate
+from pyagnostics.protocols import Diagnostic
 from pyagnostics.severity import Severity
-from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+from pyagnostics.snippets import (
+    Omission,
+    OmittedLabels,
+    RenderLimits,
+    SnippetBlock,
+    chars_read,
+    cropped_lines,
+    cropped_ranges,
+    highlight_window,
+    labels_omitted,
+    lines_omitted,
+    snippet_blocks,
+)
+from pyagnostics.source import CroppedLine
+from pyagnostics.spans import LabeledSpan
 
 
 @dataclass
@@ -34,16 +76,70 @@ class LabeledSourceBlock:
     start_line: int = 1
     start_char_index: int = 0
     labels: Sequence[LabeledSpan] = field(default_factory=list)
+    # Lines omitted between the lines of `source`
+    omitted: Sequence[Omission] = ()
+    # Limits on the columns shown of long lines
+    limits: RenderLimits | None = None
+    # Lines of `source` of which only the columns shown were read, by their index
+    cropped: Mapping[int, CroppedLine] = field(default_factory=dict)
+
+    # Wrapped and labeled lines rendered so far, per width
+    _lines_by_width: dict[int, list[Segment | RenderableType]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
 
-    def __rich_console__(  # noqa: PLR0912, PLR0915
-        self: Self, _console: Console, _options: ConsoleOptions
+    def __rich_console__(
+        self: Self, console: Console, options: ConsoleOptions
     ) -> RenderResult:
+        lines = self._lines_by_width.get(options.max_width)
+        if lines is None:
+            with measure(Phase.LAYOUT) as measurement:
+                lines = list(self._render_lines(console, options))
+                if measurement is not None:
+                    measurement.chars = len(self.source)
+            self._lines_by_width[options.max_width] = lines
+        yield from lines
+
+    # The pieces of `line` shown, with the offset of the start of each piece in the
+    # source, and the end of the codepoints of the source it shows. A cropped piece
+    # starts or ends with `…`, standing in for the codepoints omitted.
+    def _line_pieces(
+        self: Self, line: Text, line_start: int, crop: CroppedLine | None
+    ) -> list[tuple[Text, int, int | None]]:
+        line_end = line_start + len(line) if crop is None else crop.end
+        ranges = cropped_ranges(line_start, line_end, self.labels, self.limits)
+        if crop is not None:
+            ranges = crop.shown(ranges)
+        if ranges is None:
+            return [(line, line_start, None)]
+        pieces: list[tuple[Text, int, int | None]] = []
+        for start, end in ranges:
+            piece = (
+                line[start - line_start : end - line_start]
+                if crop is None
+                else crop.slice(start, end)
+            )
+            piece_start = start
+            if start > line_start:
+                piece = Text("…", style=Style(dim=True)) + piece
+                piece_start -= 1
+            if end < line_end:
+                piece.append("…", style=Style(dim=True))
+            pieces.append((piece, piece_start, end))
+        return pieces
+
+    def _render_lines(  # noqa: PLR0912, PLR0915
+        self: Self, _console: Console, _options: ConsoleOptions
+    ) -> Iterator[Segment | RenderableType]:
         plain_lines_with_end = self.source.plain.splitlines(keepends=True)
         text_lines = list(self.source.split("\n"))
         if len(text_lines) > len(plain_lines_with_end):
             text_lines = text_lines[: len(plain_lines_with_end)]
 
-        lines_in_src = len(plain_lines_with_end)
+        omissions = {omission.line_index: omission for omission in self.omitted}
+        lines_in_src = len(plain_lines_with_end) + sum(
+            omission.line_count for omission in self.omitted
+        )
         line_number_max_len = len(str(lines_in_src + self.start_line))
         line_numbers_padding = " " * (line_number_max_len + 1)
 
@@ -57,35 +153,61 @@ class LabeledSourceBlock:
         src_line_start_index = self.start_char_index
         available_width = max(1, _options.max_width - (line_number_max_len + 3))
 
+        # Sweep over the labels in order of their start, as the segments advance
+        # through the source. `active_labels` holds the labels which have started
+        # before the current segment and have not ended before it, in order.
+        sorted_labels = sorted(self.labels, key=lambda label: label.span.start)
+        next_label_idx = 0
+        active_labels: list[LabeledSpan] = []
+
+        first_line = self.start_line
         for i, (line, line_with_end) in enumerate(
             zip(text_lines, plain_lines_with_end)
         ):
-            wrapped_lines = line.wrap(
-                _console, width=available_width, overflow="fold", no_wrap=False
-            )
-            wrapped_lines_list: list[Text] = (
-                list(wrapped_lines) if wrapped_lines else [Text("")]
-            )
-
-            offset = 0
-            for j, wrapped_line in enumerate(wrapped_lines_list):
+            omission = omissions.get(i)
+            if omission is not None:
+                yield Segment(line_numbers_padding)
+                yield Segment(lines_omitted(omission.line_count), Style(dim=True))
+                yield Segment.line()
+                src_line_start_index += omission.char_count
+                first_line += omission.line_count
+
+            crop = self.cropped.get(i)
+            wrapped_lines_list: list[tuple[Text, int, int | None]] = []
+            for piece, piece_start, piece_end in self._line_pieces(
+                line, src_line_start_index, crop
+            ):
+                wrapped_lines = piece.wrap(
+                    _console, width=available_width, overflow="fold", no_wrap=False
+                )
+                offset = piece_start
+                for wrapped_line in wrapped_lines or [Text("")]:
+                    wrapped_lines_list.append((wrapped_line, offset, piece_end))
+                    offset += len(wrapped_line.plain)
+
+            for j, (wrapped_line, segment_start, piece_end) in enumerate(
+                wrapped_lines_list
+            ):
                 wrapped_line.end = ""
                 wrapped_plain = wrapped_line.plain
                 segment_len = len(wrapped_plain)
-                segment_start = src_line_start_index + offset
                 segment_end = segment_start + segment_len
-
-                labels_in_line = [
-                    label
-                    for label in self.labels
-                    if label.span.start < segment_end and label.span.end > segment_start
+                if piece_end is not None:
+                    segment_end = min(segment_end, piece_end)
+
+                while (
+                    next_label_idx < len(sorted_labels)
+                    and sorted_labels[next_label_idx].span.start < segment_end
+                ):
+                    active_labels.append(sorted_labels[next_label_idx])
+                    next_label_idx += 1
+                active_labels = [
+                    label for label in active_labels if label.span.end > segment_start
                 ]
-                labels_in_line = sorted(
-                    labels_in_line, key=lambda label: label.span.start
-                )
+                labels_in_line = active_labels
 
                 line_number = (
-                    f"{str(i + self.start_line).rjust(line_number_max_len)}"
+                    f"{str(i + first_line).rjust(line_number_max_len)}"
                     if j == 0
                     else " " * line_number_max_len
                 )
@@ -133,9 +255,11 @@ class LabeledSourceBlock:
                                 if k == len(labels_in_line) - label_row:
                                     yield Segment("╰─ ", style)
 
-                                    renderable = label.label
-                                    if isinstance(label.label, str):
-                                        renderable = Text(label.label, end="")
+                                    renderable = evaluate(label.label)
+                                    if renderable is None or isinstance(
+                                        renderable, str
+                                    ):
+                                        renderable = Text(renderable or "", end="")
 
                                     yield Styled(renderable, style)
                                 else:
@@ -146,33 +270,22 @@ class LabeledSourceBlock:
 
                         yield Segment.line()
 
-                offset += segment_len
-
-            src_line_start_index += len(line_with_end)
+            src_line_start_index += (
+                len(line_with_end) if crop is None else crop.span.end - crop.span.start
+            )
 
         yield Segment(line_numbers_padding)
         yield Segment("╰───\n")
 
 
-def next_exc(exc: BaseException) -> BaseException | None:
-    if exc.__cause__:
-        return exc.__cause__
-    elif exc.__context__ and not exc.__suppress_context__:
-        return exc.__context__
-    else:
-        return None
-
-
-def walk_causes_and_stacks(exc: BaseException) -> Iterator[tuple[BaseException, Stack]]:
-    cause: BaseException | None = exc
-    stacks = Traceback.extract(type(exc), exc, exc.__traceback__).stacks
-
-    while True:
-        assert cause is not None
-        yield cause, stacks.pop(0)
-        cause = next_exc(cause)
-        if cause is None:
-            break
+def _render_stack_entry(entry: StackEntry) -> RenderableType:
+    match entry:
+        case Frame():
+            return format_frame(entry)
+        case RepeatedFrames():
+            return Text(frames_repeated(entry), style=Style(dim=True))
+        case OmittedFrames(count):
+            return Text(frames_omitted(count), style=Style(dim=True))
 
 
 @dataclass
@@ -234,10 +347,86 @@ class CauseList(ConsoleRenderable):
                 yield NewLine()
 
 
+# Fields of a `Report` which change what it renders
+_RENDERED_FIELDS = frozenset({"diag", "suppressed_frame_paths", "limits"})
+
+
+# Key of the rendered segments of a report in a `RenderCache`
+class RenderKey(NamedTuple):
+    width: int
+    color_system: str | None
+    encoding: str
+    markup: bool | None
+    highlight: bool | None
+    justify: str | None
+    overflow: str | None
+    # The styles of the console theme, see `_theme_key`, or `Report.theme`
+    theme: Hashable
+
+
+# The names of the styles which rich highlights the text of reports with, of which
+# consoles may be given themes with other styles
+_HIGHLIGHT_STYLE_NAMES = tuple(
+    name for name in DEFAULT_STYLES if name.startswith(ReprHighlighter.base_style)
+)
+
+
+# The styles a console renders the highlighted text of reports with. Rich has no
+# public accessor for the theme itself, so themes which differ in the styles of
+# other names are only told apart by `Report.theme`.
+def _theme_key(console: Console) -> tuple[Style, ...]:
+    return tuple(
+        console.get_style(name, default="none") for name in _HIGHLIGHT_STYLE_NAMES
+    )
+
+
+# The renderable tree of a report, and the segments rendered from it per console
+# width and color system. Pickling a cache yields an empty one, and it must be
+# cleared whenever the diagnostic it belongs to is mutated.
 @dataclass
-class Report(RichCast):
+class RenderCache:
+    renderable: RenderableType | None = None
+    segments: dict[RenderKey, list[Segment]] = field(default_factory=dict)
+    # Exception state of the diagnostic when the cache was filled, see `Report`
+    origin: tuple[object, ...] = ()
+
+    def clear(self: Self) -> None:
+        self.renderable = None
+        self.segments = {}
+        self.origin = ()
+
+    def __reduce__(self: Self) -> tuple[type[Self], tuple[()]]:
+        return type(self), ()
+
+
+@dataclass
+class Report(ConsoleRenderable):
     diag: Diagnostic
-    suppressed_frame_paths: Sequence[str] = field(default_factory=list)
+    suppressed_frame_paths: Sequence[str] | FrameMatcher = field(default_factory=list)
+    limits: RenderLimits = field(default_factory=RenderLimits)
+    # Measures the phases of rendering the report, see `pyagnostics.instrument`
+    instrumentation: Instrumentation | None = None
+    # Identifies the console theme the report is rendered with in its cache, for
+    # reports with markup of styles other than those of `_theme_key`
+    theme: Hashable | None = None
+    cache: RenderCache = field(default_factory=RenderCache, repr=False, compare=False)
+
+    # Changing what the report renders once it is initialised clears its cache
+    def __setattr__(self: Self, name: str, value: object) -> None:
+        super().__setattr__(name, value)
+        if name in _RENDERED_FIELDS and "cache" in self.__dict__:
+            self.__dict__.pop("_frame_matcher", None)
+            self.cache.clear()
+
+    @cached_property
+    def _frame_matcher(self: Self) -> FrameMatcher:
+        if isinstance(self.suppressed_frame_paths, FrameMatcher):
+            return self.suppressed_frame_paths
+        return FrameMatcher(prefixes=list(self.suppressed_frame_paths))
+
+    def _frames(self: Self, stack: Stack) -> list[RenderableType]:
+        with measure(Phase.FRAMES):
+            return [_render_stack_entry(entry) for entry in stack.frames]
 
     @group()
     def _render_header(self: Self) -> RenderResult:
@@ -255,28 +444,28 @@ class Report(RichCast):
         causes: MutableSequence[RenderableType | None] = [*self.diag.context]
 
         if isinstance(self.diag, BaseException):
+            seen: set[int] = set()
             causes_and_stacks: Iterator[tuple[BaseException, Stack]] = (
-                walk_causes_and_stacks(self.diag)
+                walk_causes_and_stacks(
+                    self.diag,
+                    self.limits.max_cause_depth,
+                    self.limits.max_stack_frames,
+                    self._frame_matcher,
+                    seen,
+                )
             )
             if not include_exc_causes:
                 causes_and_stacks = iter([next(causes_and_stacks)])
 
             first = True
+            last: BaseException = self.diag
             for exc, stack in causes_and_stacks:
+                last = exc
                 if first:
                     first = False
-                    for frame in stack.frames:
-                        if any(
-                            frame.filename.startswith(path)
-                            for path in self.suppressed_frame_paths
-                        ):
-                            continue
-
-                        causes.append(
-                            f"in File {frame.filename}:{frame.lineno} in {frame.name}"
-                        )
+                    causes.extend(self._frames(stack))
                 elif isinstance(exc, Diagnostic):
-                    cause_report = Report(exc)
+                    cause_report = Report(exc, limits=self.limits)
                     causes.append(
                         Group(
                             Text.assemble(
@@ -293,19 +482,6 @@ class Report(RichCast):
                         )
                     )
                 else:
-                    nested_causes = []
-
-                    for frame in stack.frames:
-                        if any(
-                            frame.filename.startswith(path)
-                            for path in self.suppressed_frame_paths
-                        ):
-                            continue
-
-                        nested_causes.append(
-                            f"in File {frame.filename}:{frame.lineno} in {frame.name}"
-                        )
-
                     causes.append(
                         Group(
                             Text.assemble(
@@ -318,64 +494,53 @@ class Report(RichCast):
                             ),
                             CauseList(
                                 str(exc),
-                                nested_causes,
+                                self._frames(stack),
                                 style=self.diag.severity.style,
                             ),
                         )
                     )
 
-        yield CauseList(self.diag.message, causes, style=self.diag.severity.style)
+            if include_exc_causes:
+                omitted = omitted_causes(last, seen)
+                if omitted:
+                    causes.append(Text(causes_omitted(omitted), style=Style(dim=True)))
+
+        yield CauseList(
+            evaluate(self.diag.message), causes, style=self.diag.severity.style
+        )
 
     @group()
     def _render_snippets(self: Self) -> Iterable[RenderableType]:
-        if not self.diag.labels or not isinstance(self.diag, SourceMap):
-            return
-        labels_by_source: dict[SourceId, list[LabeledSpan]] = {}
-        for label in self.diag.labels:
-            labels_by_source.setdefault(label.source_id, []).append(label)
-
-        for source_id, labels in labels_by_source.items():
-            resolved = self.diag.get_source(source_id)
-            if resolved is None:
-                continue
-            source_code, highlighter = resolved
-
-            if not labels:
-                continue
-
-            context_spans: list[SourceSpan] = []
-            for label in labels:
-                span_contents = source_code.read_span(
-                    label.span, context_lines_before=2, context_lines_after=2
-                )
-                context_spans.append(
-                    SourceSpan(
-                        span_contents.span.start,
-                        span_contents.span.end,
-                        source_id=span_contents.span.source_id,
+        for block in snippet_blocks(self.diag, self.limits):
+            match block:
+                case OmittedLabels(count):
+                    yield NewLine()
+                    yield Text(labels_omitted(count), style=Style(dim=True))
+                case SnippetBlock(windows, labels, highlighter):
+                    if highlighter is not None:
+                        with measure(Phase.HIGHLIGHT) as measurement:
+                            windows = [
+                                highlight_window(highlighter, window)
+                                for window in windows
+                            ]
+                            if measurement is not None:
+                                measurement.chars = sum(
+                                    chars_read(window) for window in windows
+                                )
+                    first = windows[0]
+                    yield NewLine()
+                    yield LabeledSourceBlock(
+                        first.text
+                        if len(windows) == 1
+                        else Text("").join(window.text for window in windows),
+                        title=first.name,
+                        start_line=first.line,
+                        start_char_index=first.span.start,
+                        labels=labels,
+                        omitted=block.omissions(),
+                        limits=self.limits,
+                        cropped=cropped_lines(windows),
                     )
-                )
-
-            for merged_span in SourceSpan.union(context_spans):
-                span_contents = source_code.read_span(merged_span)
-                if highlighter is not None:
-                    span_contents = highlighter.highlight(span_contents)
-                block_labels = [
-                    label
-                    for label in labels
-                    if label.span.start < merged_span.end
-                    and label.span.end > merged_span.start
-                ]
-                if not block_labels:
-                    continue
-                yield NewLine()
-                yield LabeledSourceBlock(
-                    span_contents.text,
-                    title=span_contents.name,
-                    start_line=span_contents.line,
-                    start_char_index=span_contents.span.start,
-                    labels=block_labels,
-                )
 
     @group()
     def _render_notes(self: Self) -> Iterable[RenderableType]:
@@ -383,13 +548,82 @@ class Report(RichCast):
             yield NewLine()
             yield from self.diag.notes
 
-    def __rich__(self: Self) -> RenderableType:
+    # Raising, chaining or capturing the frames of an exception changes its report
+    # without going through any of the methods which clear the cache.
+    def _origin(self: Self) -> tuple[object, ...]:
+        suppressed_patterns = self._frame_matcher.pattern_count
+        if not isinstance(self.diag, BaseException):
+            return (suppressed_patterns,)
+        return (
+            suppressed_patterns,
+            self.diag.__traceback__,
+            self.diag.__cause__,
+            self.diag.__context__,
+            self.diag.__suppress_context__,
+        )
+
+    def _renderable(self: Self) -> RenderableType:
+        origin = self._origin()
+        cache = self.cache
+        if len(origin) != len(cache.origin) or any(
+            current is not cached for current, cached in zip(origin, cache.origin)
+        ):
+            cache.clear()
+            cache.origin = origin
+        if cache.renderable is None:
+            cache.renderable = self._build()
+        return cache.renderable
+
+    def __rich_console__(
+        self: Self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        activation = (
+            nullcontext()
+            if self.instrumentation is None
+            else self.instrumentation.activate()
+        )
+        with activation, measure(Phase.REPORT):
+            segments = self._segments(console, options)
+        yield from segments
+
+    def _segments(
+        self: Self, console: Console, options: ConsoleOptions
+    ) -> list[Segment]:
+        renderable = self._renderable()
+        key = RenderKey(
+            options.max_width,
+            console.color_system,
+            options.encoding,
+            options.markup,
+            options.highlight,
+            options.justify,
+            options.overflow,
+            _theme_key(console) if self.theme is None else self.theme,
+        )
+        segments = self.cache.segments.get(key)
+        if segments is None:
+            segments = list(console.render(renderable, options))
+            self.cache.segments[key] = segments
+        return segments
+
+    # Former `RichCast` API, the report renders itself
+    def __rich__(self: Self) -> Self:
+        return self
+
+    def __rich_measure__(
+        self: Self, console: Console, options: ConsoleOptions
+    ) -> Measurement:
+        return Measurement.get(console, options, self._renderable())
+
+    def _build(self: Self) -> RenderableType:
+        with measure(Phase.CAUSES):
+            causes = self._render_causes()
         return Padding(
             Group(
                 self._render_header(),
                 Padding(
                     Group(
-                        self._render_causes(),
+                        causes,
                         self._render_snippets(),
                         self._render_notes(),
                     ),
@@ -0,0 +1,111 @@
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from types import TracebackType
+from typing import NamedTuple, Self
+
+from pyagnostics.protocols import SourceCode, SourceCodeHighlighter, SourceMap
+from pyagnostics.registry import SourceHold, source_registry
+from pyagnostics.spans import SourceId
+
+
+# The sources active in a context, innermost first. Diagnostics capture the scope
+# active when they are created, and resolve their labels through it when they are
+# rendered, so that sources are attached without catching the diagnostic.
+class SourceScope(NamedTuple):
+    source_id: SourceId
+    source_code: SourceCode
+    highlighter: SourceCodeHighlighter | None = None
+    parent: "SourceScope | None" = None
+
+    def get(
+        self: Self, source_id: SourceId
+    ) -> tuple[SourceCode, SourceCodeHighlighter | None] | None:
+        scope: SourceScope | None = self
+        while scope is not None:
+            if scope.source_id == source_id:
+                return scope.source_code, scope.highlighter
+            scope = scope.parent
+        return None
+
+
+_current_scope: ContextVar[SourceScope | None] = ContextVar(
+    "pyagnostics_source_scope", default=None
+)
+
+
+def current_source_scope() -> SourceScope | None:
+    return _current_scope.get()
+
+
+# Makes a source active for the diagnostics created within the block, in this
+# context only, so each asyncio task and thread sees only the scopes it entered.
+# Entering costs a context variable update, and an exception leaving the block is
+# neither caught nor re-raised.
+#
+# Diagnostics created elsewhere, such as on a thread pool, and raised through the
+# block get the source added as it exits, unless it is attached to them already.
+# A scope can only be entered once at a time. A `registered` source is also held in
+# `source_registry` until the block exits, see `SourceRegistry.hold`.
+@dataclass
+class AmbientSource:
+    source_code: SourceCode
+    highlighter: SourceCodeHighlighter | None = None
+    source_id: SourceId = field(kw_only=True)
+    registered: bool = field(default=False, kw_only=True)
+
+    _token: "Token[SourceScope | None] | None" = field(
+        default=None, init=False, repr=False
+    )
+    _hold: SourceHold | None = field(default=None, init=False, repr=False)
+
+    def __enter__(self: Self) -> SourceId:
+        if self._token is not None:
+            raise RuntimeError("Source scope is already entered")
+        self._token = _current_scope.set(
+            SourceScope(
+                self.source_id,
+                self.source_code,
+                self.highlighter,
+                _current_scope.get(),
+            )
+        )
+        if self.registered:
+            self._hold = source_registry.hold(
+                self.source_id, self.source_code, self.highlighter
+            )
+        return self.source_id
+
+    def __exit__(
+        self: Self,
+        _exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        _traceback: TracebackType | None,
+    ) -> None:
+        if self._token is not None:
+            _current_scope.reset(self._token)
+            self._token = None
+            if self._hold is not None:
+                source_registry.release(self.source_id, self._hold)
+                self._hold = None
+        # Checked against `None` first, as checking a runtime protocol is slow
+        if exc_value is None or not isinstance(exc_value, SourceMap):
+            return
+        # Only sources attached to the exception itself count, not those it
+        # resolves through `source_registry`, which may be unregistered before it
+        # is rendered
+        get_attached_source = getattr(
+            exc_value, "get_attached_source", exc_value.get_source
+        )
+        if get_attached_source(self.source_id) is None:
+            exc_value.add_source(self.source_id, self.source_code, self.highlighter)
+
+    async def __aenter__(self: Self) -> SourceId:
+        return self.__enter__()
+
+    async def __aexit__(
+        self: Self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.__exit__(exc_type, exc_value, traceback)
@@ -1,7 +1,8 @@
 from enum import StrEnum, auto
-from typing import Self
+from typing import TYPE_CHECKING, Self
 
-from rich.style import Style
+if TYPE_CHECKING:
+    from rich.style import Style
 
 
 class Severity(StrEnum):
@@ -10,7 +11,9 @@ class Severity(StrEnum):
     ERROR = auto()
 
     @property
-    def style(self: Self) -> Style:
+    def style(self: Self) -> "Style":
+        from rich.style import Style  # noqa: PLC0415
+
         match self:
             case Severity.ADVICE:
                 return Style(color="blue")
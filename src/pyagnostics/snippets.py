@@ -0,0 +1,650 @@
+from bisect import bisect_right
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass, replace
+from itertools import pairwise
+from typing import NamedTuple, Self
+
+from pyagnostics.instrument import Phase, measure
+from pyagnostics.protocols import (
+    Diagnostic,
+    SlicingSourceCode,
+    SourceCode,
+    SourceCodeHighlighter,
+    SourceMap,
+    SpanContents,
+)
+from pyagnostics.source import (
+    CroppedLine,
+    CroppedSpanContents,
+    InMemorySpanContents,
+    read_spans,
+)
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan, SpanSet
+
+# Lines of context shown before and after labels
+CONTEXT_LINES = 2
+
+
+# Limits on the source, causes and frames shown in a report, so that the cost of
+# rendering a report scales with what it shows, rather than with the size of its
+# labeled spans, of the lines they are on, or of its chain of causes. `None` is
+# unlimited.
+@dataclass(frozen=True, slots=True)
+class RenderLimits:
+    # Lines longer than this are cropped to the columns around their labels. Of
+    # sources which implement `SlicingSourceCode`, only those columns are read.
+    max_line_columns: int | None = 500
+    # Columns shown on either side of the start and the end of each label on a
+    # cropped line, and at the start of a cropped line without any
+    label_columns: int = 80
+    # Lines shown per source block. Beyond this, the lines between the labels of a
+    # block are omitted, and then the labels in the middle of the block, but the
+    # lines around the start and end of its first and last labels are always
+    # shown. Omitted lines are never read from the source.
+    max_block_lines: int | None = 200
+    # Lines of source shown per report, after which the remaining labels are
+    # omitted. No block is longer than this either.
+    max_report_lines: int | None = 2000
+    # Causes shown after the diagnostic itself, after which the rest are omitted.
+    # The frames of omitted causes are never extracted.
+    max_cause_depth: int | None = 100
+    # Frames shown per stack, after folding repeated frames. Beyond this, the
+    # frames in the middle of the stack are omitted.
+    max_stack_frames: int | None = 100
+
+
+UNLIMITED = RenderLimits(None, 0, None, None, None, None)
+
+
+# `line_count` lines of `char_count` codepoints omitted before the `line_index`th
+# line shown in a source block
+@dataclass(frozen=True, slots=True)
+class Omission:
+    line_index: int
+    line_count: int
+    char_count: int
+
+
+# The labels of a source block, and the windows of the source shown for them, in
+# order. The lines between each window and the next are omitted.
+@dataclass
+class SnippetBlock:
+    windows: list[SpanContents]
+    labels: list[LabeledSpan]
+    highlighter: SourceCodeHighlighter | None = None
+
+    @property
+    def line_count(self: Self) -> int:
+        return sum(window.line_count + 1 for window in self.windows)
+
+    def omissions(self: Self) -> list[Omission]:
+        omissions = []
+        line_index = self.windows[0].line_count + 1
+        for before, after in pairwise(self.windows):
+            omissions.append(
+                Omission(
+                    line_index,
+                    after.line - (before.line + before.line_count + 1),
+                    after.span.start - before.span.end,
+                )
+            )
+            line_index += after.line_count + 1
+        return omissions
+
+
+# Stands in for the labels of a report which are not shown, as the report has
+# already shown `RenderLimits.max_report_lines`. Labels whose source could not be
+# resolved are never shown, and are counted in `unresolved` rather than `count`.
+@dataclass(frozen=True, slots=True)
+class OmittedLabels:
+    count: int
+    unresolved: int = 0
+
+
+def lines_omitted(count: int) -> str:
+    return f"… {count} line{'' if count == 1 else 's'} omitted"
+
+
+def labels_omitted(count: int) -> str:
+    return f"… {count} more label{'' if count == 1 else 's'} omitted"
+
+
+def _parts(contents: SpanContents) -> tuple[SpanContents, ...]:
+    if isinstance(contents, CroppedSpanContents):
+        return contents.parts
+    return (contents,)
+
+
+# Codepoints read of `contents`, which only counts the pieces of cropped lines
+def chars_read(contents: SpanContents) -> int:
+    return sum(
+        sum(len(piece.text) for piece in part.pieces)
+        if isinstance(part, CroppedLine)
+        else len(part.text)
+        for part in _parts(contents)
+    )
+
+
+# The cropped lines of the windows of a block, by the index of their line in it
+def cropped_lines(windows: Iterable[SpanContents]) -> dict[int, CroppedLine]:
+    cropped = {}
+    line_index = 0
+    for window in windows:
+        for part in _parts(window):
+            if isinstance(part, CroppedLine):
+                cropped[line_index] = part
+            line_index += part.line_count + 1
+    return cropped
+
+
+# Highlight `contents`, and each piece of its cropped lines on its own
+def highlight_window(
+    highlighter: SourceCodeHighlighter, contents: SpanContents
+) -> SpanContents:
+    if not isinstance(contents, CroppedSpanContents):
+        return highlighter.highlight(contents)
+    return CroppedSpanContents(
+        tuple(
+            replace(
+                part,
+                pieces=tuple(highlighter.highlight(piece) for piece in part.pieces),
+            )
+            if isinstance(part, CroppedLine)
+            else highlighter.highlight(part)
+            for part in contents.parts
+        ),
+        contents.column,
+    )
+
+
+def _join(before: SpanContents, after: SpanContents) -> SpanContents:
+    if isinstance(before, CroppedSpanContents) or isinstance(
+        after, CroppedSpanContents
+    ):
+        return CroppedSpanContents((*_parts(before), *_parts(after)), before.column)
+    return InMemorySpanContents(
+        text=before.text + after.text,
+        span=SourceSpan(before.span.start, after.span.end, before.span.source_id),
+        line=before.line,
+        column=before.column,
+        line_count=before.line_count + after.line_count + 1,
+        name=before.name,
+    )
+
+
+# The ranges within `columns` of each of `offsets`, in order, of the codepoints
+# `[line_start, line_end)` of a line, merging those which overlap or touch
+def _column_ranges(
+    line_start: int, line_end: int, offsets: Iterable[int], columns: int
+) -> list[tuple[int, int]]:
+    ranges: list[tuple[int, int]] = []
+    for offset in sorted(offsets):
+        start, end = max(line_start, offset - columns), min(line_end, offset + columns)
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+# Read the ranges of `line`, the `line_number`th of the source, which
+# `cropped_ranges` shows for any of `labels`
+def _read_cropped_line(
+    source_code: SlicingSourceCode,
+    line: SourceSpan,
+    line_number: int,
+    labels: Sequence[LabeledSpan],
+    columns: int,
+) -> CroppedLine:
+    ranges = _column_ranges(
+        line.start,
+        line.end,
+        [
+            line.start,
+            *(
+                offset
+                for label in labels
+                for offset in (label.span.start, label.span.end)
+                if line.start <= offset <= line.end
+            ),
+        ],
+        columns,
+    )
+    # The text of the line ends before its line break, which is only known once
+    # the range reaching it is read, so that range is read through the break
+    if ranges[-1][1] >= line.end - 1:
+        ranges[-1] = (min(ranges[-1][0], line.end - 1), line.end)
+
+    read = [
+        source_code.read_slice(SourceSpan(start, end, line.source_id))
+        for start, end in ranges
+    ]
+    pieces = tuple(
+        piece
+        for contents in read
+        for piece in (
+            contents.pieces if isinstance(contents, CroppedLine) else (contents,)
+        )
+    )
+    end = (
+        line.end - 1
+        if pieces
+        and pieces[-1].span.end == line.end
+        and pieces[-1].text.plain.endswith("\n")
+        else line.end
+    )
+    return CroppedLine(line, line_number, end, pieces, read[0].name)
+
+
+# Read the lines `read_span` reads for `span`, of which those longer than
+# `max_line_columns` only as far as `cropped_ranges` shows them for any of `labels`
+def _read_window(
+    source_code: SourceCode,
+    span: SourceSpan,
+    labels: Sequence[LabeledSpan],
+    limits: RenderLimits,
+) -> SpanContents:
+    max_columns = limits.max_line_columns
+    if max_columns is None or not isinstance(source_code, SlicingSourceCode):
+        return source_code.read_span(span)
+    lines = source_code.line_spans(span)
+    # Only lines longer than `max_columns` even without their line break are
+    # cropped, as they are certain to be cropped when rendered
+    if all(line.end - line.start - 1 <= max_columns for line in lines):
+        return source_code.read_span(span)
+
+    # Offsets at the start of a line resolve to the line before it, and every line
+    # has at least its last codepoint or line break, so one codepoint into a line
+    # resolves to it
+    first_line = source_code.read_slice(
+        SourceSpan(lines[0].start + 1, lines[0].start + 1, span.source_id)
+    ).line
+    parts: list[SpanContents] = []
+    run_start = None
+    for index, line in enumerate([*lines, None]):
+        if line is not None and line.end - line.start - 1 <= max_columns:
+            if run_start is None:
+                run_start = line.start
+            continue
+        if run_start is not None:
+            run_end = lines[-1].end if line is None else line.start
+            contents = source_code.read_span(
+                SourceSpan(run_start + 1, run_end, span.source_id)
+            )
+            parts.extend(_parts(contents))
+            run_start = None
+        if line is not None:
+            parts.append(
+                _read_cropped_line(
+                    source_code,
+                    line,
+                    first_line + index,
+                    labels,
+                    limits.label_columns,
+                )
+            )
+    return CroppedSpanContents(tuple(parts), span.start - lines[0].start)
+
+
+def _read_lines_between(
+    source_code: SourceCode,
+    before: SpanContents,
+    after: SpanContents,
+    labels: Sequence[LabeledSpan],
+    limits: RenderLimits,
+) -> SpanContents:
+    # `read_span` resolves an offset at the start of a line to the line before it,
+    # so the span starts one codepoint into the first line after `before`
+    with measure(Phase.READ) as measurement:
+        contents = _read_window(
+            source_code,
+            SourceSpan(before.span.end + 1, after.span.start, before.span.source_id),
+            labels,
+            limits,
+        )
+        if measurement is not None:
+            measurement.chars = chars_read(contents)
+    return contents
+
+
+def _read_windows(
+    source_code: SourceCode,
+    spans: Sequence[SourceSpan],
+    labels: Sequence[LabeledSpan],
+    limits: RenderLimits,
+) -> list[SpanContents]:
+    with measure(Phase.READ) as measurement:
+        if limits.max_line_columns is not None and isinstance(
+            source_code, SlicingSourceCode
+        ):
+            context_spans = []
+            for span in spans:
+                lines = source_code.line_spans(span, CONTEXT_LINES, CONTEXT_LINES)
+                context_spans.append(
+                    SourceSpan(lines[0].start, lines[-1].end, span.source_id)
+                )
+            with measure(Phase.UNION):
+                context_windows = SourceSpan.union(context_spans)
+            windows = [
+                _read_window(source_code, window, labels, limits)
+                for window in context_windows
+            ]
+        else:
+            windows = read_spans(source_code, spans, CONTEXT_LINES, CONTEXT_LINES)
+        if measurement is not None:
+            measurement.chars = sum(chars_read(window) for window in windows)
+    return windows
+
+
+# Join the windows of a block, reading the lines between them, smallest gaps first,
+# for as long as the block stays within `max_block_lines`
+def _fill(
+    source_code: SourceCode,
+    windows: list[SpanContents],
+    labels: Sequence[LabeledSpan],
+    limits: RenderLimits,
+    max_block_lines: int,
+) -> list[SpanContents]:
+    gaps = [
+        after.line - (before.line + before.line_count + 1)
+        for before, after in pairwise(windows)
+    ]
+    budget = max_block_lines - sum(window.line_count + 1 for window in windows)
+    filled = set()
+    for gap, index in sorted((gap, index) for index, gap in enumerate(gaps)):
+        if gap > budget:
+            break
+        budget -= gap
+        filled.add(index)
+
+    joined = [windows[0]]
+    for index, (before, after) in enumerate(pairwise(windows)):
+        if index not in filled:
+            joined.append(after)
+            continue
+        if gaps[index]:
+            joined[-1] = _join(
+                joined[-1],
+                _read_lines_between(source_code, before, after, labels, limits),
+            )
+        joined[-1] = _join(joined[-1], after)
+    return joined
+
+
+# The context window of an offset, and its lines, by the offsets they start at for
+# sources which implement `SlicingSourceCode`, or else by their line numbers
+class _Context(NamedTuple):
+    span: SourceSpan
+    lines: Sequence[int]
+
+
+def _context(source_code: SourceCode, offset: int, source_id: SourceId) -> _Context:
+    anchor = SourceSpan(offset, offset, source_id)
+    if isinstance(source_code, SlicingSourceCode):
+        lines = source_code.line_spans(anchor, CONTEXT_LINES, CONTEXT_LINES)
+        return _Context(
+            SourceSpan(lines[0].start, lines[-1].end, source_id),
+            [line.start for line in lines],
+        )
+    contents = source_code.read_span(anchor, CONTEXT_LINES, CONTEXT_LINES)
+    return _Context(
+        contents.span, range(contents.line, contents.line + contents.line_count + 1)
+    )
+
+
+# The offset `read_span` reads a window starting at `offset` from, which is the
+# start of the line before it unless it is the start of the source
+def _read_start(source_code: SourceCode, offset: int, source_id: SourceId) -> int:
+    anchor = SourceSpan(offset, offset, source_id)
+    if isinstance(source_code, SlicingSourceCode):
+        return source_code.line_spans(anchor)[0].start
+    return source_code.read_span(anchor).span.start
+
+
+# The lines `read_span` reads for the windows of each prefix of the ordered
+# `contexts`, merged as `SourceSpan.union` merges them
+def _lines_read(contexts: Iterable[_Context]) -> Iterator[int]:
+    total = 0
+    end = last = -1
+    for context in contexts:
+        if context.span.start > end:
+            total += len(context.lines) + (context.span.start > 0)
+        else:
+            total += sum(line > last for line in context.lines)
+        end, last = max(end, context.span.end), max(last, context.lines[-1])
+        yield total
+
+
+# How many of the first of the ordered `contexts` of a block are shown within
+# `max_lines`, and how many after them are not, so that the first and the last of
+# them are shown within half of it each. At least the first and the last are
+# shown, and the windows of either never merge.
+def _shown_contexts(contexts: Sequence[_Context], max_lines: int) -> tuple[int, int]:
+    totals = list(_lines_read(contexts))
+    if totals[-1] <= max_lines:
+        return len(contexts), 0
+    head = max(1, bisect_right(totals, max_lines // 2))
+
+    tail, total = len(contexts), totals[head - 1]
+    start = first = 0
+    for context in reversed(contexts[head:]):
+        lines = len(context.lines) + (context.span.start > 0)
+        if tail < len(contexts) and context.span.end >= start:
+            lines += sum(line < first for line in context.lines) - len(context.lines)
+            lines -= start > 0
+        if tail < len(contexts) and total + lines > max_lines:
+            break
+        tail, total = tail - 1, total + lines
+        start, first = context.span.start, context.lines[0]
+    while (
+        tail < len(contexts)
+        and contexts[tail].span.start <= contexts[head - 1].span.end
+    ):
+        tail += 1
+    if tail == len(contexts):
+        return len(contexts), 0
+    return head, tail - head
+
+
+def _read_contexts(
+    source_code: SourceCode,
+    contexts: Sequence[_Context],
+    labels: Sequence[LabeledSpan],
+    limits: RenderLimits,
+    max_block_lines: int,
+) -> list[SpanContents]:
+    with measure(Phase.READ) as measurement:
+        windows = [
+            _read_window(source_code, window, labels, limits)
+            for window in SourceSpan.union([context.span for context in contexts])
+        ]
+        if measurement is not None:
+            measurement.chars = sum(chars_read(window) for window in windows)
+    return _fill(source_code, windows, labels, limits, max_block_lines)
+
+
+# Read only the context windows of the start and the end of each label, as one
+# block per run of windows which labels span, and the lines between them as far as
+# `max_block_lines` allows. Of a block whose windows alone exceed it, only the
+# windows of its first and last labels are read, and the labels in between are
+# omitted. Without limits, this reads the same lines as reading the context windows
+# of the whole labels. Returns the blocks and the indices of the omitted labels.
+def _read_anchored_blocks(
+    source_code: SourceCode,
+    labels: Sequence[LabeledSpan],
+    limits: RenderLimits,
+    max_block_lines: int,
+) -> tuple[list[list[SpanContents]], set[int]]:
+    if not labels:
+        return [], set()
+    source_id = labels[0].source_id
+    anchors = sorted(
+        (offset, index)
+        for index, label in enumerate(labels)
+        for offset in (label.span.start, label.span.end)
+    )
+    with measure(Phase.UNION):
+        contexts = [_context(source_code, offset, source_id) for offset, _ in anchors]
+        # The windows of the contexts, merged as `SourceSpan.union` merges them, by
+        # the index of their first context
+        windows: list[tuple[int, SourceSpan]] = []
+        for index, context in enumerate(contexts):
+            if windows and context.span.start <= windows[-1][1].end:
+                first, window = windows[-1]
+                windows[-1] = (
+                    first,
+                    SourceSpan(
+                        window.start, max(window.end, context.span.end), source_id
+                    ),
+                )
+            else:
+                windows.append((index, context.span))
+
+    # Each window contains the ends of the labels it was read for, so the labels
+    # cover the whole gap between two windows only if one of them spans it
+    covered = SpanSet.from_spans([label.span for label in labels])
+    block_starts = [0]
+    for (_, before), (first, after) in pairwise(windows):
+        read_start = _read_start(source_code, after.start, source_id)
+        if not covered.contains(SourceSpan(before.end, read_start + 1, source_id)):
+            block_starts.append(first)
+
+    blocks = []
+    omitted: set[int] = set()
+    for start, end in pairwise([*block_starts, len(contexts)]):
+        block = contexts[start:end]
+        head, dropped = _shown_contexts(block, max_block_lines)
+        if not dropped:
+            blocks.append(
+                _read_contexts(source_code, block, labels, limits, max_block_lines)
+            )
+            continue
+        omitted.update(
+            index for _, index in anchors[start + head : start + head + dropped]
+        )
+        windows_read = _read_contexts(
+            source_code, block[:head], labels, limits, max_block_lines // 2
+        )
+        head_lines = sum(window.line_count + 1 for window in windows_read)
+        windows_read += _read_contexts(
+            source_code,
+            block[head + dropped :],
+            labels,
+            limits,
+            max_block_lines - head_lines,
+        )
+        blocks.append(windows_read)
+    return blocks, omitted
+
+
+# Every source block read for the labels of `diagnostic`, in order, including
+# blocks without any label to show. Once `max_report_lines` have been shown, the
+# rest of the labels are omitted, as are those in the middle of blocks longer than
+# the limits, which are counted after the last block.
+def _read_blocks(
+    diagnostic: Diagnostic, limits: RenderLimits
+) -> Iterator[SnippetBlock | OmittedLabels]:
+    if not diagnostic.labels or not isinstance(diagnostic, SourceMap):
+        return
+    labels_by_source: dict[SourceId, list[LabeledSpan]] = {}
+    for label in diagnostic.labels:
+        labels_by_source.setdefault(label.source_id, []).append(label)
+
+    sources = list(labels_by_source.items())
+    shown_lines = shown_labels = unresolved = 0
+    elided = False
+    for index, (source_id, labels) in enumerate(sources):
+        resolved = diagnostic.get_source(source_id)
+        if resolved is None:
+            unresolved += len(labels)
+            continue
+        source_code, highlighter = resolved
+
+        max_lines = [
+            max_lines
+            for max_lines in (limits.max_block_lines, limits.max_report_lines)
+            if max_lines is not None
+        ]
+        omitted: set[int] = set()
+        if max_lines:
+            blocks, omitted = _read_anchored_blocks(
+                source_code, labels, limits, min(max_lines)
+            )
+            elided = elided or bool(omitted)
+        else:
+            blocks = [
+                [window]
+                for window in _read_windows(
+                    source_code, [label.span for label in labels], labels, limits
+                )
+            ]
+
+        for windows in blocks:
+            start, end = windows[0].span.start, windows[-1].span.end
+            block = SnippetBlock(
+                windows,
+                [
+                    label
+                    for label_index, label in enumerate(labels)
+                    if label_index not in omitted
+                    and label.span.start < end
+                    and label.span.end > start
+                ],
+                highlighter,
+            )
+            if block.labels:
+                if (
+                    limits.max_report_lines is not None
+                    and shown_lines
+                    and shown_lines + block.line_count > limits.max_report_lines
+                ):
+                    unresolved += sum(
+                        len(later)
+                        for later_id, later in sources[index + 1 :]
+                        if diagnostic.get_source(later_id) is None
+                    )
+                    yield OmittedLabels(
+                        len(diagnostic.labels) - shown_labels - unresolved, unresolved
+                    )
+                    return
+                shown_lines += block.line_count
+                shown_labels += len(block.labels)
+            yield block
+
+    if elided:
+        yield OmittedLabels(
+            len(diagnostic.labels) - shown_labels - unresolved, unresolved
+        )
+
+
+# The source blocks of the labels of `diagnostic`, as shown by its report, in
+# order. Once `max_report_lines` have been shown, the rest are omitted.
+def snippet_blocks(
+    diagnostic: Diagnostic, limits: RenderLimits
+) -> Iterator[SnippetBlock | OmittedLabels]:
+    for block in _read_blocks(diagnostic, limits):
+        if isinstance(block, OmittedLabels) or block.labels:
+            yield block
+
+
+# The ranges of the codepoints `[line_start, line_end)` of a line shown when the
+# line is longer than `max_line_columns`, or `None` if it is shown in full
+def cropped_ranges(
+    line_start: int,
+    line_end: int,
+    labels: Sequence[LabeledSpan],
+    limits: RenderLimits | None,
+) -> list[tuple[int, int]] | None:
+    if (
+        limits is None
+        or limits.max_line_columns is None
+        or line_end - line_start <= limits.max_line_columns
+    ):
+        return None
+    offsets = [
+        offset
+        for label in labels
+        for offset in (label.span.start, label.span.end)
+        if line_start <= offset <= line_end
+    ] or [line_start]
+    return _column_ranges(line_start, line_end, offsets, limits.label_columns)
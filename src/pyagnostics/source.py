@@ -1,23 +1,34 @@
-from collections.abc import Iterator
-from contextlib import contextmanager
-from dataclasses import dataclass
-from typing import TYPE_CHECKING, Self
-
-from rich.text import Text
+import mmap
+import re
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+from itertools import accumulate
+from pathlib import Path
+from threading import Lock
+from types import TracebackType
+from typing import TYPE_CHECKING, Any, Self
 
+from pyagnostics.instrument import Phase, measure
 from pyagnostics.protocols import (
+    MultiSpanSourceCode,
+    SlicingSourceCode,
     SourceCode,
     SourceCodeHighlighter,
-    SourceMap,
     SourceSpan,
     SpanContents,
 )
-from pyagnostics.spans import SourceId
+from pyagnostics.scope import AmbientSource
+from pyagnostics.spans import Edit, LabeledSpan, SourceId, Utf8Index, remap_span
+
+if TYPE_CHECKING:
+    from rich.text import Text
 
 
 @dataclass
 class InMemorySpanContents:
-    text: Text
+    text: "Text"
     span: SourceSpan
     line: int
     column: int
@@ -25,80 +36,1055 @@ class InMemorySpanContents:
     name: str | None
 
 
+# A line of which only some ranges of codepoints were read, such as the columns
+# shown of a very long line. In the text of a `CroppedSpanContents`, it stands as
+# `…` and a line break.
+@dataclass(frozen=True, slots=True)
+class CroppedLine:
+    # The whole line, with its line break
+    span: SourceSpan
+    line: int
+    # The end of the text of the line, before its line break if that was read, or
+    # else the end of `span`
+    end: int
+    # The ranges read, each with exactly the codepoints of its span, in order
+    pieces: tuple[SpanContents, ...]
+    name: str | None = None
+
+    @property
+    def text(self: Self) -> "Text":
+        return _span_text("…\n")
+
+    @property
+    def column(self: Self) -> int:
+        return 0
+
+    @property
+    def line_count(self: Self) -> int:
+        return 0
+
+    # The piece containing the codepoints `[start, end)`, if any
+    def _piece(self: Self, start: int, end: int) -> SpanContents | None:
+        index = bisect_right([piece.span.start for piece in self.pieces], start) - 1
+        if index < 0 or end > self.pieces[index].span.end:
+            return None
+        return self.pieces[index]
+
+    # The text of the codepoints `[start, end)`, which must have been read
+    def slice(self: Self, start: int, end: int) -> "Text":
+        piece = self._piece(start, end)
+        if piece is None:
+            raise ValueError(f"Codepoints {start}:{end} of the line were not read")
+        return piece.text[start - piece.span.start : end - piece.span.start]
+
+    # `ranges` of the line if they were all read, or else the ranges which were
+    def shown(
+        self: Self, ranges: Sequence[tuple[int, int]] | None
+    ) -> list[tuple[int, int]]:
+        if ranges is not None and all(
+            self._piece(start, end) is not None for start, end in ranges
+        ):
+            return list(ranges)
+        return [
+            (piece.span.start, min(piece.span.end, self.end)) for piece in self.pieces
+        ]
+
+
+# The contents of a window of whole lines, some of which are cropped, see
+# `pyagnostics.snippets`
+@dataclass(frozen=True, slots=True)
+class CroppedSpanContents:
+    # Runs of whole lines and cropped lines, in order and without gaps
+    parts: tuple[SpanContents, ...]
+    column: int = 0
+
+    @property
+    def text(self: Self) -> "Text":
+        return _span_text("").join(part.text for part in self.parts)
+
+    @property
+    def span(self: Self) -> SourceSpan:
+        first, last = self.parts[0].span, self.parts[-1].span
+        return SourceSpan(first.start, last.end, source_id=first.source_id)
+
+    @property
+    def line(self: Self) -> int:
+        return self.parts[0].line
+
+    @property
+    def line_count(self: Self) -> int:
+        return sum(part.line_count + 1 for part in self.parts) - 1
+
+    @property
+    def name(self: Self) -> str | None:
+        return self.parts[0].name
+
+
 if TYPE_CHECKING:
-    _: type[SpanContents] = InMemorySpanContents
+    _: tuple[type[SpanContents], ...] = (
+        InMemorySpanContents,
+        CroppedLine,
+        CroppedSpanContents,
+    )
+
+
+# rich is only imported once a span is read, so that sources can be attached to
+# diagnostics without it, see `pyagnostics.exceptions`
+def _span_text(text: str) -> "Text":
+    from rich.text import Text  # noqa: PLC0415
+
+    return Text(text)
+
+
+def _locate_span(line_offsets: Sequence[int], span: SourceSpan) -> tuple[int, int]:
+    # Find the indices of the first and last lines touched by `span`, given the
+    # line start offsets of a source (terminated by the source length).
+    line_count = len(line_offsets) - 1
+
+    # The first line whose end is at or after the start of the span
+    start_line_idx = bisect_left(line_offsets, span.start, lo=1) - 1
+    if start_line_idx >= line_count:
+        raise ValueError("Span start is out of bounds")
+
+    # The first line (from the start line on) whose end is at or after the span end
+    end_line_idx = bisect_left(line_offsets, span.end, lo=start_line_idx + 1) - 1
+    if end_line_idx >= line_count:
+        raise ValueError("Span end is out of bounds")
+
+    return start_line_idx, end_line_idx
+
+
+# The spans of the lines `read_span` reads for `span` and its context, as in
+# `SlicingSourceCode.line_spans`
+def _line_spans(
+    line_offsets: Sequence[int],
+    span: SourceSpan,
+    context_lines_before: int,
+    context_lines_after: int,
+) -> list[SourceSpan]:
+    start_line_idx, end_line_idx = _locate_span(line_offsets, span)
+    context_start = max(0, start_line_idx - context_lines_before)
+    context_end = min(len(line_offsets) - 2, end_line_idx + context_lines_after)
+    return [
+        SourceSpan(line_offsets[idx], line_offsets[idx + 1], source_id=span.source_id)
+        for idx in range(context_start, context_end + 1)
+    ]
+
+
+# The contents of exactly `span`, given its `text`, as in
+# `SlicingSourceCode.read_slice`. Its lines are located as by `read_span`, so an
+# offset at the start of a line resolves to the line before it.
+def _slice_contents(
+    line_offsets: Sequence[int], span: SourceSpan, text: str, name: str | None
+) -> InMemorySpanContents:
+    if not 0 <= span.start <= span.end <= line_offsets[-1]:
+        raise ValueError("Span is out of bounds")
+    start_line_idx, end_line_idx = _locate_span(line_offsets, span)
+    return InMemorySpanContents(
+        text=_span_text(text),
+        span=span,
+        line=start_line_idx + 1,
+        column=span.start - line_offsets[start_line_idx],
+        line_count=end_line_idx - start_line_idx,
+        name=name,
+    )
+
+
+def _context_windows(
+    line_offsets: Sequence[int],
+    spans: Sequence[SourceSpan],
+    context_lines_before: int,
+    context_lines_after: int,
+) -> list[SourceSpan]:
+    # Equivalent to the `SourceSpan.union` of the context windows of `spans`, but
+    # resolved in a single sweep over the spans sorted by their start.
+    with measure(Phase.UNION):
+        if not spans:
+            return []
+        source_id = spans[0].source_id
+        if any(span.source_id != source_id for span in spans):
+            raise ValueError("Cannot merge spans from different sources")
+
+        last_line_idx = len(line_offsets) - 2
+        windows: list[tuple[int, int]] = []
+        for span in sorted(spans, key=lambda span: span.start):
+            start_line_idx, end_line_idx = _locate_span(line_offsets, span)
+            window_start = max(0, start_line_idx - context_lines_before)
+            window_end = min(last_line_idx, end_line_idx + context_lines_after)
+            if (
+                windows
+                and line_offsets[window_start] <= line_offsets[windows[-1][1] + 1]
+            ):
+                windows[-1] = (windows[-1][0], max(windows[-1][1], window_end))
+            else:
+                windows.append((window_start, window_end))
+
+        return [
+            SourceSpan(line_offsets[start], line_offsets[end + 1], source_id=source_id)
+            for start, end in windows
+        ]
+
+
+# Read the merged context windows of `spans` from `source_code`, in order.
+def read_spans(
+    source_code: SourceCode,
+    spans: Sequence[SourceSpan],
+    context_lines_before: int = 0,
+    context_lines_after: int = 0,
+) -> list[SpanContents]:
+    if isinstance(source_code, MultiSpanSourceCode):
+        return source_code.read_spans(spans, context_lines_before, context_lines_after)
+
+    context_spans: list[SourceSpan] = []
+    for span in spans:
+        span_contents = source_code.read_span(
+            span, context_lines_before, context_lines_after
+        )
+        context_spans.append(
+            SourceSpan(
+                span_contents.span.start,
+                span_contents.span.end,
+                source_id=span_contents.span.source_id,
+            )
+        )
+    with measure(Phase.UNION):
+        windows = SourceSpan.union(context_spans)
+    return [source_code.read_span(window) for window in windows]
 
 
 @dataclass
-class InMemorySource(SourceCode):
+class InMemorySource(MultiSpanSourceCode, SlicingSourceCode):
     source_code: str
     name: str | None = None
 
+    @cached_property
+    def _line_offsets(self: Self) -> list[int]:
+        # Codepoint offset of the start of every line, followed by the length of
+        # the source, so that line `i` spans `[offsets[i], offsets[i + 1])`.
+        return list(
+            accumulate(map(len, self.source_code.splitlines(keepends=True)), initial=0)
+        )
+
+    # Translates the UTF-8 byte offsets of the source to codepoint offsets, see
+    # `SourceSpan.from_byte_range`
+    @cached_property
+    def utf8_index(self: Self) -> Utf8Index:
+        return Utf8Index(self.source_code)
+
+    @property
+    def _addressable_lines(self: Self) -> int:
+        # An empty source, or one that ends in a line break, has a trailing empty
+        # line that offsets at the very end of the source resolve to.
+        line_count = len(self._line_offsets) - 1
+        if not self.source_code or self.source_code[-1:].splitlines() == [""]:
+            line_count += 1
+        return line_count
+
+    # Convert a codepoint offset to a 1-based line number and a 0-based column
+    def offset_to_line_col(self: Self, offset: int) -> tuple[int, int]:
+        line_offsets = self._line_offsets
+        if not 0 <= offset <= line_offsets[-1]:
+            raise ValueError(f"Offset {offset} is out of bounds")
+        line_idx = bisect_right(line_offsets, offset, hi=self._addressable_lines) - 1
+        return line_idx + 1, offset - line_offsets[line_idx]
+
+    # Convert a 1-based line number and a 0-based column to a codepoint offset
+    def line_col_to_offset(self: Self, line: int, column: int) -> int:
+        line_offsets = self._line_offsets
+        if not 1 <= line <= self._addressable_lines:
+            raise ValueError(f"Line {line} is out of bounds")
+        line_start = line_offsets[line - 1]
+        line_end = line_offsets[min(line, len(line_offsets) - 1)]
+        if not 0 <= column <= line_end - line_start:
+            raise ValueError(f"Column {column} is out of bounds for line {line}")
+        return line_start + column
+
     def read_span(
         self: Self,
         span: SourceSpan,
         context_lines_before: int = 0,
         context_lines_after: int = 0,
     ) -> SpanContents:
-        lines = self.source_code.splitlines(keepends=True)
+        line_offsets = self._line_offsets
+        start_line_idx, end_line_idx = _locate_span(line_offsets, span)
 
-        chars_before = 0
+        context_start = max(0, start_line_idx - context_lines_before)
+        context_end = min(len(line_offsets) - 2, end_line_idx + context_lines_after)
 
-        start_line_idx = None
-        for i, line in enumerate(lines):
-            if chars_before + len(line) >= span.start:
-                start_line_idx = i
-                break
-            chars_before += len(line)
+        chars_before_context = line_offsets[context_start]
+        chars_after_context = line_offsets[context_end + 1]
 
-        if start_line_idx is None:
-            raise ValueError("Span start is out of bounds")
+        return InMemorySpanContents(
+            text=_span_text(self.source_code[chars_before_context:chars_after_context]),
+            span=SourceSpan(
+                chars_before_context,
+                chars_after_context,
+                source_id=span.source_id,
+            ),
+            line=context_start + 1,
+            column=span.start - line_offsets[start_line_idx],
+            line_count=context_end - context_start,
+            name=self.name,
+        )
 
-        chars_in_lines = 0
-        end_line_idx = None
-        for i, line in enumerate(lines[start_line_idx:]):
-            chars_in_lines += len(line)
-            if chars_before + chars_in_lines >= span.end:
-                end_line_idx = i + start_line_idx
-                break
+    def read_spans(
+        self: Self,
+        spans: Sequence[SourceSpan],
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SpanContents]:
+        windows = _context_windows(
+            self._line_offsets, spans, context_lines_before, context_lines_after
+        )
+        return [self.read_span(window) for window in windows]
 
-        if end_line_idx is None:
-            raise ValueError("Span end is out of bounds")
+    def line_spans(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SourceSpan]:
+        return _line_spans(
+            self._line_offsets, span, context_lines_before, context_lines_after
+        )
+
+    def read_slice(self: Self, span: SourceSpan) -> SpanContents:
+        return _slice_contents(
+            self._line_offsets, span, self.source_code[span.start : span.end], self.name
+        )
+
+
+# Codepoint offsets of the start of every line of `window`, followed by its end. A
+# cropped line counts as one line.
+def _window_line_offsets(window: SpanContents) -> list[int]:
+    parts = window.parts if isinstance(window, CroppedSpanContents) else (window,)
+    line_offsets = [window.span.start]
+    for part in parts:
+        if isinstance(part, CroppedLine):
+            line_offsets.append(part.span.end)
+        else:
+            # Parts are contiguous, so each starts where the one before ends
+            line_offsets[-1:] = accumulate(
+                map(len, part.text.plain.splitlines(keepends=True)),
+                initial=part.span.start,
+            )
+    return line_offsets
 
-        context_start = max(0, start_line_idx - context_lines_before)
-        context_end = min(len(lines) - 1, end_line_idx + context_lines_after)
 
-        chars_before_context = sum(len(line) for line in lines[:context_start])
-        chars_before_start = sum(len(line) for line in lines[:start_line_idx])
-        column = span.start - chars_before_start
-        chars_in_lines = sum(
-            len(line) for line in lines[context_start : context_end + 1]
+# The index of the line of `offset`, where an offset at the start of a line
+# resolves to that line, unlike in `_locate_span`
+def _line_index(line_offsets: Sequence[int], offset: int) -> int:
+    return min(
+        max(0, bisect_right(line_offsets, offset) - 1), max(0, len(line_offsets) - 2)
+    )
+
+
+# The codepoints `[start, end)` of a cropped line, of which only those within its
+# pieces are read
+def _crop_slice(
+    crop: CroppedLine, start: int, end: int
+) -> InMemorySpanContents | CroppedLine:
+    source_id = crop.span.source_id
+    pieces = []
+    for piece in crop.pieces:
+        piece_start, piece_end = max(start, piece.span.start), min(end, piece.span.end)
+        if piece_start > piece_end or (piece_start == piece_end and start != end):
+            continue
+        offset = piece.span.start
+        pieces.append(
+            InMemorySpanContents(
+                text=piece.text[piece_start - offset : piece_end - offset],
+                span=SourceSpan(piece_start, piece_end, source_id=source_id),
+                line=crop.line,
+                column=piece_start - crop.span.start,
+                line_count=0,
+                name=crop.name,
+            )
         )
+    if len(pieces) == 1 and pieces[0].span == SourceSpan(
+        start, end, source_id=source_id
+    ):
+        return pieces[0]
+    return CroppedLine(
+        SourceSpan(start, end, source_id=source_id),
+        crop.line,
+        min(crop.end, end),
+        tuple(pieces),
+        crop.name,
+    )
+
+
+# A source holding only some windows of lines of a larger source, such as the
+# context windows of the labels of a diagnostic, with their text as read (and
+# possibly highlighted) from the full source. Windows may hold cropped lines, see
+# `CroppedSpanContents`, of which only the pieces read can be read again.
+#
+# Spans are read within the window containing them, so reading the same spans with
+# the same (or less) context as the windows were read with gives the same contents
+# as reading them from the full source.
+@dataclass
+class WindowedSource(MultiSpanSourceCode, SlicingSourceCode):
+    # Non-overlapping windows, in order of their start
+    windows: list[InMemorySpanContents | CroppedSpanContents]
+
+    def _window(self: Self, span: SourceSpan) -> tuple[SpanContents, list[int]]:
+        index = bisect_right([window.span.start for window in self.windows], span.start)
+        if index == 0 or span.end > self.windows[index - 1].span.end:
+            raise ValueError("Span is not within a window of the source")
+        window = self.windows[index - 1]
+        return window, _window_line_offsets(window)
 
+    # The codepoints `[start, end)` of `window`, which hold cropped lines either
+    # whole or within one of them, at the column of the line of `start_line_idx`
+    def _contents(
+        self: Self,
+        window: SpanContents,
+        line_offsets: list[int],
+        span: SourceSpan,
+        start_line_idx: int,
+        column: int,
+    ) -> SpanContents:
+        end_line_idx = max(start_line_idx, bisect_left(line_offsets, span.end) - 1)
+        parts = window.parts if isinstance(window, CroppedSpanContents) else (window,)
+
+        crop = next(
+            (
+                part
+                for part in parts
+                if isinstance(part, CroppedLine)
+                and part.span.start <= span.start
+                and span.end <= part.span.end
+                and (span.start, span.end) != (part.span.start, part.span.end)
+            ),
+            None,
+        )
+        if crop is not None:
+            sliced = _crop_slice(crop, span.start, span.end)
+            # A slice from the start of the cropped line is at the end of the line
+            # before it
+            if window.line + start_line_idx != crop.line:
+                if isinstance(sliced, CroppedLine):
+                    return replace(sliced, line=window.line + start_line_idx)
+                return replace(sliced, line=window.line + start_line_idx, column=column)
+            return sliced
+
+        read: list[SpanContents] = []
+        for part in parts:
+            part_start, part_end = part.span.start, part.span.end
+            if part_end <= span.start or part_start >= span.end:
+                continue
+            if isinstance(part, CroppedLine):
+                if part_start < span.start or part_end > span.end:
+                    raise ValueError("Span ends within a cropped line of the source")
+                read.append(part)
+                continue
+            start, end = max(span.start, part_start), min(span.end, part_end)
+            line_idx = (
+                start_line_idx
+                if start == span.start
+                else _line_index(line_offsets, start)
+            )
+            read.append(
+                InMemorySpanContents(
+                    text=part.text[start - part_start : end - part_start],
+                    span=SourceSpan(start, end, source_id=span.source_id),
+                    line=window.line + line_idx,
+                    column=start - line_offsets[line_idx],
+                    line_count=max(line_idx, bisect_left(line_offsets, end) - 1)
+                    - line_idx,
+                    name=part.name,
+                )
+            )
+
+        if any(isinstance(part, CroppedLine) for part in read):
+            return CroppedSpanContents(tuple(read), column)
         return InMemorySpanContents(
-            text=Text("".join(lines[context_start : context_end + 1])),
-            span=SourceSpan(
-                chars_before_context,
-                chars_before_context + chars_in_lines,
+            text=read[0].text
+            if len(read) == 1
+            else _span_text("").join(part.text for part in read),
+            span=SourceSpan(span.start, span.end, source_id=span.source_id),
+            line=window.line + start_line_idx,
+            column=column,
+            line_count=end_line_idx - start_line_idx,
+            name=window.name,
+        )
+
+    def read_span(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> SpanContents:
+        window, line_offsets = self._window(span)
+        start_line_idx, end_line_idx = _locate_span(line_offsets, span)
+
+        context_start = max(0, start_line_idx - context_lines_before)
+        context_end = min(len(line_offsets) - 2, end_line_idx + context_lines_after)
+
+        return self._contents(
+            window,
+            line_offsets,
+            SourceSpan(
+                line_offsets[context_start],
+                line_offsets[context_end + 1],
                 source_id=span.source_id,
             ),
+            context_start,
+            span.start - line_offsets[start_line_idx],
+        )
+
+    def read_spans(
+        self: Self,
+        spans: Sequence[SourceSpan],
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SpanContents]:
+        spans_by_window: dict[int, list[SourceSpan]] = {}
+        line_offsets_by_window: dict[int, list[int]] = {}
+        for span in spans:
+            window, line_offsets = self._window(span)
+            spans_by_window.setdefault(window.span.start, []).append(span)
+            line_offsets_by_window[window.span.start] = line_offsets
+
+        return [
+            self.read_span(context_window)
+            for window_start in sorted(spans_by_window)
+            for context_window in _context_windows(
+                line_offsets_by_window[window_start],
+                spans_by_window[window_start],
+                context_lines_before,
+                context_lines_after,
+            )
+        ]
+
+    def line_spans(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SourceSpan]:
+        _window, line_offsets = self._window(span)
+        return _line_spans(
+            line_offsets, span, context_lines_before, context_lines_after
+        )
+
+    def read_slice(self: Self, span: SourceSpan) -> SpanContents:
+        window, line_offsets = self._window(span)
+        start_line_idx, _end_line_idx = _locate_span(line_offsets, span)
+        return self._contents(
+            window,
+            line_offsets,
+            span,
+            start_line_idx,
+            span.start - line_offsets[start_line_idx],
+        )
+
+
+# A source that can be edited in place, for long-lived sessions where the source
+# changes by small edits, such as an editor integration.
+#
+# The text is held in a piece table, so an edit never copies the text of the
+# source, and only the lines around an edit are re-indexed. An edit still costs
+# O(pieces + lines), to shift the offsets of the pieces and lines after it. Once
+# there are more than `max_pieces` pieces, they are joined back into one.
+#
+# The last `max_edits` edits at least are recorded, so that spans read at an
+# earlier `version` can be remapped through the edits since, rather than
+# recomputed. Older edits are discarded, and spans read before them can no longer
+# be remapped.
+@dataclass
+class EditableSource(MultiSpanSourceCode, SlicingSourceCode):
+    initial_text: str = ""
+    name: str | None = None
+    max_edits: int | None = field(default=10_000, kw_only=True)
+    max_pieces: int = field(default=1024, kw_only=True)
+
+    # The edits made since version `_first_version`
+    edits: list[Edit] = field(default_factory=list, init=False)
+    _first_version: int = field(default=0, init=False, repr=False, compare=False)
+
+    # Pieces of the text, each a slice `buffer[start:end]` of either the initial
+    # text or an inserted text, and the offset in the source where each begins.
+    _pieces: list[tuple[str, int, int]] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+    _piece_starts: list[int] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+    # Codepoint offset of the start of every line, followed by the length of the
+    # source, as in `InMemorySource`
+    _line_offsets: list[int] = field(
+        default_factory=lambda: [0], init=False, repr=False, compare=False
+    )
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    def __post_init__(self: Self) -> None:
+        if self.initial_text:
+            self._pieces = [(self.initial_text, 0, len(self.initial_text))]
+            self._piece_starts = [0]
+            self._line_offsets = list(
+                accumulate(
+                    map(len, self.initial_text.splitlines(keepends=True)), initial=0
+                )
+            )
+
+    # Number of edits made to the source
+    @property
+    def version(self: Self) -> int:
+        return self._first_version + len(self.edits)
+
+    def __len__(self: Self) -> int:
+        return self._line_offsets[-1]
+
+    @property
+    def text(self: Self) -> str:
+        with self._lock:
+            return self._slice(0, len(self))
+
+    def _slice(self: Self, start: int, end: int) -> str:
+        pieces, piece_starts = self._pieces, self._piece_starts
+        index = max(0, bisect_right(piece_starts, start) - 1)
+        parts = []
+        while index < len(pieces) and piece_starts[index] < end:
+            buffer, piece_start, piece_end = pieces[index]
+            offset = piece_starts[index]
+            parts.append(
+                buffer[
+                    piece_start + max(0, start - offset) : min(
+                        piece_end, piece_start + end - offset
+                    )
+                ]
+            )
+            index += 1
+        return "".join(parts)
+
+    def _split(self: Self, offset: int) -> int:
+        # Split the piece containing `offset`, returning the index of the piece
+        # that starts at `offset`
+        pieces, piece_starts = self._pieces, self._piece_starts
+        index = bisect_right(piece_starts, offset) - 1
+        if index < 0 or piece_starts[index] == offset:
+            return max(0, index)
+        buffer, piece_start, piece_end = pieces[index]
+        cut = piece_start + offset - piece_starts[index]
+        if cut >= piece_end:
+            return index + 1
+        pieces[index : index + 1] = [
+            (buffer, piece_start, cut),
+            (buffer, cut, piece_end),
+        ]
+        piece_starts.insert(index + 1, offset)
+        return index + 1
+
+    # Replace the codepoints `[start, end)` of the source with `text`
+    def replace(self: Self, start: int, end: int, text: str) -> Edit:
+        with self._lock:
+            if not 0 <= start <= end <= len(self):
+                raise ValueError(f"Edit range {start}:{end} is out of bounds")
+            edit = Edit(start, end, len(text))
+
+            # The lines to re-index: those touched by the edit, and one line on
+            # either side, as the edit may join or split a `\r\n` line break
+            line_offsets = self._line_offsets
+            last_line_idx = max(0, len(line_offsets) - 2)
+            first = max(
+                0, min(bisect_right(line_offsets, start) - 1, last_line_idx) - 1
+            )
+            last = min(bisect_right(line_offsets, end) + 1, len(line_offsets) - 1)
+
+            lo = self._split(start)
+            hi = self._split(end)
+            self._pieces[lo:hi] = [(text, 0, len(text))] if text else []
+            self._piece_starts[lo:] = list(
+                accumulate(
+                    (
+                        piece_end - piece_start
+                        for _, piece_start, piece_end in self._pieces[lo:]
+                    ),
+                    initial=start,
+                )
+            )[:-1]
+
+            region_start = line_offsets[first]
+            region_end = line_offsets[last] + edit.delta
+            region = list(
+                accumulate(
+                    map(
+                        len,
+                        self._slice(region_start, region_end).splitlines(keepends=True),
+                    ),
+                    initial=region_start,
+                )
+            )
+            delta = edit.delta
+            region.pop()
+            region.extend([offset + delta for offset in line_offsets[last:]])
+            line_offsets[first:] = region
+
+            if len(self._pieces) > self.max_pieces:
+                self._compact()
+            self.edits.append(edit)
+            # Discarded in batches, so that each edit costs O(1) on average
+            if self.max_edits is not None and len(self.edits) >= 2 * self.max_edits:
+                discarded = len(self.edits) - self.max_edits
+                del self.edits[:discarded]
+                self._first_version += discarded
+            return edit
+
+    # Join the pieces into one, releasing the texts they were sliced from
+    def _compact(self: Self) -> None:
+        text = self._slice(0, len(self))
+        self._pieces = [(text, 0, len(text))] if text else []
+        self._piece_starts = [0] if text else []
+
+    def insert(self: Self, offset: int, text: str) -> Edit:
+        return self.replace(offset, offset, text)
+
+    def delete(self: Self, start: int, end: int) -> Edit:
+        return self.replace(start, end, "")
+
+    # Remap `span`, read at `version` of the source, through the edits since. See
+    # `pyagnostics.spans.remap_span`.
+    def remap_span(self: Self, span: SourceSpan, version: int) -> SourceSpan | None:
+        with self._lock:
+            if version < self._first_version:
+                raise ValueError(
+                    f"Edits before version {self._first_version} have been discarded"
+                )
+            edits = self.edits[version - self._first_version :]
+        remapped: SourceSpan | None = span
+        for edit in edits:
+            if remapped is None:
+                break
+            remapped = remap_span(remapped, edit)
+        return remapped
+
+    def remap_labeled_span(
+        self: Self, labeled_span: LabeledSpan, version: int
+    ) -> LabeledSpan | None:
+        span = self.remap_span(labeled_span.span, version)
+        if span is None:
+            return None
+        return LabeledSpan(span, labeled_span.label)
+
+    def read_span(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> SpanContents:
+        with self._lock:
+            line_offsets = self._line_offsets
+            start_line_idx, end_line_idx = _locate_span(line_offsets, span)
+
+            context_start = max(0, start_line_idx - context_lines_before)
+            context_end = min(len(line_offsets) - 2, end_line_idx + context_lines_after)
+
+            chars_before_context = line_offsets[context_start]
+            chars_after_context = line_offsets[context_end + 1]
+
+            return InMemorySpanContents(
+                text=_span_text(self._slice(chars_before_context, chars_after_context)),
+                span=SourceSpan(
+                    chars_before_context,
+                    chars_after_context,
+                    source_id=span.source_id,
+                ),
+                line=context_start + 1,
+                column=span.start - line_offsets[start_line_idx],
+                line_count=context_end - context_start,
+                name=self.name,
+            )
+
+    def read_spans(
+        self: Self,
+        spans: Sequence[SourceSpan],
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SpanContents]:
+        with self._lock:
+            windows = _context_windows(
+                self._line_offsets, spans, context_lines_before, context_lines_after
+            )
+        return [self.read_span(window) for window in windows]
+
+    def line_spans(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SourceSpan]:
+        with self._lock:
+            return _line_spans(
+                self._line_offsets, span, context_lines_before, context_lines_after
+            )
+
+    def read_slice(self: Self, span: SourceSpan) -> SpanContents:
+        with self._lock:
+            return _slice_contents(
+                self._line_offsets, span, self._slice(span.start, span.end), self.name
+            )
+
+
+_NEWLINE = re.compile("\n")
+_NEWLINE_BYTES = re.compile(b"\n")
+
+
+# A source backed by a read-only memory map of a file.
+#
+# The file is only opened once a span is first read, and the line index is built
+# in chunks, only as far into the file as the spans read so far require. Only the
+# bytes of the requested context window are ever decoded.
+#
+# Unlike `InMemorySource`, lines are only split on `\n` (which covers `\r\n`), and
+# `encoding` must be ASCII compatible, such as UTF-8 or Latin-1.
+@dataclass
+class FileSource(MultiSpanSourceCode, SlicingSourceCode):
+    path: Path
+    name: str | None = None
+    encoding: str = "utf-8"
+    # Minimum number of bytes to scan each time the line index is extended
+    chunk_size: int = 1 << 20
+
+    _data: mmap.mmap | bytes | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # Codepoint and byte offsets of the start of every indexed line, followed by
+    # the end of the last indexed line.
+    _line_offsets: list[int] = field(
+        default_factory=lambda: [0], init=False, repr=False, compare=False
+    )
+    _byte_offsets: list[int] = field(
+        default_factory=lambda: [0], init=False, repr=False, compare=False
+    )
+    _fully_indexed: bool = field(default=False, init=False, repr=False, compare=False)
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    def __post_init__(self: Self) -> None:
+        self.path = Path(self.path)
+
+    def __getstate__(self: Self) -> dict[str, Any]:
+        return {
+            "path": self.path,
+            "name": self.name,
+            "encoding": self.encoding,
+            "chunk_size": self.chunk_size,
+        }
+
+    def __setstate__(self: Self, state: dict[str, Any]) -> None:
+        self.__init__(**state)  # type: ignore[misc]
+
+    def __enter__(self: Self) -> Self:
+        return self
+
+    def __exit__(
+        self: Self,
+        _exc_type: type[BaseException] | None,
+        _exc_value: BaseException | None,
+        _traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    # Release the memory map. Reading a span again maps the file again.
+    def close(self: Self) -> None:
+        with self._lock:
+            if isinstance(self._data, mmap.mmap):
+                self._data.close()
+            self._data = None
+            self._line_offsets = [0]
+            self._byte_offsets = [0]
+            self._fully_indexed = False
+
+    # Must be called with the lock held
+    def _open(self: Self) -> mmap.mmap | bytes:
+        if self._data is None:
+            with self.path.open("rb") as file:
+                try:
+                    self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # Empty files cannot be mapped
+                    self._data = b""
+        return self._data
+
+    # Must be called with the lock held
+    def _index_chunk(self: Self) -> None:
+        data = self._open()
+        start = self._byte_offsets[-1]
+        stop = min(len(data), start + self.chunk_size)
+
+        # Always index whole lines, so that chunks never split a multibyte sequence
+        if stop < len(data):
+            newline = data.rfind(b"\n", start, stop)
+            if newline == -1:
+                newline = data.find(b"\n", stop)
+            stop = len(data) if newline == -1 else newline + 1
+
+        chunk = data[start:stop]
+        text = chunk.decode(self.encoding, errors="replace")
+        chars_before = self._line_offsets[-1]
+
+        self._byte_offsets.extend(
+            start + match.end() for match in _NEWLINE_BYTES.finditer(chunk)
+        )
+        self._line_offsets.extend(
+            chars_before + match.end() for match in _NEWLINE.finditer(text)
+        )
+
+        if stop == len(data):
+            if chunk and not chunk.endswith(b"\n"):
+                self._byte_offsets.append(stop)
+                self._line_offsets.append(chars_before + len(text))
+            self._fully_indexed = True
+
+    # Extend the line index until it covers `offset` and `min_lines` lines. Must be
+    # called with the lock held.
+    def _index_through(self: Self, offset: int, min_lines: int = 1) -> None:
+        while not self._fully_indexed and (
+            self._line_offsets[-1] < offset or len(self._line_offsets) <= min_lines
+        ):
+            self._index_chunk()
+
+    # The indices of the first and last lines of `span`, once the index covers them
+    # and `context_lines_after` lines after them. Must be called with the lock held.
+    def _locate(
+        self: Self, span: SourceSpan, context_lines_after: int = 0
+    ) -> tuple[int, int]:
+        self._index_through(span.end)
+        start_line_idx, end_line_idx = _locate_span(self._line_offsets, span)
+        self._index_through(span.end, end_line_idx + context_lines_after + 1)
+        return start_line_idx, end_line_idx
+
+    # The index and the map are only read with the lock held, as `close` may replace
+    # them on another thread. Only decoding happens outside of it.
+    def read_span(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> SpanContents:
+        with self._lock:
+            start_line_idx, end_line_idx = self._locate(span, context_lines_after)
+            line_offsets = self._line_offsets
+            byte_offsets = self._byte_offsets
+
+            context_start = max(0, start_line_idx - context_lines_before)
+            context_end = min(len(line_offsets) - 2, end_line_idx + context_lines_after)
+            window = self._open()[
+                byte_offsets[context_start] : byte_offsets[context_end + 1]
+            ]
+            window_span = SourceSpan(
+                line_offsets[context_start],
+                line_offsets[context_end + 1],
+                source_id=span.source_id,
+            )
+            column = span.start - line_offsets[start_line_idx]
+
+        return InMemorySpanContents(
+            text=_span_text(window.decode(self.encoding, errors="replace")),
+            span=window_span,
             line=context_start + 1,
             column=column,
             line_count=context_end - context_start,
             name=self.name,
         )
 
+    def read_spans(
+        self: Self,
+        spans: Sequence[SourceSpan],
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SpanContents]:
+        with self._lock:
+            if spans:
+                max_end = max(span.end for span in spans)
+                self._index_through(max_end)
+                max_end_line_idx = bisect_left(self._line_offsets, max_end, lo=1) - 1
+                self._index_through(max_end, max_end_line_idx + context_lines_after + 1)
+
+            windows = _context_windows(
+                self._line_offsets, spans, context_lines_before, context_lines_after
+            )
+        return [self.read_span(window) for window in windows]
+
+    def line_spans(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> list[SourceSpan]:
+        with self._lock:
+            self._locate(span, context_lines_after)
+            return _line_spans(
+                self._line_offsets, span, context_lines_before, context_lines_after
+            )
+
+    # Only the bytes up to the end of `span` are decoded, from the start of its line
+    def read_slice(self: Self, span: SourceSpan) -> SpanContents:
+        with self._lock:
+            self._index_through(span.end)
+            line_offsets = self._line_offsets
+            if not 0 <= span.start <= span.end <= line_offsets[-1]:
+                raise ValueError("Span is out of bounds")
+            start_line_idx, end_line_idx = _locate_span(line_offsets, span)
+
+            line_start = line_offsets[start_line_idx]
+            byte_start = self._byte_offsets[start_line_idx]
+            # No codepoint is encoded in more than 4 bytes
+            byte_end = min(
+                self._byte_offsets[end_line_idx + 1],
+                byte_start + 4 * (span.end - line_start),
+            )
+            chunk = self._open()[byte_start:byte_end]
+        text = chunk.decode(self.encoding, errors="replace")
+        # The offsets are only ever appended to, or replaced as a whole by `close`
+        return _slice_contents(
+            line_offsets,
+            span,
+            text[span.start - line_start : span.end - line_start],
+            self.name,
+        )
+
+
+# Resolve the name of the source of `span`, and the 1-based line and 0-based column
+# of its start. At most the line the span starts on is read.
+def span_location(
+    source_code: SourceCode, span: SourceSpan
+) -> tuple[str | None, int, int]:
+    if isinstance(source_code, InMemorySource):
+        return source_code.name, *source_code.offset_to_line_col(span.start)
+
+    start = SourceSpan(span.start, span.start, source_id=span.source_id)
+    if isinstance(source_code, SlicingSourceCode):
+        contents = source_code.read_slice(start)
+        line_lengths = [
+            line.end - line.start for line in source_code.line_spans(start)[:1]
+        ]
+    else:
+        contents = source_code.read_span(start)
+        line_lengths = [
+            len(line) for line in contents.text.plain.splitlines(keepends=True)[:1]
+        ]
+    # `read_span` resolves an offset at the start of a line to the end of the
+    # line before it.
+    if line_lengths and contents.column >= line_lengths[0]:
+        return contents.name, contents.line + 1, contents.column - line_lengths[0]
+    return contents.name, contents.line, contents.column
+
+
+# Resolve the 1-based line and 0-based column of the start of `span`
+def span_line_col(source_code: SourceCode, span: SourceSpan) -> tuple[int, int]:
+    _name, line, column = span_location(source_code, span)
+    return line, column
+
 
-@contextmanager
+# Make `source_code` active for the diagnostics created within the block, see
+# `AmbientSource`, which also supports `async with`. Other diagnostics, created
+# within the block but not raised through it, resolve the source through
+# `source_registry` until the block exits.
 def attach_diagnostic_source_code(
     source_code: SourceCode,
     highlighter: SourceCodeHighlighter | None = None,
     *,
     source_id: SourceId,
-) -> Iterator[SourceId]:
-    try:
-        yield source_id
-    except Exception as e:
-        if isinstance(e, SourceMap):
-            raise e.add_source(source_id, source_code, highlighter=highlighter)
-        raise
+) -> AmbientSource:
+    return AmbientSource(source_code, highlighter, source_id=source_id, registered=True)
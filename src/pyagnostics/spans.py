@@ -1,15 +1,18 @@
-from collections.abc import Iterator, Sequence
-from dataclasses import dataclass
-from itertools import count
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass, field
+from itertools import accumulate, count
 from threading import Lock
-from typing import ClassVar, Self
+from typing import TYPE_CHECKING, ClassVar, NamedTuple, Self
 
-from rich.console import RenderableType
-from rich.style import Style
-from rich.text import Span
+if TYPE_CHECKING:
+    from rich.console import RenderableType
+    from rich.style import Style
+    from rich.text import Span
 
 
-@dataclass(eq=True, frozen=True, init=False)
+@dataclass(eq=True, frozen=True, init=False, slots=True)
 class SourceId:
     value: int
     _counter: ClassVar[Iterator[int]] = count(1)
@@ -29,7 +32,7 @@ class SourceId:
 
 
 # Represents a span of codepoints in a source code
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class SourceSpan:
     # Starting codepoint index of the span, inclusive
     start: int
@@ -38,9 +41,24 @@ class SourceSpan:
     # Source identifier for this span
     source_id: SourceId
 
-    def styled(self: Self, style: Style | str) -> Span:
+    def styled(self: Self, style: "Style | str") -> "Span":
+        from rich.text import Span  # noqa: PLC0415
+
         return Span(self.start, self.end, style)
 
+    # The span of the UTF-8 bytes `[start, end)` of the text indexed by `index`
+    @staticmethod
+    def from_byte_range(
+        start: int, end: int, source_id: SourceId, index: "Utf8Index"
+    ) -> "SourceSpan":
+        return SourceSpan(
+            index.to_char_offset(start), index.to_char_offset(end), source_id=source_id
+        )
+
+    # The UTF-8 byte offsets of the span in the text indexed by `index`
+    def byte_range(self: Self, index: "Utf8Index") -> tuple[int, int]:
+        return index.to_byte_offset(self.start), index.to_byte_offset(self.end)
+
     @staticmethod
     def enclose(start: "SourceSpan", end: "SourceSpan") -> "SourceSpan":
         if start.source_id != end.source_id:
@@ -54,24 +72,388 @@ class SourceSpan:
         first_source_id = spans[0].source_id
         if any(span.source_id != first_source_id for span in spans):
             raise ValueError("Cannot merge spans from different sources")
-        spans = sorted(spans, key=lambda span: span.start)
-        merged = [spans[0]]
-        for span in spans[1:]:
-            last = merged[-1]
-            if span.start <= last.end:
-                merged[-1] = SourceSpan(
-                    last.start, max(last.end, span.end), source_id=first_source_id
-                )
-            else:
-                merged.append(span)
-        return merged
+        return SpanSet.from_spans(spans).spans(first_source_id)
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class LabeledSpan:
     span: SourceSpan
-    label: RenderableType
+    label: "RenderableType"
 
     @property
     def source_id(self) -> SourceId:
         return self.span.source_id
+
+
+# Replacement of the codepoints `[start, end)` of a source with `length` new ones
+@dataclass(eq=True, frozen=True, slots=True)
+class Edit:
+    start: int
+    end: int
+    length: int
+
+    # Change in the length of the source
+    @property
+    def delta(self: Self) -> int:
+        return self.length - (self.end - self.start)
+
+
+# Shift `span` through `edit` of its source, so that it covers the same text after
+# the edit. A span containing the edit (or exactly replaced by it) grows or shrinks
+# with it, and one partially overlapping it is cut down to its remaining text.
+# Returns `None` if the edit replaced the text of the span along with more text.
+def remap_span(span: SourceSpan, edit: Edit) -> SourceSpan | None:
+    if span.end <= edit.start:
+        return span
+    if span.start >= edit.end:
+        return SourceSpan(
+            span.start + edit.delta, span.end + edit.delta, source_id=span.source_id
+        )
+    if span.start <= edit.start and edit.end <= span.end:
+        return SourceSpan(span.start, span.end + edit.delta, source_id=span.source_id)
+    if edit.start <= span.start and span.end <= edit.end:
+        return None
+    if span.start < edit.start:
+        return SourceSpan(span.start, edit.start, source_id=span.source_id)
+    return SourceSpan(
+        edit.start + edit.length, span.end + edit.delta, source_id=span.source_id
+    )
+
+
+def remap_labeled_span(labeled_span: LabeledSpan, edit: Edit) -> LabeledSpan | None:
+    span = remap_span(labeled_span.span, edit)
+    if span is None:
+        return None
+    return LabeledSpan(span, labeled_span.label)
+
+
+# Stores many spans as parallel arrays of their start, end and source id value,
+# rather than as one `SourceSpan` each, for callers which create far more spans
+# than they end up labeling. `SourceSpan`s are only created when indexed. Queries
+# bisect the spans in order of their start, which are only sorted again once spans
+# are appended.
+@dataclass
+class SpanTable:
+    starts: "array[int]" = field(default_factory=lambda: array("q"))
+    ends: "array[int]" = field(default_factory=lambda: array("q"))
+    # `SourceId.value` of each span
+    source_ids: "array[int]" = field(default_factory=lambda: array("q"))
+
+    _source_ids: dict[int, SourceId] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _order: "_SpanOrder | None" = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    @classmethod
+    def from_spans(cls, spans: Iterable[SourceSpan]) -> "SpanTable":
+        table = cls()
+        table.extend(spans)
+        return table
+
+    def append(self: Self, start: int, end: int, source_id: SourceId) -> int:
+        self._source_ids.setdefault(source_id.value, source_id)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.source_ids.append(source_id.value)
+        return len(self.starts) - 1
+
+    def add(self: Self, span: SourceSpan) -> int:
+        return self.append(span.start, span.end, span.source_id)
+
+    def extend(self: Self, spans: Iterable[SourceSpan]) -> None:
+        for span in spans:
+            self.append(span.start, span.end, span.source_id)
+
+    def _source_id(self: Self, value: int) -> SourceId:
+        source_id = self._source_ids.get(value)
+        if source_id is None:
+            # The arrays were filled directly, rather than through `append`
+            source_id = self._source_ids[value] = SourceId.unsafe_from_value(value)
+        return source_id
+
+    def __len__(self: Self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self: Self, index: int) -> SourceSpan:
+        return SourceSpan(
+            self.starts[index],
+            self.ends[index],
+            self._source_id(self.source_ids[index]),
+        )
+
+    def __iter__(self: Self) -> Iterator[SourceSpan]:
+        for start, end, source_id in zip(self.starts, self.ends, self.source_ids):
+            yield SourceSpan(start, end, self._source_id(source_id))
+
+    # Same as `SourceSpan.enclose(self[start_index], self[end_index])`
+    def enclose(self: Self, start_index: int, end_index: int) -> SourceSpan:
+        if self.source_ids[start_index] != self.source_ids[end_index]:
+            raise ValueError("Cannot enclose spans from different sources")
+        return SourceSpan(
+            self.starts[start_index],
+            self.ends[end_index],
+            self._source_id(self.source_ids[start_index]),
+        )
+
+    # The spans in order of their start, sorted on the first query once spans are
+    # added
+    def _sorted(self: Self) -> "_SpanOrder":
+        order = self._order
+        if order is None or len(order.indices) != len(self.starts):
+            starts, ends = self.starts, self.ends
+            indices = array("q", sorted(range(len(starts)), key=starts.__getitem__))
+            order = self._order = _SpanOrder(
+                indices,
+                array("q", (starts[index] for index in indices)),
+                array("q", accumulate((ends[index] for index in indices), max)),
+            )
+        return order
+
+    # Same as `SourceSpan.union` over all spans of the table, as a new table
+    def union(self: Self) -> "SpanTable":
+        merged = SpanTable()
+        if not self.starts:
+            return merged
+        first_source_id = self.source_ids[0]
+        if self.source_ids.count(first_source_id) != len(self.source_ids):
+            raise ValueError("Cannot merge spans from different sources")
+
+        starts, ends = self.starts, self.ends
+        order = self._sorted().indices
+        merged_start, merged_end = starts[order[0]], ends[order[0]]
+        for index in order:
+            start, end = starts[index], ends[index]
+            if start <= merged_end:
+                merged_end = max(merged_end, end)
+            else:
+                merged.starts.append(merged_start)
+                merged.ends.append(merged_end)
+                merged_start, merged_end = start, end
+        merged.starts.append(merged_start)
+        merged.ends.append(merged_end)
+        merged.source_ids = array("q", [first_source_id]) * len(merged.starts)
+        merged._source_ids[first_source_id] = self._source_id(first_source_id)
+        return merged
+
+    # Indices of the spans overlapping `span`, in order
+    def overlapping(self: Self, span: SourceSpan) -> list[int]:
+        start, end, source_id = span.start, span.end, span.source_id.value
+        order = self._sorted()
+        # The spans before `first` all end at or before the start of `span`, and
+        # those from `last` start at or after its end
+        first = bisect_right(order.max_ends, start)
+        last = bisect_left(order.starts, end)
+        ends, source_ids = self.ends, self.source_ids
+        return sorted(
+            index
+            for index in order.indices[first:last]
+            if ends[index] > start and source_ids[index] == source_id
+        )
+
+
+# The indices of the spans of a `SpanTable` in order of their start, their starts,
+# and the greatest end of the spans up to each
+class _SpanOrder(NamedTuple):
+    indices: "array[int]"
+    starts: "array[int]"
+    max_ends: "array[int]"
+
+
+# The codepoints covered by spans of one or more sources, as the disjoint spans of
+# each source which cover them, in order. Adding a span coalesces it with every
+# span it overlaps or touches, as `SourceSpan.union` does.
+#
+# Added spans are only coalesced with the spans of their source by the next query,
+# in one sort of both, so that adding spans in any order costs one sort overall,
+# rather than an insertion each. The coalesced spans of each source are kept in
+# order, along with arrays of their starts and ends, which queries bisect. A span
+# is only created for the spans it coalesces.
+@dataclass
+class SpanSet:
+    _intervals: dict[SourceId, "_Intervals"] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # The spans of each source added since the last query, in the order their
+    # sources were first added
+    _added: dict[SourceId, list[SourceSpan]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    @classmethod
+    def from_spans(cls, spans: Iterable[SourceSpan]) -> "SpanSet":
+        span_set = cls()
+        span_set.update(spans)
+        return span_set
+
+    def add(self: Self, span: SourceSpan) -> None:
+        added = self._added.get(span.source_id)
+        if added is None:
+            added = self._added[span.source_id] = []
+        added.append(span)
+
+    def update(self: Self, spans: Iterable[SourceSpan]) -> None:
+        for span in spans:
+            self.add(span)
+
+    # Coalesce the added spans with the spans of their sources
+    def _coalesce_added(self: Self) -> None:
+        for source_id, added in self._added.items():
+            intervals = self._intervals.get(source_id)
+            spans = added if intervals is None else [*intervals.spans, *added]
+            spans.sort(key=_span_start)
+            self._intervals[source_id] = _coalesce(spans)
+        self._added.clear()
+
+    def _source_intervals(self: Self, source_id: SourceId) -> "_Intervals | None":
+        if self._added:
+            self._coalesce_added()
+        return self._intervals.get(source_id)
+
+    # Whether every codepoint of `span` is covered, or its offset if it is empty
+    def contains(self: Self, span: SourceSpan) -> bool:
+        intervals = self._source_intervals(span.source_id)
+        if intervals is None:
+            return False
+        index = bisect_right(intervals.starts, span.start) - 1
+        return index >= 0 and intervals.ends[index] >= span.end
+
+    # The spans of the set overlapping `span`, in order
+    def overlapping(self: Self, span: SourceSpan) -> list[SourceSpan]:
+        intervals = self._source_intervals(span.source_id)
+        if intervals is None:
+            return []
+        first = bisect_right(intervals.ends, span.start)
+        last = bisect_left(intervals.starts, span.end)
+        return intervals.spans[first:last]
+
+    # The spans of the set in the source `source_id`, in order
+    def spans(self: Self, source_id: SourceId) -> list[SourceSpan]:
+        intervals = self._source_intervals(source_id)
+        return [] if intervals is None else intervals.spans[:]
+
+    @property
+    def source_ids(self: Self) -> list[SourceId]:
+        if self._added:
+            self._coalesce_added()
+        return list(self._intervals)
+
+    def __len__(self: Self) -> int:
+        if self._added:
+            self._coalesce_added()
+        return sum(len(intervals.spans) for intervals in self._intervals.values())
+
+    # The spans of each source in order, by the source first added
+    def __iter__(self: Self) -> Iterator[SourceSpan]:
+        if self._added:
+            self._coalesce_added()
+        for intervals in self._intervals.values():
+            yield from intervals.spans
+
+
+class _Intervals(NamedTuple):
+    starts: "array[int]"
+    ends: "array[int]"
+    spans: list[SourceSpan]
+
+
+def _span_start(span: SourceSpan) -> int:
+    return span.start
+
+
+# The disjoint spans covering `spans`, sorted by their start
+def _coalesce(spans: list[SourceSpan]) -> _Intervals:
+    starts, ends, coalesced = [], [], []
+    first = spans[0]
+    merged_start, merged_end = first.start, first.end
+    for span in spans:
+        if span.start <= merged_end:
+            merged_end = max(merged_end, span.end)
+            continue
+        if first.start != merged_start or first.end != merged_end:
+            first = SourceSpan(merged_start, merged_end, first.source_id)
+        starts.append(merged_start)
+        ends.append(merged_end)
+        coalesced.append(first)
+        first = span
+        merged_start, merged_end = span.start, span.end
+    if first.start != merged_start or first.end != merged_end:
+        first = SourceSpan(merged_start, merged_end, first.source_id)
+    starts.append(merged_start)
+    ends.append(merged_end)
+    coalesced.append(first)
+    return _Intervals(array("q", starts), array("q", ends), coalesced)
+
+
+# Translates between the UTF-8 byte offsets and the codepoint offsets of `text`,
+# such as those produced by tokenizers working on bytes.
+#
+# The index holds the byte and codepoint offset of a checkpoint every `interval`
+# codepoints, built once by encoding the text in chunks. An offset is translated by
+# bisecting the checkpoints, and only decoding (or encoding) the text between the
+# nearest checkpoint and the offset. Chunks of only ASCII need neither, and a text
+# of only ASCII needs no checkpoints.
+@dataclass
+class Utf8Index:
+    text: str = field(repr=False)
+    interval: int = 128
+
+    # Byte and codepoint offsets of every checkpoint, followed by the end of the text
+    byte_offsets: "array[int]" = field(init=False, repr=False, compare=False)
+    char_offsets: "array[int]" = field(init=False, repr=False, compare=False)
+    _data: bytes = field(default=b"", init=False, repr=False, compare=False)
+
+    def __post_init__(self: Self) -> None:
+        text, interval = self.text, self.interval
+        if text.isascii():
+            self.byte_offsets = array("q", [0, len(text)])
+            self.char_offsets = array("q", [0, len(text)])
+            return
+        self._data = text.encode("utf-8", "surrogatepass")
+        starts = range(0, len(text), interval)
+        self.char_offsets = array("q", starts)
+        self.char_offsets.append(len(text))
+        self.byte_offsets = array(
+            "q",
+            accumulate(
+                (
+                    len(text[start : start + interval].encode("utf-8", "surrogatepass"))
+                    for start in starts
+                ),
+                initial=0,
+            ),
+        )
+
+    def to_char_offset(self: Self, byte_offset: int) -> int:
+        byte_offsets, char_offsets = self.byte_offsets, self.char_offsets
+        if not 0 <= byte_offset <= byte_offsets[-1]:
+            raise ValueError(f"Byte offset {byte_offset} is out of bounds")
+        index = bisect_right(byte_offsets, byte_offset) - 1
+        byte_start, char_start = byte_offsets[index], char_offsets[index]
+        if byte_offset == byte_start:
+            return char_start
+        if byte_offsets[index + 1] - byte_start == char_offsets[index + 1] - char_start:
+            return char_start + byte_offset - byte_start
+        try:
+            return char_start + len(
+                self._data[byte_start:byte_offset].decode("utf-8", "surrogatepass")
+            )
+        except UnicodeDecodeError:
+            raise ValueError(
+                f"Byte offset {byte_offset} is within a UTF-8 sequence"
+            ) from None
+
+    def to_byte_offset(self: Self, char_offset: int) -> int:
+        byte_offsets, char_offsets = self.byte_offsets, self.char_offsets
+        if not 0 <= char_offset <= char_offsets[-1]:
+            raise ValueError(f"Offset {char_offset} is out of bounds")
+        index = bisect_right(char_offsets, char_offset) - 1
+        byte_start, char_start = byte_offsets[index], char_offsets[index]
+        if char_offset == char_start:
+            return byte_start
+        if byte_offsets[index + 1] - byte_start == char_offsets[index + 1] - char_start:
+            return byte_start + char_offset - char_start
+        return byte_start + len(
+            self.text[char_start:char_offset].encode("utf-8", "surrogatepass")
+        )
@@ -0,0 +1,373 @@
+import io
+import pickle
+from collections.abc import Iterable
+from functools import cache
+from typing import Any
+
+from rich.console import RenderableType
+from rich.markup import escape
+from rich.text import Span, Text
+
+from pyagnostics.exceptions import DiagnosticError, _suppressed_frames
+from pyagnostics.frames import (
+    _CAPTURED_FRAMES_ATTR,
+    Frame,
+    OmittedFrames,
+    RepeatedFrames,
+    StackEntry,
+    extract_frames,
+    walk_causes_and_stacks,
+)
+from pyagnostics.lazy import evaluate
+from pyagnostics.plain import plain_text
+from pyagnostics.protocols import Diagnostic, SpanContents
+from pyagnostics.severity import Severity
+from pyagnostics.snippets import (
+    RenderLimits,
+    SnippetBlock,
+    _read_blocks,
+    highlight_window,
+)
+from pyagnostics.source import (
+    CroppedLine,
+    CroppedSpanContents,
+    InMemorySpanContents,
+    WindowedSource,
+)
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+_WIRE_VERSION = 3
+# Version 2 added folded and omitted frames, and version 3 cropped lines, which
+# versions before never send
+_READABLE_WIRE_VERSIONS = frozenset({1, 2, _WIRE_VERSION})
+
+# The wire format of a diagnostic is a tuple of only builtin values (tuples, lists,
+# strings, integers and `None`), pickled. Unpickling refuses any other type, so
+# decoding untrusted data cannot run arbitrary code.
+#
+# Renderables are sent as console markup strings, or as `Text` with its spans.
+# Other renderables are sent as their plain text. Exceptions in the cause chain
+# are sent as their frame records, and are received as placeholder exceptions of
+# the same module and name. Frames hidden by `supress_diagnostic_frames` in the
+# sending process are not sent, as the receiving process may not hide them. Of the
+# sources, only the windows which the labels are rendered with under the default
+# `RenderLimits` are sent, already highlighted, and of their long lines only the
+# columns shown.
+
+
+def _encode_renderable(renderable: RenderableType | None) -> Any:  # noqa: ANN401
+    renderable = evaluate(renderable)
+    if renderable is None or isinstance(renderable, str):
+        return renderable
+    if isinstance(renderable, Text):
+        return (
+            renderable.plain,
+            str(renderable.style),
+            renderable.end,
+            [(span.start, span.end, str(span.style)) for span in renderable.spans],
+        )
+    return escape(plain_text(renderable))
+
+
+def _decode_renderable(value: Any) -> Any:  # noqa: ANN401
+    if value is None or isinstance(value, str):
+        return value
+    plain, style, end, spans = value
+    return Text(plain, style=style, end=end, spans=[Span(*span) for span in spans])
+
+
+# Frames are sent as a tuple of their fields, repeated frames as their count and
+# frames, and omitted frames as their count.
+def _encode_frames(frames: Iterable[StackEntry]) -> list[tuple[Any, ...]]:
+    encoded: list[tuple[Any, ...]] = []
+    for entry in frames:
+        match entry:
+            case Frame():
+                encoded.append(tuple(entry))
+            case RepeatedFrames(repeated, count):
+                encoded.append((count, [tuple(frame) for frame in repeated]))
+            case OmittedFrames(count):
+                encoded.append((count,))
+    return encoded
+
+
+def _decode_frames(frames: list[tuple[Any, ...]]) -> tuple[StackEntry, ...]:
+    decoded: list[StackEntry] = []
+    for entry in frames:
+        match entry:
+            case (count,):
+                decoded.append(OmittedFrames(count))
+            case (count, repeated):
+                decoded.append(
+                    RepeatedFrames(tuple(Frame(*frame) for frame in repeated), count)
+                )
+            case _:
+                decoded.append(Frame(*entry))
+    return tuple(decoded)
+
+
+# The text of a window, or for a window with cropped lines, its runs of whole lines
+# and the pieces read of its cropped lines
+def _encode_window_body(contents: SpanContents) -> Any:  # noqa: ANN401
+    if not isinstance(contents, CroppedSpanContents):
+        return _encode_renderable(contents.text)
+    return [
+        (
+            "cropped",
+            part.span.start,
+            part.span.end,
+            part.line,
+            part.end,
+            [
+                (
+                    piece.span.start,
+                    piece.span.end,
+                    piece.column,
+                    _encode_renderable(piece.text),
+                )
+                for piece in part.pieces
+            ],
+        )
+        if isinstance(part, CroppedLine)
+        else (
+            "lines",
+            part.span.start,
+            part.span.end,
+            part.line,
+            part.line_count,
+            _encode_renderable(part.text),
+        )
+        for part in contents.parts
+    ]
+
+
+def _decode_window(
+    window: tuple[Any, ...], source_id: SourceId
+) -> InMemorySpanContents | CroppedSpanContents:
+    start, end, line, column, line_count, name, body = window
+    if not isinstance(body, list):
+        return InMemorySpanContents(
+            text=_decode_renderable(body),
+            span=SourceSpan(start, end, source_id),
+            line=line,
+            column=column,
+            line_count=line_count,
+            name=name,
+        )
+    parts: list[SpanContents] = []
+    for part in body:
+        match part:
+            case ("lines", start, end, line, line_count, text):
+                parts.append(
+                    InMemorySpanContents(
+                        text=_decode_renderable(text),
+                        span=SourceSpan(start, end, source_id),
+                        line=line,
+                        column=0,
+                        line_count=line_count,
+                        name=name,
+                    )
+                )
+            case ("cropped", start, end, line, text_end, pieces):
+                parts.append(
+                    CroppedLine(
+                        SourceSpan(start, end, source_id),
+                        line,
+                        text_end,
+                        tuple(
+                            InMemorySpanContents(
+                                text=_decode_renderable(text),
+                                span=SourceSpan(piece_start, piece_end, source_id),
+                                line=line,
+                                column=piece_column,
+                                line_count=0,
+                                name=name,
+                            )
+                            for piece_start, piece_end, piece_column, text in pieces
+                        ),
+                        name,
+                    )
+                )
+            case _:
+                raise ValueError(f"Unknown window part in wire data: {part[0]!r}")
+    return CroppedSpanContents(tuple(parts), column)
+
+
+def _encode_sources(diagnostic: Diagnostic) -> list[tuple[Any, ...]]:
+    # Including the windows of blocks which are not shown, as they are read again
+    # when the report is rendered
+    windows_by_source: dict[int, list[tuple[Any, ...]]] = {}
+    for block in _read_blocks(diagnostic, RenderLimits()):
+        if not isinstance(block, SnippetBlock):
+            continue
+        for contents in block.windows:
+            highlighted = (
+                highlight_window(block.highlighter, contents)
+                if block.highlighter is not None
+                else contents
+            )
+            windows_by_source.setdefault(contents.span.source_id.value, []).append(
+                (
+                    contents.span.start,
+                    contents.span.end,
+                    contents.line,
+                    contents.column,
+                    contents.line_count,
+                    contents.name,
+                    _encode_window_body(highlighted),
+                )
+            )
+    return list(windows_by_source.items())
+
+
+def _encode_causes(diagnostic: Diagnostic) -> list[tuple[Any, ...]]:
+    if not isinstance(diagnostic, BaseException):
+        return []
+    causes: list[tuple[Any, ...]] = []
+    for exc, stack in walk_causes_and_stacks(diagnostic, suppressed=_suppressed_frames):
+        if exc is diagnostic:
+            continue
+        frames = _encode_frames(stack.frames)
+        if isinstance(exc, Diagnostic):
+            causes.append(
+                (
+                    "diagnostic",
+                    stack.is_cause,
+                    frames,
+                    exc.severity.value,
+                    _encode_renderable(exc.code),
+                    _encode_renderable(exc.message),
+                    [_encode_renderable(context) for context in exc.context],
+                )
+            )
+        else:
+            causes.append(
+                (
+                    "exception",
+                    stack.is_cause,
+                    frames,
+                    exc.__class__.__module__,
+                    exc.__class__.__name__,
+                    str(exc),
+                )
+            )
+    return causes
+
+
+# Encode `diagnostic` into a compact form that can be sent to another process, and
+# rendered there by `from_wire` the same as the original.
+def to_wire(diagnostic: Diagnostic) -> bytes:
+    payload = (
+        _WIRE_VERSION,
+        diagnostic.severity.value,
+        _encode_renderable(diagnostic.code),
+        _encode_renderable(diagnostic.message),
+        [
+            (
+                label.span.start,
+                label.span.end,
+                label.source_id.value,
+                _encode_renderable(label.label),
+            )
+            for label in diagnostic.labels
+        ],
+        [_encode_renderable(note) for note in diagnostic.notes],
+        [_encode_renderable(context) for context in diagnostic.context],
+        _encode_sources(diagnostic),
+        _encode_frames(
+            extract_frames(diagnostic, suppressed=_suppressed_frames)
+            if isinstance(diagnostic, BaseException)
+            else ()
+        ),
+        _encode_causes(diagnostic),
+    )
+    return pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class _BuiltinsUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str) -> Any:  # noqa: ANN401
+        raise pickle.UnpicklingError(f"Unexpected type {module}.{name} in wire data")
+
+
+# Stands in for exceptions of a type which may not exist in this process
+@cache
+def _placeholder_exception_type(module: str, name: str) -> type[Exception]:
+    return type(name, (Exception,), {"__module__": module, "__qualname__": name})
+
+
+def _decode_cause(cause: tuple[Any, ...]) -> BaseException:
+    match cause:
+        case ("diagnostic", _, _, severity, code, message, context):
+            return DiagnosticError(
+                severity=Severity(severity),
+                code=_decode_renderable(code),
+                message=_decode_renderable(message),
+                context=[_decode_renderable(item) for item in context],
+            )
+        case ("exception", _, _, module, name, message):
+            return _placeholder_exception_type(module, name)(message)
+        case _:
+            raise ValueError(f"Unknown cause in wire data: {cause[0]!r}")
+
+
+def from_wire(data: bytes) -> DiagnosticError:
+    payload = _BuiltinsUnpickler(io.BytesIO(data)).load()
+    if payload[0] not in _READABLE_WIRE_VERSIONS:
+        raise ValueError(f"Unsupported wire format version: {payload[0]!r}")
+    (
+        _version,
+        severity,
+        code,
+        message,
+        labels,
+        notes,
+        context,
+        sources,
+        frames,
+        causes,
+    ) = payload
+
+    # The ids of the sending process could collide with those of this one, so each
+    # is given a fresh id here
+    source_ids: dict[int, SourceId] = {}
+
+    def source_id(value: int) -> SourceId:
+        if value not in source_ids:
+            source_ids[value] = SourceId()
+        return source_ids[value]
+
+    diagnostic = DiagnosticError(
+        severity=Severity(severity),
+        code=_decode_renderable(code),
+        message=_decode_renderable(message),
+        labels=[
+            LabeledSpan(
+                SourceSpan(start, end, source_id(value)), _decode_renderable(label)
+            )
+            for start, end, value, label in labels
+        ],
+        notes=[_decode_renderable(note) for note in notes],
+        context=[_decode_renderable(item) for item in context],
+    )
+    for value, windows in sources:
+        diagnostic.add_source(
+            source_id(value),
+            WindowedSource(
+                sorted(
+                    (_decode_window(window, source_id(value)) for window in windows),
+                    key=lambda window: window.span.start,
+                )
+            ),
+        )
+
+    setattr(diagnostic, _CAPTURED_FRAMES_ATTR, _decode_frames(frames))
+    exc: BaseException = diagnostic
+    for cause in causes:
+        decoded = _decode_cause(cause)
+        setattr(decoded, _CAPTURED_FRAMES_ATTR, _decode_frames(cause[2]))
+        if cause[1]:
+            exc.__cause__ = decoded
+        else:
+            exc.__context__ = decoded
+        exc = decoded
+    return diagnostic
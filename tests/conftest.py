@@ -0,0 +1,37 @@
+import io
+
+from rich.console import Console, RenderableType
+
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.source import InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+
+# `renderable` as printed `width` columns wide. Unless `styled`, as plain text
+# without trailing whitespace, as `PlainReport` renders it, or else with the
+# escape codes of its styles.
+def render(renderable: RenderableType, width: int = 80, *, styled: bool = False) -> str:
+    output = io.StringIO()
+    console = Console(
+        file=output,
+        width=width,
+        record=True,
+        force_terminal=styled,
+        color_system="truecolor",
+    )
+    console.print(renderable)
+    if styled:
+        return output.getvalue()
+    return "".join(f"{line.rstrip()}\n" for line in console.export_text().splitlines())
+
+
+# A diagnostic with a label on each of `spans` of `text`
+def make_error(text: str, *spans: tuple[int, int]) -> DiagnosticError:
+    source_id = SourceId()
+    return DiagnosticError(
+        code="test::error",
+        labels=[
+            LabeledSpan(SourceSpan(start, end, source_id=source_id), f"label {i}")
+            for i, (start, end) in enumerate(spans)
+        ],
+    ).add_source(source_id, InMemorySource(text))
@@ -0,0 +1,146 @@
+from pyagnostics.aggregate import (
+    diagnostic_key,
+    fold_duplicate_errors,
+    fold_duplicates,
+    group_duplicates,
+)
+from pyagnostics.exceptions import DiagnosticError, DiagnosticErrorGroup
+from pyagnostics.severity import Severity
+from pyagnostics.source import EditableSource, InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+DUPLICATE_COUNT = 5
+
+
+def make_diagnostic(source_id: SourceId, line: int) -> DiagnosticError:
+    start = line * 4
+    return DiagnosticError(
+        code="test::duplicate",
+        message="bad value",
+        labels=[LabeledSpan(SourceSpan(start, start + 3, source_id), "here")],
+    ).add_source(source_id, InMemorySource("abc\n" * 10, name="example"))
+
+
+def test_diagnostic_key_ignores_span() -> None:
+    source_id = SourceId()
+
+    assert diagnostic_key(make_diagnostic(source_id, 1)) == diagnostic_key(
+        make_diagnostic(source_id, 2)
+    )
+    assert diagnostic_key(make_diagnostic(source_id, 1)) != diagnostic_key(
+        make_diagnostic(SourceId(), 1)
+    )
+
+
+def test_group_duplicates_counts_occurrences() -> None:
+    source_id = SourceId()
+    diagnostics = [
+        *(make_diagnostic(source_id, line) for line in range(DUPLICATE_COUNT)),
+        make_diagnostic(source_id, 0),
+        DiagnosticError(code="test::other", severity=Severity.WARNING),
+    ]
+
+    first, other = group_duplicates(diagnostics)
+
+    assert first.diagnostic is diagnostics[0]
+    assert first.count == DUPLICATE_COUNT + 1
+    assert len(first.other_locations) == DUPLICATE_COUNT - 1
+    assert other.count == 1
+
+
+def test_fold_duplicates_notes_other_locations() -> None:
+    source_id = SourceId()
+    diagnostics = [make_diagnostic(source_id, line) for line in range(4)]
+
+    (folded,) = fold_duplicates(diagnostics, max_locations=2)
+
+    assert folded.notes == [
+        (
+            "[blue]note:[/blue] occurred 4 times, also at example:2:1, "
+            "example:3:1 and 1 more"
+        )
+    ]
+    assert folded.get_source(source_id) is not None
+    assert diagnostics[0].notes == []
+
+    folded.labels.clear()
+    folded.with_context("more")
+
+    assert diagnostics[0].labels
+    assert diagnostics[0].context == []
+
+
+def test_fold_duplicates_locates_other_occurrences_by_line() -> None:
+    source_id = SourceId()
+    source = EditableSource("abc\n" * 10, name="example")
+    diagnostics = [
+        DiagnosticError(
+            labels=[LabeledSpan(SourceSpan(line * 4, line * 4 + 3, source_id), "here")]
+        ).add_source(source_id, source)
+        for line in range(3)
+    ]
+
+    (folded,) = fold_duplicates(diagnostics)
+
+    assert folded.notes == [
+        "[blue]note:[/blue] occurred 3 times, also at example:2:1, example:3:1"
+    ]
+
+
+def test_fold_duplicates_escapes_source_name() -> None:
+    source_id = SourceId()
+    source = InMemorySource("abc\n" * 10, name="[bold]example")
+    diagnostics = [
+        DiagnosticError(
+            labels=[LabeledSpan(SourceSpan(line * 4, line * 4 + 3, source_id), "here")]
+        ).add_source(source_id, source)
+        for line in range(2)
+    ]
+
+    (folded,) = fold_duplicates(diagnostics)
+
+    assert folded.notes == [
+        "[blue]note:[/blue] occurred 2 times, also at \\[bold]example:2:1"
+    ]
+
+
+def test_fold_duplicate_errors_in_group() -> None:
+    source_id = SourceId()
+    other = DiagnosticError(code="test::other")
+    nested = DiagnosticErrorGroup("inner", [make_diagnostic(source_id, 1)])
+    group = DiagnosticErrorGroup(
+        "outer",
+        [
+            nested,  # type: ignore[list-item]
+            make_diagnostic(source_id, 0),
+            other,
+            make_diagnostic(source_id, 0),
+        ],
+    )
+
+    folded = fold_duplicate_errors(group)
+
+    nested_group, error, other_error = folded.exceptions
+    assert isinstance(nested_group, DiagnosticErrorGroup)
+    assert nested_group.message == "inner"
+    assert isinstance(error, DiagnosticError)
+    assert error.notes == ["[blue]note:[/blue] occurred 2 times"]
+    assert other_error is other
+
+
+def test_fold_duplicate_errors_keeps_group_sources() -> None:
+    source_id = SourceId()
+    source = InMemorySource("abc\n" * 10, name="example")
+    labels = [LabeledSpan(SourceSpan(0, 3, source_id), "here")]
+    group = DiagnosticErrorGroup(
+        "group",
+        [DiagnosticError(code="test::duplicate", labels=labels) for _ in range(2)],
+    ).add_source(source_id, source)
+
+    folded = fold_duplicate_errors(group)
+
+    assert folded.source_map == group.source_map
+    (error,) = folded.exceptions
+    assert isinstance(error, DiagnosticError)
+    assert error.get_attached_source(source_id) == (source, None)
+    assert "abc" in error.to_plain_text()
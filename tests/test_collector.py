@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from conftest import make_error
+
+from pyagnostics.collector import DiagnosticCollector, OverflowPolicy
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.severity import Severity
+from pyagnostics.spans import SourceSpan
+
+DIAGNOSTIC_COUNT = 100
+MAX_DIAGNOSTICS = 10
+
+
+def make_diagnostic(i: int) -> DiagnosticError:
+    return DiagnosticError(
+        severity=Severity.WARNING if i % 2 else Severity.ERROR,
+        code=f"test::{i}",
+    )
+
+
+def test_collector_counts_from_many_threads() -> None:
+    collector = DiagnosticCollector(
+        max_diagnostics=MAX_DIAGNOSTICS, overflow=OverflowPolicy.COUNT_ONLY
+    )
+
+    with ThreadPoolExecutor(8) as executor:
+        executor.map(
+            lambda i: collector.push(make_diagnostic(i)), range(DIAGNOSTIC_COUNT)
+        )
+
+    assert collector.count() == DIAGNOSTIC_COUNT
+    assert collector.count(Severity.ERROR) == DIAGNOSTIC_COUNT // 2
+    assert len(collector) == MAX_DIAGNOSTICS
+    assert collector.dropped == DIAGNOSTIC_COUNT - MAX_DIAGNOSTICS
+
+
+def test_collector_drops_oldest() -> None:
+    collector = DiagnosticCollector(max_diagnostics=MAX_DIAGNOSTICS)
+
+    collector.extend(make_diagnostic(i) for i in range(DIAGNOSTIC_COUNT))
+
+    assert [diagnostic.code for diagnostic in collector] == [
+        f"test::{i}"
+        for i in range(DIAGNOSTIC_COUNT - MAX_DIAGNOSTICS, DIAGNOSTIC_COUNT)
+    ]
+
+
+def test_collector_spills_to_disk() -> None:
+    with DiagnosticCollector(
+        max_diagnostics=MAX_DIAGNOSTICS, overflow=OverflowPolicy.SPILL
+    ) as collector:
+        collector.extend(make_diagnostic(i) for i in range(DIAGNOSTIC_COUNT))
+
+        assert len(collector) == DIAGNOSTIC_COUNT
+        assert collector.dropped == 0
+        assert [diagnostic.code for diagnostic in collector] == [
+            f"test::{i}" for i in range(DIAGNOSTIC_COUNT)
+        ]
+
+        group = collector.into_error_group()
+        assert group is not None
+        assert len(group.exceptions) == DIAGNOSTIC_COUNT
+
+
+def test_collector_spills_only_the_windows_of_sources_shown() -> None:
+    text = "".join(f"line {i}\n" for i in range(DIAGNOSTIC_COUNT))
+    spilled = make_error(text, (0, 4))
+
+    with DiagnosticCollector(
+        max_diagnostics=1,
+        overflow=OverflowPolicy.SPILL,
+    ) as collector:
+        collector.extend([spilled, make_diagnostic(0)])
+
+        group = collector.into_error_group()
+
+    assert group is not None
+    error, _kept = group.exceptions
+    assert isinstance(error, DiagnosticError)
+    assert error.to_plain_text() == spilled.to_plain_text()
+    ((error_source, _highlighter),) = error.source_map.values()
+    last_line = SourceSpan(len(text) - 8, len(text), spilled.labels[0].source_id)
+    with pytest.raises(ValueError, match="not within a window"):
+        error_source.read_span(last_line)
+
+
+def test_collector_only_raises_on_errors() -> None:
+    collector = DiagnosticCollector()
+
+    collector.push(DiagnosticError(severity=Severity.WARNING, code="test::warning"))
+
+    assert collector.into_error_group() is None
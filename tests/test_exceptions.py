@@ -0,0 +1,109 @@
+import pickle
+import subprocess
+import sys
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from typing import Any
+
+from conftest import render
+from rich.console import RenderableType
+from rich.text import Text
+
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.lazy import Lazy, evaluate
+from pyagnostics.source import InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+
+def test_exceptions_import_without_rendering_modules() -> None:
+    code = (
+        "import sys\n"
+        "import pyagnostics.exceptions, pyagnostics.severity, pyagnostics.spans\n"
+        "import pyagnostics.source\n"
+        "print(*sorted(sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    modules = result.stdout.split()
+
+    assert "pyagnostics.exceptions" in modules
+    assert not [
+        module
+        for module in modules
+        if module.startswith(("rich", "pygments", "pyagnostics.report"))
+        or module == "pyagnostics.plain"
+    ]
+
+
+def test_diagnostic_error_renders_after_lazy_import() -> None:
+    output = render(DiagnosticError(code="test::lazy", message="rendered lazily"))
+
+    assert "rendered lazily" in output
+
+
+# Bare callables are only accepted at runtime, `Lazy` is the typed form
+def make_error(wrap: Callable[[str, RenderableType], Any]) -> DiagnosticError:
+    source_id = SourceId()
+    return DiagnosticError(
+        code="test::lazy",
+        message=wrap("message", "the [bold]message[/bold]"),
+        labels=[LabeledSpan(SourceSpan(4, 5, source_id), wrap("label", "this"))],
+        notes=[wrap("note", Text("a note", style="blue"))],
+        context=[wrap("context", "while testing")],
+    ).add_source(source_id, InMemorySource("let x = 1;\n"))
+
+
+def test_lazy_fields_are_built_once_when_rendered() -> None:
+    built: Counter[str] = Counter()
+
+    def lazy(name: str, renderable: RenderableType) -> Lazy:
+        def build() -> RenderableType:
+            built[name] += 1
+            return renderable
+
+        return Lazy(build)
+
+    error = make_error(lazy)
+    assert not built
+
+    expected = make_error(lambda _name, value: value)
+    assert render(error) == render(expected)
+    assert error.to_plain_text() == expected.to_plain_text()
+    assert render(error)
+    assert built == dict.fromkeys(["message", "label", "note", "context"], 1)
+
+
+def test_callable_fields_are_lazy() -> None:
+    error = make_error(lambda _name, value: lambda: value)
+
+    assert isinstance(error.message, Lazy)
+    assert isinstance(error.labels[0].label, Lazy)
+    expected = make_error(lambda _name, value: value)
+    assert render(error) == render(expected)
+    assert error.to_plain_text() == expected.to_plain_text()
+    assert render(pickle.loads(pickle.dumps(error))) == render(error)
+
+
+def test_lazy_fields_are_built_once_across_threads() -> None:
+    threads = 8
+    barrier = Barrier(threads)
+    built: Counter[str] = Counter()
+
+    def build() -> RenderableType:
+        built["message"] += 1
+        return "the message"
+
+    message = Lazy(build)
+
+    def render_message(_index: int) -> RenderableType | None:
+        barrier.wait()
+        return evaluate(message)
+
+    with ThreadPoolExecutor(threads) as pool:
+        values = list(pool.map(render_message, range(threads)))
+
+    assert values == ["the message"] * threads
+    assert built == {"message": 1}
@@ -0,0 +1,174 @@
+from itertools import pairwise
+
+from pyagnostics.frames import (
+    _CAPTURED_FRAMES_ATTR,
+    RECURSION_CUTOFF,
+    Frame,
+    FrameMatcher,
+    OmittedFrames,
+    RepeatedFrames,
+    capture_frames,
+    extract_frames,
+    omitted_causes,
+    walk_causes_and_stacks,
+)
+
+RECURSION_DEPTH = 50
+CHAIN_LENGTH = 6
+MAX_CAUSE_DEPTH = 2
+
+
+def fail_inner() -> None:
+    raise ValueError("inner")
+
+
+def fail() -> None:
+    try:
+        fail_inner()
+    except ValueError as e:
+        raise RuntimeError("outer") from e
+
+
+def recurse_even(level: int) -> None:
+    if level == 0:
+        raise ValueError("bottom")
+    recurse_odd(level - 1)
+
+
+def recurse_odd(level: int) -> None:
+    recurse_even(level - 1)
+
+
+def test_walk_causes_and_stacks() -> None:
+    try:
+        fail()
+    except RuntimeError as e:
+        causes_and_stacks = list(walk_causes_and_stacks(e))
+
+    assert [type(exc) for exc, _ in causes_and_stacks] == [RuntimeError, ValueError]
+    assert [stack.is_cause for _, stack in causes_and_stacks] == [False, True]
+    frames = causes_and_stacks[0][1].frames
+    assert all(isinstance(frame, Frame) for frame in frames)
+    assert [frame.name for frame in frames if isinstance(frame, Frame)] == [
+        "test_walk_causes_and_stacks",
+        "fail",
+    ]
+    inner_frame = causes_and_stacks[1][1].frames[-1]
+    assert isinstance(inner_frame, Frame)
+    assert inner_frame.name == "fail_inner"
+    assert inner_frame.filename == __file__
+
+
+def test_capture_frames_releases_tracebacks() -> None:
+    try:
+        fail()
+    except RuntimeError as e:
+        error = e
+    cause = error.__cause__
+    assert cause is not None
+    frames = extract_frames(error)
+    cause_frames = extract_frames(cause)
+
+    capture_frames(error)
+
+    assert error.__traceback__ is None
+    assert cause.__traceback__ is None
+    assert extract_frames(error) == frames
+    assert extract_frames(cause) == cause_frames
+
+
+def test_repeated_frames_are_folded() -> None:
+    try:
+        recurse_even(RECURSION_DEPTH)
+    except ValueError as e:
+        error = e
+
+    frames = extract_frames(error)
+    # The test, three runs of even and odd frames, the 22 more runs folded, and the
+    # frame raising
+    assert [type(entry) for entry in frames] == [
+        *[Frame] * 7,
+        RepeatedFrames,
+        Frame,
+    ]
+    repeated = frames[7]
+    assert isinstance(repeated, RepeatedFrames)
+    assert repeated.frames == frames[1:3]
+    assert repeated.count == RECURSION_DEPTH // 2 - RECURSION_CUTOFF
+    assert extract_frames(error, max_frames=4) == (
+        *frames[:2],
+        OmittedFrames(5),
+        *frames[-2:],
+    )
+
+    capture_frames(error)
+    assert extract_frames(error) == frames
+
+
+def test_omitted_frames_are_counted_without_suppressed_frames() -> None:
+    error = ValueError("captured")
+    frames = [
+        Frame(f"/app/{i}.py", 1, "f", "app") if i % 2 else Frame(f"/lib/{i}.py", 1, "f")
+        for i in range(10)
+    ]
+    setattr(error, _CAPTURED_FRAMES_ATTR, tuple(frames))
+
+    assert extract_frames(error, 2, FrameMatcher(["/lib/"])) == (
+        frames[1],
+        OmittedFrames(3),
+        frames[9],
+    )
+
+
+def test_omitted_causes_continue_from_the_walk() -> None:
+    errors = [ValueError(i) for i in range(CHAIN_LENGTH)]
+    for error, cause in pairwise(errors):
+        error.__cause__ = cause
+    seen: set[int] = set()
+
+    walked = [
+        exc for exc, _ in walk_causes_and_stacks(errors[0], MAX_CAUSE_DEPTH, seen=seen)
+    ]
+
+    assert walked == errors[: MAX_CAUSE_DEPTH + 1]
+    assert omitted_causes(walked[-1], seen) == CHAIN_LENGTH - MAX_CAUSE_DEPTH - 1
+
+    # A chain looping back on itself is only walked and counted once
+    errors[-1].__context__ = errors[0]
+    seen = set()
+    walked = [exc for exc, _ in walk_causes_and_stacks(errors[0], seen=seen)]
+    assert walked == errors
+    assert omitted_causes(walked[-1], seen) == 0
+    capture_frames(errors[0])
+
+
+def test_frame_matcher_patterns() -> None:
+    matcher = FrameMatcher(
+        ["/usr/lib/python3/"], path_globs=["*/site-packages/*"], modules=["asyncio"]
+    )
+
+    assert matcher.matches(Frame("/usr/lib/python3/json/decoder.py", 1, "decode"))
+    assert matcher.matches(Frame("/venv/lib/site-packages/rich/console.py", 1, "f"))
+    assert matcher.matches(Frame("/x/asyncio/tasks.py", 1, "step", "asyncio.tasks"))
+    assert not matcher.matches(Frame("/x/asyncio_extras.py", 1, "f", "asyncio_extras"))
+    assert not matcher.matches(Frame("/home/app/main.py", 1, "main", "__main__"))
+
+
+def test_frame_matcher_add_invalidates_cache() -> None:
+    matcher = FrameMatcher()
+    frame = Frame("/home/app/myapp/internal/db.py", 1, "query", "myapp.internal.db")
+
+    assert not matcher.matches(frame)
+
+    matcher.add(modules=["myapp.*.db"])
+
+    assert matcher.matches(frame)
+
+
+def test_frame_matcher_prefixes_are_literal() -> None:
+    matcher = FrameMatcher(["src", "/opt/[x]"])
+
+    assert matcher.matches(Frame("src/app/main.py", 1, "main", "app.main"))
+    assert matcher.matches(Frame("/opt/[x]/tool.py", 1, "run"))
+    assert not matcher.matches(Frame("/opt/x/tool.py", 1, "run"))
+    assert not matcher.matches(Frame("/home/app/main.py", 1, "main", "src"))
@@ -0,0 +1,68 @@
+from pygments.token import String  # type: ignore[import-untyped]
+from rich.console import Console
+from rich.syntax import Syntax
+
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.highlight import PygmentsHighlighter, TokenCache
+from pyagnostics.source import InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+SOURCE_CODE = 'x = 1\ntext = """\nnot = code\n"""\ny = 2\n'
+
+
+def test_highlights_window_within_multiline_token() -> None:
+    source_id = SourceId()
+    cache = TokenCache()
+    highlighter = PygmentsHighlighter(SOURCE_CODE, "python", cache=cache)
+    start = SOURCE_CODE.index("not")
+    contents = InMemorySource(SOURCE_CODE).read_span(
+        SourceSpan(start + 1, start + 3, source_id)
+    )
+
+    highlighted = highlighter.highlight(contents)
+
+    string_style = Syntax.get_theme("monokai").get_style_for_token(String.Double)
+    assert highlighted.text.plain == contents.text.plain
+    assert [(span.start, span.end) for span in highlighted.text.spans] == [
+        (0, len("not = code\n"))
+    ]
+    assert highlighted.text.spans[0].style == string_style
+    assert (highlighted.line, highlighted.column) == (contents.line, contents.column)
+
+
+def test_token_cache_lexes_each_source_once() -> None:
+    source_id = SourceId()
+    cache = TokenCache(max_sources=2)
+    sources = [SOURCE_CODE, SOURCE_CODE.replace("x", "a"), SOURCE_CODE + "z = 3\n"]
+    for source_code in sources:
+        highlighter = PygmentsHighlighter(source_code, "python", cache=cache)
+        source = InMemorySource(source_code)
+        for offset in (0, len(source_code) - 2):
+            highlighter.highlight(
+                source.read_span(SourceSpan(offset, offset + 1, source_id))
+            )
+
+    assert len(cache) == len(sources) - 1
+    tokens = cache.get(sources[-1], "python")
+    assert cache.get(sources[-1], "python") is tokens
+
+
+def test_renders_with_highlighter() -> None:
+    source_id = SourceId()
+    start = SOURCE_CODE.index("y")
+    error = DiagnosticError(
+        code="test::highlight",
+        labels=[LabeledSpan(SourceSpan(start, start + 1, source_id), "here")],
+    ).add_source(
+        source_id,
+        InMemorySource(SOURCE_CODE),
+        PygmentsHighlighter(SOURCE_CODE, "python"),
+    )
+
+    console = Console(
+        width=80, record=True, force_terminal=True, color_system="truecolor"
+    )
+    console.print(error)
+
+    assert "y = 2" in console.export_text()
+    assert "y = 2" not in console.export_text(styles=True)
@@ -0,0 +1,68 @@
+from contextlib import nullcontext
+
+from conftest import render
+
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.highlight import PygmentsHighlighter, TokenCache
+from pyagnostics.instrument import Instrumentation, Phase, measure
+from pyagnostics.report import Report
+from pyagnostics.source import InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+SOURCE_CODE = "x = 1\ny = x + 1\nz = y * 2\n"
+CHARS_READ = 10
+
+
+def make_error() -> DiagnosticError:
+    def fail() -> None:
+        source_id = SourceId()
+        raise DiagnosticError(
+            code="test::instrument",
+            labels=[LabeledSpan(SourceSpan(6, 7, source_id), "here")],
+        ).add_source(
+            source_id,
+            InMemorySource(SOURCE_CODE),
+            PygmentsHighlighter(SOURCE_CODE, "python", cache=TokenCache()),
+        )
+
+    try:
+        try:
+            int("one")
+        except ValueError:
+            fail()
+    except DiagnosticError as e:
+        return e
+    raise AssertionError("unreachable")
+
+
+def test_report_records_phases() -> None:
+    measurements: list[tuple[Phase, float, int]] = []
+    instrumentation = Instrumentation(
+        hooks=[lambda *measurement: measurements.append(measurement)]
+    )
+    error = make_error()
+
+    render(Report(error, instrumentation=instrumentation))
+    stats = instrumentation.stats
+
+    assert set(stats) == set(Phase)
+    assert stats[Phase.REPORT].calls == 1
+    assert stats[Phase.READ].chars == len(SOURCE_CODE)
+    assert stats[Phase.HIGHLIGHT].chars == len(SOURCE_CODE)
+    assert all(stats[phase].seconds <= stats[Phase.REPORT].seconds for phase in Phase)
+    assert len(measurements) == sum(phase_stats.calls for phase_stats in stats.values())
+
+    instrumentation.reset()
+    assert instrumentation.stats == {}
+
+
+def test_measure_without_instrumentation_is_a_no_op() -> None:
+    assert isinstance(measure(Phase.READ), nullcontext)
+
+    instrumentation = Instrumentation()
+    with instrumentation.activate(), measure(Phase.READ) as measurement:
+        assert measurement is not None
+        measurement.chars = CHARS_READ
+
+    assert isinstance(measure(Phase.READ), nullcontext)
+    assert instrumentation.stats[Phase.READ].chars == CHARS_READ
@@ -0,0 +1,63 @@
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from pyagnostics.exceptions import DiagnosticError, DiagnosticErrorGroup
+from pyagnostics.parallel import ReportFormat, render_reports, write_reports
+from pyagnostics.source import InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+ERROR_COUNT = 40
+
+
+def make_group() -> DiagnosticErrorGroup:
+    source_id = SourceId()
+    source = InMemorySource("".join(f"line {i:02}\n" for i in range(ERROR_COUNT)))
+    errors = [
+        DiagnosticError(
+            code=f"test::{i}",
+            labels=[LabeledSpan(SourceSpan(i * 8, i * 8 + 4, source_id), "here")],
+        )
+        for i in range(ERROR_COUNT)
+    ]
+    nested = DiagnosticErrorGroup("nested", errors[ERROR_COUNT // 2 :])
+    return DiagnosticErrorGroup(
+        "group",
+        [*errors[: ERROR_COUNT // 2], nested],  # type: ignore[list-item]
+    ).add_source(source_id, source)
+
+
+def test_render_reports_keeps_order() -> None:
+    group = make_group()
+
+    reports = list(
+        render_reports(
+            group, report_format=ReportFormat.TEXT, max_workers=4, chunk_size=3
+        )
+    )
+
+    assert len(reports) == ERROR_COUNT
+    for i, report in enumerate(reports):
+        assert f"test::{i}" in report
+        assert f"line {i:02}" in report
+
+
+def test_render_reports_in_process_pool_resolves_group_sources() -> None:
+    group = make_group()
+    expected = list(render_reports(group))
+
+    with ProcessPoolExecutor(
+        2, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        reports = list(render_reports(group, executor=executor, chunk_size=8))
+
+    assert reports == expected
+
+
+def test_write_reports() -> None:
+    error = DiagnosticError(code="test::written", message="written")
+    output = io.StringIO()
+
+    write_reports([error, error], output, report_format=ReportFormat.TEXT)
+
+    assert output.getvalue() == error.to_plain_text(width=80) * 2
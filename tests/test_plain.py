@@ -0,0 +1,124 @@
+import json
+
+from conftest import render
+
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.frames import causes_omitted
+from pyagnostics.lazy import Lazy
+from pyagnostics.plain import PlainReport
+from pyagnostics.report import Report
+from pyagnostics.snippets import RenderLimits
+from pyagnostics.source import EditableSource, InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+
+def make_inner_error() -> DiagnosticError:
+    try:
+        try:
+            int("one")
+        except ValueError as e:
+            raise DiagnosticError(
+                code="test::inner", message="inner [bold]error[/bold]"
+            ) from e
+    except DiagnosticError as e:
+        return e
+    raise AssertionError("unreachable")
+
+
+def make_error() -> DiagnosticError:
+    source_id = SourceId()
+    error = DiagnosticError(
+        code="test::outer",
+        message="outer error",
+        labels=[
+            LabeledSpan(SourceSpan(6, 9, source_id=source_id), "this"),
+            LabeledSpan(SourceSpan(10, 13, source_id=source_id), "and that"),
+        ],
+        notes=["[blue]help:[/blue] try harder"],
+        context=["while testing"],
+    )
+    error.__cause__ = make_inner_error()
+    error.add_source(source_id, InMemorySource("let x = one;\nlet y = 2;\n"))
+    return error
+
+
+def test_plain_report_matches_rich_layout() -> None:
+    error = make_error()
+    assert PlainReport(error).render() == render(error, 200)
+
+
+def test_plain_report_wraps_like_rich() -> None:
+    error = make_error()
+    assert PlainReport(error, width=30).render() == render(error, 30)
+
+
+def retry(attempts: int) -> None:
+    try:
+        if attempts > 1:
+            retry(attempts - 1)
+        else:
+            int("one")
+    except ValueError as e:
+        raise ValueError(f"attempt {attempts} failed") from e
+
+
+def test_plain_report_limits_causes_like_rich() -> None:
+    try:
+        try:
+            retry(10)
+        except ValueError as e:
+            raise DiagnosticError(code="test::retries") from e
+    except DiagnosticError as e:
+        error = e
+    limits = RenderLimits(max_cause_depth=2)
+    expected = render(Report(error, limits=limits))
+
+    plain = PlainReport(error, width=80, limits=limits).render()
+    assert plain == expected
+    assert "attempt 9 failed" in plain
+    assert "attempt 8 failed" not in plain
+    assert causes_omitted(9) in plain
+
+
+def test_plain_report_to_json() -> None:
+    report = json.loads(make_error().to_json())
+
+    assert report["code"] == "test::outer"
+    assert report["severity"] == "error"
+    assert report["notes"] == ["help: try harder"]
+    assert report["context"] == ["while testing"]
+    assert [(label["line"], label["column"]) for label in report["labels"]] == [
+        (1, 6),
+        (1, 10),
+    ]
+    assert [label["name"] for label in report["labels"]] == [None, None]
+    assert [cause["kind"] for cause in report["causes"]] == ["cause", "cause"]
+    assert report["causes"][0]["code"] == "test::inner"
+    assert report["causes"][0]["message"] == "inner error"
+    assert report["causes"][1]["type"] == "builtins.ValueError"
+
+
+def test_plain_report_to_json_builds_lazy_fields() -> None:
+    empty = json.loads(DiagnosticError(message=Lazy(lambda: None)).to_json())
+    built = json.loads(
+        DiagnosticError(message=Lazy(lambda: "[bold]built[/]")).to_json()
+    )
+
+    assert empty["message"] is None
+    assert built["message"] == "built"
+
+
+def test_plain_report_to_json_locates_labels_by_line() -> None:
+    source_id = SourceId()
+    error = DiagnosticError(
+        labels=[
+            LabeledSpan(SourceSpan(0, 3, source_id=source_id), "first"),
+            LabeledSpan(SourceSpan(13, 16, source_id=source_id), "second"),
+        ],
+    ).add_source(source_id, EditableSource("let x = one;\nlet y = 2;\n", name="x.js"))
+
+    report = json.loads(error.to_json())
+
+    assert [
+        (label["name"], label["line"], label["column"]) for label in report["labels"]
+    ] == [("x.js", 1, 0), ("x.js", 2, 0)]
@@ -0,0 +1,134 @@
+import gc
+from typing import Self
+
+import pytest
+
+from pyagnostics.exceptions import DiagnosticError, DiagnosticErrorGroup
+from pyagnostics.protocols import SpanContents
+from pyagnostics.registry import SourceHold, SourceRegistry, source_registry
+from pyagnostics.source import InMemorySource, attach_diagnostic_source_code
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+
+class SlottedSource:
+    __slots__ = ("source",)
+
+    def __init__(self: Self, source_code: str) -> None:
+        self.source = InMemorySource(source_code)
+
+    def read_span(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> SpanContents:
+        return self.source.read_span(span, context_lines_before, context_lines_after)
+
+
+def test_registry_holds_sources_weakly_unless_pinned() -> None:
+    registry = SourceRegistry()
+    weak_id, pinned_id = SourceId(), SourceId()
+    registry.register(weak_id, InMemorySource("weak"))
+    registry.register(pinned_id, InMemorySource("pinned"), pin=True)
+    gc.collect()
+
+    assert weak_id not in registry
+    assert pinned_id in registry
+    assert len(registry) == 1
+
+    registry.unpin(pinned_id)
+    gc.collect()
+
+    assert pinned_id not in registry
+
+
+def test_registry_restores_registrations_once_holds_are_released() -> None:
+    registry = SourceRegistry()
+    source_id = SourceId()
+    weak, first, second = (InMemorySource(name) for name in ("weak", "first", "second"))
+    registry.register(source_id, weak)
+
+    first_hold = registry.hold(source_id, first)
+    second_hold = registry.hold(source_id, second)
+    registry.release(source_id, first_hold)
+
+    assert registry.get(source_id) == (second, None)
+
+    registry.release(source_id, second_hold)
+
+    assert registry.get(source_id) == (weak, None)
+
+    registry.hold(source_id, first)
+    del weak
+    gc.collect()
+
+    assert registry.get(source_id) == (first, None)
+
+    registry.release(source_id, SourceHold(first))
+
+    assert source_id not in registry
+    assert len(registry) == 0
+
+
+def test_registry_requires_pinning_sources_without_weak_references() -> None:
+    registry = SourceRegistry()
+    source_id = SourceId()
+
+    with pytest.raises(TypeError, match="pin=True"):
+        registry.register(source_id, SlottedSource("slotted"))
+    assert source_id not in registry
+
+    registry.register(source_id, SlottedSource("slotted"), pin=True)
+    gc.collect()
+
+    resolved = registry.get(source_id)
+    assert resolved is not None
+    assert isinstance(resolved[0], SlottedSource)
+
+
+def test_registry_resolves_only_the_registered_id() -> None:
+    registry = SourceRegistry()
+    source = InMemorySource("abc\n")
+    source_id = registry.register(SourceId(), source)
+    colliding_id = SourceId.unsafe_from_value(source_id.value)
+
+    assert registry.resolve(source_id) == (source, None)
+    assert registry.resolve(colliding_id) is None
+    assert registry.get(colliding_id) == (source, None)
+
+
+def test_attached_source_is_unregistered_on_exit() -> None:
+    source_id = SourceId()
+    source = SlottedSource("abc\n")
+
+    with attach_diagnostic_source_code(source, source_id=source_id):
+        assert source_registry.resolve(source_id) == (source, None)
+
+    assert source_id not in source_registry
+
+
+def test_group_sources_are_resolved_by_its_exceptions() -> None:
+    source_id = SourceId()
+    source = InMemorySource("abc\n")
+    errors = [
+        DiagnosticError(
+            code=f"test::{i}", labels=[LabeledSpan(SourceSpan(0, 3, source_id), "here")]
+        )
+        for i in range(3)
+    ]
+    nested = DiagnosticErrorGroup("nested", errors[1:])
+    group = DiagnosticErrorGroup(
+        "group",
+        [errors[0], nested],  # type: ignore[list-item]
+    )
+    before = errors[2].to_plain_text()
+    group.add_source(source_id, source)
+
+    assert "abc" not in before
+    assert "abc" in errors[2].to_plain_text()
+    assert all(error.source_map == {} for error in errors)
+    assert all(
+        error.get_attached_source(source_id) == (source, None) for error in errors
+    )
+    assert nested.get_source(source_id) == (source, None)
+    assert group.get_source(source_id) == (source, None)
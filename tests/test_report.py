@@ -1,9 +1,15 @@
+import pickle
 import re
+from io import StringIO
 
+from conftest import render
 from rich.console import Console
 from rich.text import Text
+from rich.theme import Theme
 
-from pyagnostics.report import LabeledSourceBlock
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.report import LabeledSourceBlock, RenderCache, Report
+from pyagnostics.source import InMemorySource
 from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
 
 
@@ -53,3 +59,101 @@ def test_labeled_source_block_renders_label_on_wrapped_line() -> None:
     output = console.export_text()
 
     assert "tail" in output
+
+
+def test_labeled_source_block_label_order_does_not_matter() -> None:
+    source_id = SourceId()
+    content = "".join(f"value_{i} = {i}\n" for i in range(20))
+    labels = [
+        LabeledSpan(SourceSpan(start, start + 7, source_id=source_id), f"label {i}")
+        for i, start in enumerate(range(0, len(content) - 7, 9))
+    ]
+
+    def render(labels: list[LabeledSpan]) -> str:
+        console = Console(width=30, record=True)
+        console.print(LabeledSourceBlock(Text(content), labels=labels))
+        return console.export_text()
+
+    output = render(labels)
+
+    assert output == render(labels[::-1])
+    assert all(f"label {i}" in output for i in range(len(labels)))
+
+
+def test_report_cache_is_keyed_by_width_and_cleared_on_mutation() -> None:
+    source_id = SourceId()
+    error = DiagnosticError(
+        code="test::cached",
+        labels=[LabeledSpan(SourceSpan(4, 7, source_id), "here")],
+    ).add_source(source_id, InMemorySource("abc\ndef\nghi\n"))
+    widths = [80, 30]
+
+    outputs = [render(error, width, styled=True) for width in widths]
+
+    assert [render(error, width, styled=True) for width in widths] == outputs
+    assert error._render_cache is not None
+    assert len(error._render_cache.segments) == len(widths)
+    assert outputs[0] != outputs[1]
+
+    error.add_note("a new note")
+
+    assert "a new note" in render(error, widths[0])
+    assert error._render_cache is not None
+    assert len(error._render_cache.segments) == 1
+    assert pickle.loads(pickle.dumps(error))._render_cache.segments == {}
+
+
+def test_report_cache_follows_raised_exception() -> None:
+    error = DiagnosticError(code="test::raised")
+    before = render(error, 80)
+
+    try:
+        raise error from ValueError("the cause")
+    except DiagnosticError:
+        pass
+
+    assert render(error, 80) != before
+    assert "the cause" in render(error, 80)
+
+
+def test_report_cache_is_keyed_by_theme_and_cleared_on_field_writes() -> None:
+    error = DiagnosticError(code="test::themed", message="[repr.str]quoted[/]")
+    report = Report(error)
+    themed = Console(
+        width=80,
+        color_system="truecolor",
+        theme=Theme({"repr.str": "bold red"}),
+        file=StringIO(),
+    )
+    plain = Console(width=80, color_system="truecolor", file=StringIO())
+
+    with themed.capture() as themed_capture:
+        themed.print(report)
+    with plain.capture() as plain_capture:
+        plain.print(report)
+
+    assert themed_capture.get() != plain_capture.get()
+    assert report.__rich__() is report
+
+    report.diag = DiagnosticError(code="test::replaced")
+
+    assert "test::replaced" in render(report, 80)
+
+
+def test_report_cache_is_keyed_by_given_theme() -> None:
+    error = DiagnosticError(code="test::themed", message="[custom]styled[/]")
+    cache = RenderCache()
+    outputs = {}
+    for color in ("red", "blue"):
+        console = Console(
+            width=80,
+            color_system="truecolor",
+            theme=Theme({"custom": color}),
+            file=StringIO(),
+        )
+        with console.capture() as capture:
+            console.print(Report(error, theme=color, cache=cache))
+        outputs[color] = capture.get()
+
+    assert outputs["red"] != outputs["blue"]
+    assert len(cache.segments) == len(outputs)
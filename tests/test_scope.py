@@ -0,0 +1,131 @@
+import asyncio
+import gc
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.registry import source_registry
+from pyagnostics.scope import AmbientSource, current_source_scope
+from pyagnostics.source import InMemorySource, attach_diagnostic_source_code
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+
+def make_error(*source_ids: SourceId) -> DiagnosticError:
+    return DiagnosticError(
+        code="test::scope",
+        labels=[
+            LabeledSpan(SourceSpan(0, 4, source_id), "here") for source_id in source_ids
+        ],
+    )
+
+
+def test_diagnostics_resolve_sources_of_enclosing_scopes() -> None:
+    outer_id, inner_id = SourceId(), SourceId()
+    outer, inner = InMemorySource("outer\n"), InMemorySource("inner\n")
+
+    with (
+        pytest.raises(DiagnosticError) as exc_info,
+        AmbientSource(outer, source_id=outer_id),
+        AmbientSource(inner, source_id=inner_id),
+    ):
+        raise make_error(outer_id, inner_id)
+
+    error = exc_info.value
+    assert current_source_scope() is None
+    assert error.source_map == {}
+    assert error.get_source(outer_id) == (outer, None)
+    assert error.get_source(inner_id) == (inner, None)
+
+
+def test_sources_are_added_to_diagnostics_created_outside_the_scope() -> None:
+    source_id = SourceId()
+    source = InMemorySource("pool\n")
+
+    with (
+        pytest.raises(DiagnosticError) as exc_info,
+        AmbientSource(source, source_id=source_id),
+        ThreadPoolExecutor(max_workers=1) as pool,
+    ):
+        raise pool.submit(make_error, source_id).result()
+
+    assert exc_info.value.source_map == {source_id: (source, None)}
+
+
+def test_registered_sources_are_added_to_diagnostics_created_outside_the_scope() -> (
+    None
+):
+    source_id = SourceId()
+    source = InMemorySource("pool\n")
+
+    with (
+        pytest.raises(DiagnosticError) as exc_info,
+        attach_diagnostic_source_code(source, source_id=source_id),
+        ThreadPoolExecutor(max_workers=1) as pool,
+    ):
+        raise pool.submit(make_error, source_id).result()
+
+    # The diagnostic keeps the source, once it is no longer registered
+    del source
+    gc.collect()
+    assert source_id not in source_registry
+    resolved = exc_info.value.get_source(source_id)
+    assert resolved is not None
+    assert resolved[0].read_span(SourceSpan(0, 4, source_id)).text.plain == "pool\n"
+
+
+def test_sources_are_added_to_diagnostics_which_resolve_them_from_the_registry() -> (
+    None
+):
+    source_id = SourceId()
+    source = InMemorySource("pool\n")
+    source_registry.register(source_id, source)
+
+    with (
+        pytest.raises(DiagnosticError) as exc_info,
+        AmbientSource(source, source_id=source_id),
+        ThreadPoolExecutor(max_workers=1) as pool,
+    ):
+        raise pool.submit(make_error, source_id).result()
+    source_registry.unregister(source_id)
+
+    assert exc_info.value.get_source(source_id) == (source, None)
+
+
+def test_registered_scopes_restore_the_registration_they_replace() -> None:
+    source_id = SourceId()
+    pinned, outer, inner = (
+        InMemorySource(f"{name}\n") for name in ("pinned", "outer", "inner")
+    )
+    source_registry.register(source_id, pinned, pin=True)
+
+    with AmbientSource(outer, source_id=source_id, registered=True):
+        with AmbientSource(inner, source_id=source_id, registered=True):
+            assert source_registry.get(source_id) == (inner, None)
+        assert source_registry.get(source_id) == (outer, None)
+    assert source_registry.get(source_id) == (pinned, None)
+
+    source_registry.unregister(source_id)
+    with AmbientSource(outer, source_id=source_id, registered=True):
+        pass
+    assert source_id not in source_registry
+
+
+def test_scopes_are_isolated_between_tasks() -> None:
+    async def check(index: int) -> DiagnosticError:
+        source_id = SourceId()
+        async with AmbientSource(
+            InMemorySource(f"task {index}\n"), source_id=source_id
+        ):
+            # Interleave the tasks, so that each enters its scope while the others
+            # are within theirs
+            await asyncio.sleep(0.01 * (3 - index))
+            return make_error(source_id)
+
+    async def main() -> list[DiagnosticError]:
+        return await asyncio.gather(*(check(index) for index in range(3)))
+
+    for index, error in enumerate(asyncio.run(main())):
+        assert f"1 │ task {index}" in error.to_plain_text()
+        assert error._source_scope is not None
+        assert error._source_scope.parent is None
@@ -0,0 +1,169 @@
+from dataclasses import dataclass
+from itertools import accumulate
+from pathlib import Path
+from typing import Self
+
+from conftest import make_error, render
+
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.plain import PlainReport
+from pyagnostics.protocols import SpanContents
+from pyagnostics.report import Report
+from pyagnostics.snippets import (
+    UNLIMITED,
+    OmittedLabels,
+    RenderLimits,
+    SnippetBlock,
+    chars_read,
+    snippet_blocks,
+)
+from pyagnostics.source import FileSource, InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+
+# Width the reports are rendered at
+WIDTH = 100
+# Bound on the lines of a report of a huge span or line
+MAX_OUTPUT_LINES = 50
+# Bound on the lines of a report of a block of dense labels, under the default
+# limits
+MAX_DENSE_OUTPUT_LINES = 400
+# Bound on the codepoints read of a huge line for a label on it
+MAX_CHARS_READ = 1_000
+
+
+def test_long_span_omits_lines() -> None:
+    text = "".join(f"line {i}\n" for i in range(50_000))
+    error = make_error(text, (text.index("line 10\n"), text.index("line 49990\n")))
+
+    output = render(Report(error), WIDTH)
+
+    assert "… 49974 lines omitted" in output
+    assert "11 │ line 10" in output
+    assert "49991 │ line 49990" in output
+    assert len(output.splitlines()) < MAX_OUTPUT_LINES
+    assert PlainReport(error, width=WIDTH).render() == output
+
+
+def test_long_line_is_cropped_around_labels() -> None:
+    text = "x" * 1_000_000 + "needle" + "x" * 1_000_000 + "\n"
+    start = text.index("needle")
+    error = make_error(text, (start, start + len("needle")))
+    limits = RenderLimits(label_columns=10)
+
+    output = render(Report(error, limits=limits), WIDTH)
+
+    assert f"1 │ …{'x' * 10}needle{'x' * 10}…" in output
+    assert "label 0" in output
+    assert len(output.splitlines()) < MAX_OUTPUT_LINES
+    assert PlainReport(error, width=WIDTH, limits=limits).render() == output
+
+
+# A source which only reads whole lines
+@dataclass
+class LineSource:
+    source: InMemorySource
+
+    def read_span(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> SpanContents:
+        return self.source.read_span(span, context_lines_before, context_lines_after)
+
+
+def test_long_line_is_only_read_around_labels() -> None:
+    text = "".join(
+        f"{'x' * 1_000_000}needle {i}{'x' * 1_000_000}\nshort {i}\n" for i in range(3)
+    )
+    starts = [text.index(f"needle {i}") for i in range(3)]
+    error = make_error(text, *((start, start + 8) for start in starts))
+    source_id = error.labels[0].source_id
+    whole_lines = DiagnosticError(code=error.code, labels=error.labels)
+    whole_lines.add_source(source_id, LineSource(InMemorySource(text)))
+    limits = RenderLimits(max_block_lines=6)
+
+    blocks = list(snippet_blocks(error, limits))
+
+    assert all(isinstance(block, SnippetBlock) for block in blocks)
+    assert (
+        sum(
+            chars_read(window)
+            for block in blocks
+            if isinstance(block, SnippetBlock)
+            for window in block.windows
+        )
+        < MAX_CHARS_READ
+    )
+    assert render(Report(error, limits=limits), WIDTH) == render(
+        Report(whole_lines, limits=limits), WIDTH
+    )
+    assert PlainReport(error, width=WIDTH, limits=limits).render() == (
+        PlainReport(whole_lines, width=WIDTH, limits=limits).render()
+    )
+
+
+def test_labels_beyond_report_lines_are_omitted() -> None:
+    text = "".join(f"line {i}\n" for i in range(1_000))
+    starts = [text.index(f"line {i}\n") for i in range(100, 1_000, 100)]
+    error = make_error(text, *((start, start + 4) for start in starts))
+    limits = RenderLimits(max_report_lines=14)
+
+    output = render(Report(error, limits=limits), WIDTH)
+
+    assert "label 1" in output
+    assert "label 2" not in output
+    assert "… 7 more labels omitted" in output
+    assert PlainReport(error, width=WIDTH, limits=limits).render() == output
+
+
+def test_omitted_labels_count_unresolved_sources_separately() -> None:
+    text = "".join(f"line {i}\n" for i in range(1_000))
+    starts = [text.index(f"line {i}\n") for i in range(100, 1_000, 100)]
+    error = make_error(text, *((start, start + 4) for start in starts))
+    unresolved = SourceId()
+    error.labels.extend(
+        LabeledSpan(SourceSpan(0, 4, unresolved), "unresolved") for _ in range(2)
+    )
+
+    blocks = list(snippet_blocks(error, RenderLimits(max_report_lines=14)))
+
+    assert blocks[-1] == OmittedLabels(7, 2)
+
+
+def test_limits_do_not_change_small_reports() -> None:
+    text = "".join(f"line {i}\n" for i in range(100))
+    error = make_error(text, (12, 80), (300, 310), (305, 320))
+
+    assert render(Report(error), WIDTH) == render(
+        Report(error, limits=UNLIMITED), WIDTH
+    )
+
+
+def test_dense_labels_are_omitted_in_the_middle_of_a_block(tmp_path: Path) -> None:
+    lines = [f"line {i}\n" for i in range(50_000)]
+    text = "".join(lines)
+    path = tmp_path / "source.txt"
+    path.write_text(text)
+    starts = list(accumulate(map(len, lines), initial=0))[:-1:5]
+    error = make_error(text, *((start, start + 4) for start in starts))
+    source_id = error.labels[0].source_id
+    error.source_map[source_id] = (FileSource(path), None)
+
+    output = render(Report(error), WIDTH)
+
+    assert "label 0" in output
+    assert "label 9999" in output
+    assert "lines omitted" in output
+    assert "more labels omitted" in output
+    assert len(output.splitlines()) < MAX_DENSE_OUTPUT_LINES
+    assert PlainReport(error, width=WIDTH).render() == output
+
+    max_report_lines = 40
+    limits = RenderLimits(max_block_lines=None, max_report_lines=max_report_lines)
+    output = render(error.with_limits(limits), WIDTH)
+
+    assert "label 0" in output
+    assert "label 9999" in output
+    assert sum(" │ " in line for line in output.splitlines()) <= max_report_lines
+    assert error.to_plain_text(width=WIDTH) == output
@@ -1,6 +1,24 @@
-from pyagnostics.source import InMemorySource
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Self
+
+import pytest
+
+from pyagnostics.protocols import MultiSpanSourceCode, SlicingSourceCode, SpanContents
+from pyagnostics.source import (
+    EditableSource,
+    FileSource,
+    InMemorySource,
+    read_spans,
+)
 from pyagnostics.spans import SourceId, SourceSpan
 
+MAX_EDITS = 2
+EDIT_COUNT = 5
+
 
 def test_read_span_with_context_lines() -> None:
     source = InMemorySource("aaa\n  bbb\nccc\n", name="example")
@@ -17,3 +35,243 @@ def test_read_span_with_context_lines() -> None:
     assert contents.column == expected_column
     assert contents.line_count == expected_line_count
     assert contents.name == "example"
+
+
+def test_read_span_on_line_boundaries() -> None:
+    source = InMemorySource("a\nbb\nccc\ndddd\n")
+    source_id = SourceId()
+    expected_line = 2
+
+    contents = source.read_span(SourceSpan(5, 8, source_id=source_id))
+
+    assert contents.text.plain == "bb\nccc\n"
+    assert contents.line == expected_line
+    assert contents.span == SourceSpan(2, 9, source_id=source_id)
+
+
+def test_offset_to_line_col_round_trips() -> None:
+    text = "aaa\r\n  bbb\nccc"
+    source = InMemorySource(text)
+
+    positions = [source.offset_to_line_col(offset) for offset in range(len(text) + 1)]
+
+    assert positions[0] == (1, 0)
+    assert positions[7] == (2, 2)
+    assert positions[-1] == (3, 3)
+    assert [source.line_col_to_offset(*position) for position in positions] == list(
+        range(len(text) + 1)
+    )
+
+
+def test_file_source_matches_in_memory_source(tmp_path: Path) -> None:
+    text = "first\n  sécond\r\nthird 漢字\nfourth\nfifth"
+    path = tmp_path / "source.txt"
+    path.write_bytes(text.encode())
+    in_memory = InMemorySource(text, name="source.txt")
+    file_source = FileSource(path, name="source.txt", chunk_size=4)
+    source_id = SourceId()
+
+    for start, end in [(0, 0), (8, 13), (20, 25), (18, 30), (33, 37)]:
+        span = SourceSpan(start, end, source_id=source_id)
+        expected = in_memory.read_span(span, 1, 1)
+        actual = file_source.read_span(span, 1, 1)
+
+        assert actual.text.plain == expected.text.plain
+        assert actual.span == expected.span
+        assert actual.line == expected.line
+        assert actual.column == expected.column
+        assert actual.line_count == expected.line_count
+        assert actual.name == expected.name
+
+
+# Every start and end, so empty spans at the start of a line and at the end of
+# the text are covered too
+@pytest.mark.parametrize(
+    "text", ["first\n  sécond\nthird 漢字\n\nfifth", "first\n\nthird\n"]
+)
+def test_read_slice_reads_exactly_the_span(tmp_path: Path, text: str) -> None:
+    path = tmp_path / "source.txt"
+    path.write_bytes(text.encode())
+    in_memory = InMemorySource(text)
+    sources: list[SlicingSourceCode] = [
+        in_memory,
+        EditableSource(text),
+        FileSource(path, chunk_size=4),
+    ]
+    source_id = SourceId()
+
+    for start in range(len(text) + 1):
+        for end in range(start, len(text) + 1):
+            span = SourceSpan(start, end, source_id=source_id)
+            read = in_memory.read_span(span)
+            window = in_memory.read_span(span, 1, 1).span
+            lines = in_memory.line_spans(span, 1, 1)
+            assert (lines[0].start, lines[-1].end) == (window.start, window.end)
+            for source in sources:
+                contents = source.read_slice(span)
+
+                assert contents.text.plain == text[start:end]
+                assert (contents.line, contents.column) == (read.line, read.column)
+                assert source.line_spans(span, 1, 1) == in_memory.line_spans(span, 1, 1)
+
+
+def test_file_source_indexes_lazily(tmp_path: Path) -> None:
+    path = tmp_path / "large.txt"
+    path.write_text("line\n" * 100_000)
+    source = FileSource(path, chunk_size=64)
+    source_id = SourceId()
+
+    contents = source.read_span(SourceSpan(11, 13, source_id=source_id), 0, 1)
+
+    assert contents.text.plain == "line\nline\n"
+    assert source._byte_offsets[-1] < len("line\n") * 100
+
+
+def test_file_source_reads_while_closed(tmp_path: Path) -> None:
+    lines = 10_000
+    path = tmp_path / "large.txt"
+    path.write_text("".join(f"{i:06}\n" for i in range(lines)))
+    source = FileSource(path, chunk_size=64)
+    source_id = SourceId()
+
+    def read(line: int) -> str:
+        if line % 4 == 0:
+            source.close()
+        span = SourceSpan(line * 7 + 1, line * 7 + 3, source_id=source_id)
+        return source.read_span(span).text.plain + source.read_slice(span).text.plain
+
+    # Switch threads as often as possible, so that reads interleave with closing
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(4) as pool:
+            read_lines = list(pool.map(read, range(0, lines, 7)))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert read_lines == [
+        f"{line:06}\n" + f"{line:06}"[1:3] for line in range(0, lines, 7)
+    ]
+
+
+def test_file_source_indexes_in_chunks(tmp_path: Path) -> None:
+    lines = 100_000
+    path = tmp_path / "large.txt"
+    path.write_text("".join(f"{i:06}\n" for i in range(lines)))
+    source_id = SourceId()
+
+    with FileSource(path, chunk_size=64) as source, ThreadPoolExecutor(4) as pool:
+        contents = list(
+            pool.map(
+                lambda line: source.read_span(
+                    SourceSpan(line * 7 + 1, line * 7 + 3, source_id=source_id)
+                ),
+                range(0, lines, lines // 8),
+            )
+        )
+
+    assert [int(window.text.plain) for window in contents] == list(
+        range(0, lines, lines // 8)
+    )
+    assert [window.line for window in contents] == [
+        line + 1 for line in range(0, lines, lines // 8)
+    ]
+
+    # Closing releases the map of the file, so its new contents are read
+    path.write_text("changed\n")
+    assert source.read_span(SourceSpan(1, 2, source_id)).text.plain == "changed\n"
+
+
+@dataclass
+class SingleSpanSource:
+    inner: InMemorySource
+
+    def read_span(
+        self: Self,
+        span: SourceSpan,
+        context_lines_before: int = 0,
+        context_lines_after: int = 0,
+    ) -> SpanContents:
+        return self.inner.read_span(span, context_lines_before, context_lines_after)
+
+
+def test_read_spans_matches_fallback() -> None:
+    text = "".join(f"line {i}\n" for i in range(30))
+    source = InMemorySource(text)
+    source_id = SourceId()
+    spans = [
+        SourceSpan(start, end, source_id=source_id)
+        for start, end in [(100, 104), (3, 5), (20, 21), (150, 190), (60, 60)]
+    ]
+
+    native = read_spans(source, spans, 2, 2)
+    fallback = read_spans(SingleSpanSource(source), spans, 2, 2)
+
+    assert isinstance(source, MultiSpanSourceCode)
+    assert not isinstance(SingleSpanSource(source), MultiSpanSourceCode)
+    assert [contents.span for contents in native] == [
+        contents.span for contents in fallback
+    ]
+    assert [contents.text.plain for contents in native] == [
+        contents.text.plain for contents in fallback
+    ]
+
+
+def test_editable_source_matches_in_memory_source() -> None:
+    source_id = SourceId()
+    rng = random.Random(0)
+    source = EditableSource("first\nsecond\r\nthird\n", name="edited", max_pieces=8)
+    text = source.text
+    for _ in range(200):
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, min(len(text), start + 5))
+        inserted = rng.choice(["", "x", "\n", "\r", "ab\ncd", "\r\n"])
+        source.replace(start, end, inserted)
+        text = text[:start] + inserted + text[end:]
+
+        assert source.text == text
+        assert len(source._pieces) <= source.max_pieces
+        expected = InMemorySource(text, name="edited")
+        spans = [
+            SourceSpan(offset, offset + 1, source_id) for offset in (0, len(text) // 2)
+        ]
+        if len(text) > 1:
+            assert source.read_spans(spans, 1, 1) == expected.read_spans(spans, 1, 1)
+
+
+def test_editable_source_remaps_spans() -> None:
+    source_id = SourceId()
+    source = EditableSource("let x = 1;\nlet y = x;\n")
+    version = source.version
+    span = SourceSpan(15, 16, source_id)
+
+    source.insert(0, "// comment\n")
+    source.replace(15, 16, "value")
+
+    assert source.version == version + 2
+    remapped = source.remap_span(span, version)
+    assert remapped == SourceSpan(30, 31, source_id)
+    assert source.text[remapped.start : remapped.end] == "y"
+    assert source.remap_span(SourceSpan(4, 5, source_id), version) == SourceSpan(
+        15, 20, source_id
+    )
+    assert source.remap_span(SourceSpan(0, 3, source_id), source.version) == (
+        SourceSpan(0, 3, source_id)
+    )
+    source.delete(0, 11)
+    assert source.remap_span(SourceSpan(0, 3, source_id), version + 2) is None
+
+
+def test_editable_source_discards_old_edits() -> None:
+    source_id = SourceId()
+    source = EditableSource("abc\n", max_edits=MAX_EDITS)
+    for _ in range(EDIT_COUNT):
+        source.insert(0, "x")
+
+    assert source.version == EDIT_COUNT
+    assert MAX_EDITS <= len(source.edits) < 2 * MAX_EDITS
+    assert source.remap_span(SourceSpan(0, 1, source_id), source.version - 2) == (
+        SourceSpan(2, 3, source_id)
+    )
+    with pytest.raises(ValueError, match="discarded"):
+        source.remap_span(SourceSpan(0, 1, source_id), 0)
@@ -1,4 +1,18 @@
-from pyagnostics.spans import SourceId
+import random
+
+import pytest
+
+from pyagnostics.spans import (
+    Edit,
+    LabeledSpan,
+    SourceId,
+    SourceSpan,
+    SpanSet,
+    SpanTable,
+    Utf8Index,
+    remap_labeled_span,
+    remap_span,
+)
 
 
 def test_source_id_is_unique() -> None:
@@ -12,3 +26,132 @@ def test_source_id_from_value() -> None:
     expected_value = 42
     source_id = SourceId.unsafe_from_value(expected_value)
     assert source_id.value == expected_value
+
+
+def test_span_table_union_matches_source_span_union() -> None:
+    rng = random.Random(0)
+    source_id = SourceId()
+    spans = []
+    for _ in range(200):
+        start = rng.randrange(1000)
+        spans.append(SourceSpan(start, start + rng.randint(0, 20), source_id))
+    table = SpanTable.from_spans(spans)
+
+    assert list(table) == spans
+    assert list(table.union()) == SourceSpan.union(spans)
+    assert table.union()[0].source_id is source_id
+
+
+def test_span_set_matches_source_span_union() -> None:
+    rng = random.Random(0)
+    source_ids = [SourceId(), SourceId()]
+    spans = []
+    for _ in range(200):
+        start = rng.randrange(1000)
+        spans.append(
+            SourceSpan(start, start + rng.randint(0, 20), rng.choice(source_ids))
+        )
+    span_set = SpanSet()
+    for span in spans:
+        span_set.add(span)
+
+    expected = {
+        source_id: SourceSpan.union(
+            [span for span in spans if span.source_id == source_id]
+        )
+        for source_id in span_set.source_ids
+    }
+    assert set(expected) == set(source_ids)
+    assert list(span_set) == [span for merged in expected.values() for span in merged]
+    assert len(span_set) == sum(len(merged) for merged in expected.values())
+    assert list(SpanSet.from_spans(spans)) == list(span_set)
+
+
+def test_span_set_queries() -> None:
+    source_id, other_source_id = SourceId(), SourceId()
+    span_set = SpanSet.from_spans(
+        [SourceSpan(0, 5, source_id), SourceSpan(10, 15, source_id)]
+    )
+    span_set.add(SourceSpan(3, 12, other_source_id))
+
+    assert span_set.overlapping(SourceSpan(5, 10, source_id)) == []
+    assert span_set.overlapping(SourceSpan(4, 11, source_id)) == [
+        SourceSpan(0, 5, source_id),
+        SourceSpan(10, 15, source_id),
+    ]
+    assert span_set.contains(SourceSpan(11, 15, source_id))
+    assert not span_set.contains(SourceSpan(4, 11, source_id))
+    assert not span_set.contains(SourceSpan(0, 1, SourceId()))
+
+    span_set.add(SourceSpan(5, 10, source_id))
+    assert span_set.spans(source_id) == [SourceSpan(0, 15, source_id)]
+    assert span_set.contains(SourceSpan(4, 11, source_id))
+
+
+def test_span_table_queries() -> None:
+    source_id, other_source_id = SourceId(), SourceId()
+    table = SpanTable()
+    table.append(0, 5, source_id)
+    table.append(10, 15, source_id)
+    table.append(3, 12, other_source_id)
+    table.append(4, 11, source_id)
+
+    assert table[1] == SourceSpan(10, 15, source_id)
+    assert table.enclose(0, 1) == SourceSpan(0, 15, source_id)
+    assert table.overlapping(SourceSpan(5, 10, source_id)) == [3]
+    assert table.overlapping(SourceSpan(4, 11, source_id)) == [0, 1, 3]
+
+    table.append(1, 2, source_id)
+
+    assert table.overlapping(SourceSpan(0, 4, source_id)) == [0, 4]
+    with pytest.raises(ValueError, match="different sources"):
+        table.union()
+    with pytest.raises(ValueError, match="different sources"):
+        table.enclose(0, 2)
+
+
+def test_remap_span() -> None:
+    source_id = SourceId()
+    span = SourceSpan(10, 20, source_id)
+
+    # Before, after, and within the span
+    assert remap_span(span, Edit(20, 25, 2)) == span
+    assert remap_span(span, Edit(0, 5, 0)) == SourceSpan(5, 15, source_id)
+    assert remap_span(span, Edit(12, 14, 5)) == SourceSpan(10, 23, source_id)
+    # Overlapping the start or the end of the span
+    assert remap_span(span, Edit(5, 15, 1)) == SourceSpan(6, 11, source_id)
+    assert remap_span(span, Edit(15, 25, 1)) == SourceSpan(10, 15, source_id)
+    # Replacing all of the span
+    assert remap_span(span, Edit(5, 25, 3)) is None
+
+    labeled_span = LabeledSpan(span, "label")
+    assert remap_labeled_span(labeled_span, Edit(0, 0, 3)) == LabeledSpan(
+        SourceSpan(13, 23, source_id), "label"
+    )
+
+
+@pytest.mark.parametrize("interval", [1, 3, 128])
+def test_utf8_index_matches_encoding(interval: int) -> None:
+    text = "ascii, é, € and 😀\n" * 20
+    index = Utf8Index(text, interval=interval)
+    for offset in range(len(text) + 1):
+        byte_offset = len(text[:offset].encode())
+        assert index.to_byte_offset(offset) == byte_offset
+        assert index.to_char_offset(byte_offset) == offset
+
+
+def test_source_span_from_byte_range() -> None:
+    source_id = SourceId()
+    text = "let café = '😀';"
+    index = Utf8Index(text)
+    data = text.encode()
+    start = data.index("😀".encode())
+
+    span = SourceSpan.from_byte_range(start, start + 4, source_id, index)
+
+    assert text[span.start : span.end] == "😀"
+    assert span.byte_range(index) == (start, start + 4)
+    with pytest.raises(ValueError, match="within a UTF-8 sequence"):
+        SourceSpan.from_byte_range(start + 1, start + 4, source_id, index)
+    with pytest.raises(ValueError, match="out of bounds"):
+        index.to_char_offset(len(data) + 1)
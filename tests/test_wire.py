@@ -0,0 +1,148 @@
+import pickle
+
+import pytest
+from conftest import make_error, render
+
+from pyagnostics.exceptions import DiagnosticError
+from pyagnostics.frames import FrameMatcher
+from pyagnostics.severity import Severity
+from pyagnostics.source import InMemorySource
+from pyagnostics.spans import LabeledSpan, SourceId, SourceSpan
+from pyagnostics.wire import from_wire, to_wire
+
+# Bound on the size sent of a diagnostic with a label on a huge line
+MAX_WIRE_BYTES = 10_000
+
+
+def fail_inner() -> None:
+    raise ValueError("inner")
+
+
+def fail_cause() -> None:
+    try:
+        fail_inner()
+    except ValueError as e:
+        raise DiagnosticError(
+            code="test::cause", message="the cause", context=["parsing"]
+        ) from e
+
+
+def fail() -> None:
+    source_id = SourceId()
+    source = InMemorySource(
+        "".join(f"line {i:02}\n" for i in range(30)), name="source.txt"
+    )
+    try:
+        fail_cause()
+    except DiagnosticError as e:
+        raise DiagnosticError(
+            severity=Severity.WARNING,
+            code="test::wire",
+            message="[bold]crossed[/bold] processes",
+            labels=[
+                LabeledSpan(SourceSpan(8, 12, source_id), "first"),
+                LabeledSpan(SourceSpan(81, 85, source_id), "second"),
+                LabeledSpan(SourceSpan(200, 204, source_id), "far away"),
+            ],
+            notes=["a note"],
+        ).add_source(source_id, source) from e
+
+
+def fail_in_handler() -> None:
+    try:
+        raise_key_error()
+    except KeyError:
+        raise DiagnosticError(code="test::context")
+
+
+def raise_key_error() -> None:
+    raise KeyError("missing")
+
+
+def recurse(level: int) -> None:
+    if level == 0:
+        raise DiagnosticError(code="test::recursion")
+    recurse(level - 1)
+
+
+def test_round_trip_renders_the_same() -> None:
+    try:
+        fail()
+    except DiagnosticError as e:
+        error = e
+
+    received = from_wire(to_wire(error))
+
+    assert render(received, styled=True) == render(error, styled=True)
+    assert received.to_plain_text() == error.to_plain_text()
+
+
+def test_round_trip_keeps_context_chain() -> None:
+    try:
+        fail_in_handler()
+    except DiagnosticError as e:
+        error = e
+
+    received = from_wire(to_wire(error))
+
+    assert received.__cause__ is None
+    assert type(received.__context__).__name__ == "KeyError"
+    assert render(received, styled=True) == render(error, styled=True)
+
+
+def test_round_trip_keeps_folded_frames() -> None:
+    try:
+        recurse(20)
+    except DiagnosticError as e:
+        error = e
+
+    received = from_wire(to_wire(error))
+
+    assert render(received, styled=True) == render(error, styled=True)
+    assert "[Previous frame repeated 17 more times]" in received.to_plain_text()
+
+
+def test_round_trip_gives_sources_fresh_ids() -> None:
+    try:
+        fail()
+    except DiagnosticError as e:
+        error = e
+
+    received = from_wire(to_wire(error))
+
+    sent_ids = {label.source_id for label in error.labels}
+    received_ids = {label.source_id for label in received.labels}
+    assert len(received_ids) == len(sent_ids)
+    assert received_ids.isdisjoint(sent_ids)
+    assert all(received.get_source(source_id) for source_id in received_ids)
+
+
+def test_round_trip_sends_only_the_columns_shown() -> None:
+    text = f"{'x' * 1_000_000}needle{'x' * 1_000_000}\nshort\n"
+    start = text.index("needle")
+    error = make_error(text, (start, start + 6), (len(text) - 6, len(text) - 1))
+
+    data = to_wire(error)
+
+    assert len(data) < MAX_WIRE_BYTES
+    assert render(from_wire(data), styled=True) == render(error, styled=True)
+
+
+def test_to_wire_leaves_out_suppressed_frames(monkeypatch: pytest.MonkeyPatch) -> None:
+    try:
+        fail()
+    except DiagnosticError as e:
+        error = e
+    monkeypatch.setattr(
+        "pyagnostics.wire._suppressed_frames", FrameMatcher(modules=[__name__])
+    )
+
+    received = from_wire(to_wire(error))
+
+    assert "fail_cause" in error.to_plain_text()
+    assert "fail_cause" not in received.to_plain_text()
+
+
+def test_from_wire_refuses_other_types() -> None:
+    with pytest.raises(pickle.UnpicklingError):
+        from_wire(pickle.dumps((1, SourceId())))